@@ -34,7 +34,7 @@ TEMPLATE = """
 ##    i.e. volcanic eruption, or earthquake, and check timeseriesStepModel.h5 afterward for their estimation.
 ## excludeDate       - Dates excluded for error estimation only
 ## pixelwiseGeometry - Use pixel-wise geometry info, such as incidence angle and slant range distance for error estimation
-##    yes - use pixel-wise geometry when they are available [slow; used by default]
+##    yes - use pixel-wise geometry when they are available [used by default]
 ##    no  - use mean geometry [fast]
 mintpy.topographicResidual                   = auto  #[yes / no], auto for yes
 mintpy.topographicResidual.polyOrder         = auto  #[1-inf], auto for 2, poly order of temporal deformation model
@@ -45,7 +45,7 @@ mintpy.topographicResidual.pixelwiseGeometry = auto  #[yes / no], auto for yes,
 """
 
 EXAMPLE = """example:
-  # correct DEM error with pixel-wise geometry parameters [slow]
+  # correct DEM error with pixel-wise geometry parameters
   dem_error.py  timeseries_ERA5_ramp.h5 -g inputs/geometryRadar.h5 -t smallbaselineApp.cfg
 
   # correct DEM error with mean geometry parameters [fast]
@@ -98,6 +98,8 @@ def create_parser():
                              '1) output timeseries file already exists, readable '+
                              'and newer than input interferograms file\n' +
                              '2) all configuration parameters are the same.')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use per block, e.g. 8GB, 512MB, or number in GB (default: %(default)s).')
     return parser
 
 
@@ -180,6 +182,10 @@ def read_template2inps(template_file, inps=None):
                 inpsDict[key] = int(value)
             elif key in ['excludeDate','stepFuncDate']:
                 inpsDict[key] = ptime.yyyymmdd(value.replace(',', ' ').split())
+
+    key = 'mintpy.compute.maxMemory'
+    if template.get(key, None):
+        inpsDict['maxMemory'] = template[key]
     return inps
 
 
@@ -213,7 +219,7 @@ def design_matrix4deformation(inps):
     msg = 'ordinal least squares (OLS) inversion with L2-norm minimization on: phase'
     if inps.phaseVelocity:
         msg += ' velocity'
-    if inps.rangeDist.size != 1:
+    if inps.geom_file:
         msg += ' (pixel-wisely)'
     print(msg)
 
@@ -238,40 +244,53 @@ def design_matrix4deformation(inps):
     return A_def
 
 
-def read_geometry(inps):
-    ts_obj = timeseries(inps.timeseries_file)
+def read_geometry(ts_file, geom_file=None, box=None, print_msg=True):
+    """Read the geometry info for the area of interest
+    Parameters: ts_file   : str, path of time-series file
+                geom_file : str, path of geometry file
+                box       : tuple of 4 int for (x0, y0, x1, y1) of the area of interest
+    Returns:    sin_inc_angle : 0/1D np.array in size of (num_pixel,), sine of the incidence angle
+                range_dist    : 0/1D np.array in size of (num_pixel,), slant range distance
+                pbase         : 2D np.array in size of (num_date, 1 / num_pixel), perpendicular baseline
+    """
+    ts_obj = timeseries(ts_file)
     ts_obj.open(print_msg=False)
 
     # 2D / 3D geometry
-    if inps.geom_file:
-        geom_obj = geometry(inps.geom_file)
-        geom_obj.open()
+    if geom_file:
+        geom_obj = geometry(geom_file)
+        geom_obj.open(print_msg=False)
         if 'incidenceAngle' not in geom_obj.datasetNames:
-            inps.incAngle = ut.incidence_angle(ts_obj.metadata, dimension=0)
-            inps.rangeDist = ut.range_distance(ts_obj.metadata, dimension=0)
+            inc_angle = ut.incidence_angle(ts_obj.metadata, dimension=0)
+            range_dist = ut.range_distance(ts_obj.metadata, dimension=0)
         else:
-            print(('read 2D incidenceAngle,slantRangeDistance from {} file:'
-                   ' {}').format(geom_obj.name, os.path.basename(geom_obj.file)))
-            inps.incAngle = geom_obj.read(datasetName='incidenceAngle', print_msg=False).flatten()
-            inps.rangeDist = geom_obj.read(datasetName='slantRangeDistance', print_msg=False).flatten()
+            if print_msg:
+                print(('read 2D incidenceAngle,slantRangeDistance from {} file:'
+                       ' {}').format(geom_obj.name, os.path.basename(geom_obj.file)))
+            inc_angle  = geom_obj.read(datasetName='incidenceAngle', box=box, print_msg=False).flatten()
+            range_dist = geom_obj.read(datasetName='slantRangeDistance', box=box, print_msg=False).flatten()
         if 'bperp' in geom_obj.datasetNames:
-            print('read 3D bperp from {} file: {} ...'.format(geom_obj.name, os.path.basename(geom_obj.file)))
+            if print_msg:
+                print('read 3D bperp from {} file: {} ...'.format(geom_obj.name, os.path.basename(geom_obj.file)))
             dset_list = ['bperp-{}'.format(d) for d in ts_obj.dateList]
-            inps.pbase = geom_obj.read(datasetName=dset_list, print_msg=False).reshape((ts_obj.numDate, -1))
-            inps.pbase -= np.tile(inps.pbase[ts_obj.refIndex, :].reshape(1, -1), (ts_obj.numDate, 1))
+            pbase = geom_obj.read(datasetName=dset_list, box=box, print_msg=False).reshape((ts_obj.numDate, -1))
+            pbase -= np.tile(pbase[ts_obj.refIndex, :].reshape(1, -1), (ts_obj.numDate, 1))
         else:
-            print('read mean bperp from {} file'.format(ts_obj.name))
-            inps.pbase = ts_obj.pbase.reshape((-1, 1))
+            if print_msg:
+                print('read mean bperp from {} file'.format(ts_obj.name))
+            pbase = ts_obj.pbase.reshape((-1, 1))
 
     # 0D geometry
     else:
-        print('read mean incidenceAngle,slantRangeDistance,bperp value from {} file'.format(ts_obj.name))
-        inps.incAngle = ut.incidence_angle(ts_obj.metadata, dimension=0)
-        inps.rangeDist = ut.range_distance(ts_obj.metadata, dimension=0)
-        inps.pbase = ts_obj.pbase.reshape((-1, 1))
+        if print_msg:
+            print('read mean incidenceAngle,slantRangeDistance,bperp value from {} file'.format(ts_obj.name))
+        inc_angle = ut.incidence_angle(ts_obj.metadata, dimension=0)
+        range_dist = ut.range_distance(ts_obj.metadata, dimension=0)
+        pbase = ts_obj.pbase.reshape((-1, 1))
 
-    inps.sinIncAngle = np.sin(inps.incAngle * np.pi / 180.)
-    return inps
+    sin_inc_angle = np.sin(np.array(inc_angle) * np.pi / 180.)
+    range_dist = np.array(range_dist)
+    return sin_inc_angle, range_dist, pbase
 
 
 def estimate_dem_error(ts0, A0, tbase, drop_date=None, phaseVelocity=False, num_step=0):
@@ -333,114 +352,213 @@ def estimate_dem_error(ts0, A0, tbase, drop_date=None, phaseVelocity=False, num_
     return delta_z, ts_cor, ts_res, step_def
 
 
-def correct_dem_error(inps, A_def):
-    """Correct DEM error of input timeseries file"""
-    # Read Date Info
-    ts_obj = timeseries(inps.timeseries_file)
-    ts_obj.open()
+def estimate_dem_error_batch(ts0, A_geom, A_def, tbase, drop_date=None, phaseVelocity=False, num_step=0):
+    """Estimate DEM error with least square optimization for pixels with different geometry at once,
+    by solving the batched normal equations of the per-pixel design matrix [A_geom[:, i], A_def].
+
+    Parameters: ts0    : 2D np.array in size of (numDate, numPixel), original displacement time-series
+                A_geom : 2D np.array in size of (numDate, numPixel), design matrix for DEM error,
+                         i.e. pbase / (rangeDist * sinIncAngle) for each pixel
+                A_def  : 2D np.array in size of (numDate, model_num), design matrix of deformation model
+                tbase  : 2D np.array in size of (numDate, 1), temporal baseline
+                drop_date : 1D np.array in bool data type, mark the date used in the estimation
+                phaseVelocity : bool, use phase history or phase velocity for minimization
+    Returns:    same as estimate_dem_error()
+    Example:    delta_z, ts_cor, ts_res, step_def = estimate_dem_error_batch(ts, A_geom, A_def, tbase, drop_date)
+    """
+    if drop_date is None:
+        drop_date = np.ones(ts0.shape[0], np.bool_)
+
+    # Prepare Design matrix and observations for inversion
+    G = np.array(A_geom[drop_date, :], np.float64)
+    D = np.array(A_def[drop_date, :], np.float64)
+    ts = np.array(ts0[drop_date, :], np.float64)
+    if phaseVelocity:
+        dt = np.diff(tbase[drop_date, :], axis=0)
+        G = np.diff(G, axis=0) / dt
+        D = np.diff(D, axis=0) / dt
+        ts = np.diff(ts, axis=0) / dt
+
+    # normalize the DEM error column to keep the normal matrix well conditioned
+    num_pixel = ts.shape[1]
+    num_param = D.shape[1] + 1
+    G_norm = np.sqrt(np.sum(G**2, axis=0))
+    G_norm[G_norm == 0] = 1.
+    G /= G_norm
+
+    # normal equations: N * X = A^T * ts, in size of (numPixel, model_num+1, model_num+1)
+    N = np.zeros((num_pixel, num_param, num_param), np.float64)
+    N[:, 0, 0] = np.sum(G**2, axis=0)
+    N[:, 0, 1:] = np.dot(G.T, D)
+    N[:, 1:, 0] = N[:, 0, 1:]
+    N[:, 1:, 1:] = np.dot(D.T, D)
+    rhs = np.hstack((np.sum(G * ts, axis=0).reshape(-1, 1), np.dot(ts.T, D)))
+    try:
+        X = np.linalg.solve(N, rhs[:, :, np.newaxis])[:, :, 0].T
+    except np.linalg.LinAlgError:
+        X = np.matmul(np.linalg.pinv(N), rhs[:, :, np.newaxis])[:, :, 0].T
+    X[0, :] /= G_norm
+    del N, rhs, G, D, ts
+
+    # Prepare Outputs
+    delta_z = X[0, :]
+    ts_cor = ts0 - A_geom * delta_z.reshape(1, -1)
+    ts_res = ts_cor - np.dot(A_def, X[1:, :])
+
+    step_def = None
+    if num_step > 0:
+        step_def = X[-1*num_step:, :].reshape(num_step, -1)
+    return delta_z, ts_cor, ts_res, step_def
+
+
+def split2boxes(ts_file, geom_file=None, max_memory=4, print_msg=True):
+    """Split into chunks in rows to reduce memory usage
+    Parameters: ts_file    : str, path of time-series file
+                geom_file  : str, path of geometry file, with 3D bperp or not
+                max_memory : str / float, max memory to use in GB
+    Returns:    box_list   : list of tuple of 4 int in (x0, y0, x1, y1)
+    """
+    ts_obj = timeseries(ts_file)
+    ts_obj.open(print_msg=False)
     num_date = ts_obj.numDate
-    num_pixel = ts_obj.numPixel
-    tbase = np.array(ts_obj.tbase, np.float32) / 365.25
 
+    # memory usage per pixel: input time-series, corrected / residual time-series,
+    # float64 copies and the perpendicular baseline during the inversion
+    array_list = [(np.float32, num_date),
+                  (np.float32, num_date),
+                  (np.float32, num_date),
+                  (np.float64, num_date),
+                  (np.float64, num_date)]
+    if geom_file and 'bperp' in readfile.get_dataset_list(geom_file):
+        array_list += [(np.float32, num_date), (np.float64, num_date)]
+
+    box_list = ut.split_box2blocks((ts_obj.length, ts_obj.width),
+                                   array_list=array_list,
+                                   max_memory=max_memory,
+                                   chunk_shape=ut.get_chunk_shape(ts_file, 'timeseries'),
+                                   print_msg=print_msg)
+    return box_list
+
+
+def correct_dem_error_patch(inps, A_def, box=None, print_msg=True):
+    """Correct DEM error of input timeseries file within the area of interest
+    Parameters: inps  : Namespace with input options
+                A_def : 2D np.array in size of (numDate, model_num), design matrix of deformation model
+                box   : tuple of 4 int for (x0, y0, x1, y1) of the area of interest
+    Returns:    delta_z    : 2D np.array in size of (length, width), estimated DEM error
+                ts_cor     : 3D np.array in size of (numDate, length, width), corrected time-series
+                ts_res     : 3D np.array in size of (numDate, length, width), residual time-series
+                step_model : 3D np.array in size of (numStep, length, width), estimated step model
+    """
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open(print_msg=False)
+    if box is None:
+        box = (0, 0, ts_obj.width, ts_obj.length)
+    num_date = ts_obj.numDate
     num_step = len(inps.stepFuncDate)
-    drop_date, inps.excludeDate = read_exclude_date(inps.excludeDate, ts_obj.dateList)
-    if inps.polyOrder > np.sum(drop_date):
-        raise ValueError(("input poly order {} > number of acquisition {}!"
-                          " Reduce it!").format(inps.polyOrder, np.sum(drop_date)))
-
-    # Read time-series Data
-    ts_data = ts_obj.read(print_msg=True).reshape((num_date, -1))
+    box_wid = box[2] - box[0]
+    box_len = box[3] - box[1]
+    num_pixel = box_len * box_wid
+    tbase = np.array(ts_obj.tbase, np.float32).reshape(-1, 1) / 365.25
+    drop_date = read_exclude_date(inps.excludeDate, ts_obj.dateList, print_msg=False)[0]
+
+    # Read time-series data and geometry
+    ts_data = ts_obj.read(box=box, print_msg=False).reshape((num_date, -1))
+    sin_inc_angle, range_dist, pbase = read_geometry(inps.timeseries_file,
+                                                     geom_file=inps.geom_file,
+                                                     box=box,
+                                                     print_msg=print_msg)
 
-    ##-------------------------------- Loop for L2-norm inversion  --------------------------------##
-    print('inverting DEM error ...')
     delta_z = np.zeros(num_pixel, dtype=np.float32)
     ts_cor = np.zeros((num_date, num_pixel), dtype=np.float32)
     ts_res = np.zeros((num_date, num_pixel), dtype=np.float32)
-    if num_step > 0:
-        step_model = np.zeros((num_step, num_pixel), dtype=np.float32)
+    step_model = np.zeros((num_step, num_pixel), dtype=np.float32)
 
     # initiate mask based on time-series
-    print('skip pixels with ZERO in ALL acquisitions')
+    if print_msg:
+        print('skip pixels with ZERO in ALL acquisitions')
     mask = np.nanmean(ts_data, axis=0) != 0.
-    print('skip pixels with NaN  in ANY acquisitions')
+    if print_msg:
+        print('skip pixels with NaN  in ANY acquisitions')
     mask *= np.sum(np.isnan(ts_data), axis=0) == 0
 
-    if inps.rangeDist.size == 1:
-        A_geom = inps.pbase / (inps.rangeDist * inps.sinIncAngle)
-        A = np.hstack((A_geom, A_def))
-
-        ts_data = ts_data[:, mask]
-        (delta_z_i,
-         ts_cor_i,
-         ts_res_i,
-         step_model_i) = estimate_dem_error(ts_data, A,
-                                            tbase=tbase,
-                                            drop_date=drop_date,
-                                            phaseVelocity=inps.phaseVelocity,
-                                            num_step=num_step)
-        delta_z[mask] = delta_z_i
-        ts_cor[:, mask] = ts_cor_i
-        ts_res[:, mask] = ts_res_i
-        if num_step > 0:
-            step_model[:, mask] = step_model_i
-    else:
-        # update mask based on geometry
-        print('skip pixels with ZERO / NaN value in incidenceAngle / slantRangeDistance')
-        for geom_data in [inps.sinIncAngle, inps.rangeDist]:
-            mask *= geom_data != 0.
-            mask *= ~np.isnan(geom_data)
-
-        num_pixel2inv = np.sum(mask)
-        idx_pixel2inv = np.where(mask)[0]
-        print(('number of pixels to invert: {} out of {}'
-               ' ({:.1f}%)').format(num_pixel2inv,
-                                    num_pixel,
-                                    num_pixel2inv/num_pixel*100))
-
+    # update mask based on geometry
+    if range_dist.size != 1 or pbase.shape[1] != 1:
+        if print_msg:
+            print('skip pixels with ZERO / NaN value in incidenceAngle / slantRangeDistance')
+        for geom_data in [sin_inc_angle, range_dist]:
+            if geom_data.size != 1:
+                mask *= geom_data != 0.
+                mask *= ~np.isnan(geom_data)
+        if pbase.shape[1] != 1:
+            mask *= np.sum(np.isnan(pbase), axis=0) == 0
+
+    num_pixel2inv = int(np.sum(mask))
+    print(('number of pixels to invert: {} out of {}'
+           ' ({:.1f}%)').format(num_pixel2inv, num_pixel, num_pixel2inv/num_pixel*100))
+    if num_pixel2inv > 0:
         # update data matrix to save memory and IO
         ts_data = ts_data[:, mask]
-        inps.rangeDist = inps.rangeDist[mask]
-        inps.sinIncAngle = inps.sinIncAngle[mask]
-        if inps.pbase.shape[1] != 1:
-            inps.pbase = inps.pbase[:, mask]
-
-        # loop pixel by pixel
-        prog_bar = ptime.progressBar(maxValue=num_pixel2inv)
-        for i in range(num_pixel2inv):
-            prog_bar.update(i+1, every=2000, suffix='{}/{}'.format(i+1, num_pixel2inv))
-            idx = idx_pixel2inv[i]
-
-            # design matrix
-            if inps.pbase.shape[1] == 1:
-                pbase = inps.pbase
-            else:
-                pbase = inps.pbase[:, i].reshape(-1, 1)
-            A_geom = pbase / (inps.rangeDist[i] * inps.sinIncAngle[i])
-            A = np.hstack((A_geom, A_def))
-
+        if sin_inc_angle.size != 1:
+            sin_inc_angle = sin_inc_angle[mask]
+        if range_dist.size != 1:
+            range_dist = range_dist[mask]
+
+        if pbase.shape[1] == 1:
+            # same bperp time-series for all pixels: the per-pixel geometry only scales the
+            # 1st column of the design matrix, thus solve all pixels at once with bperp alone
+            A = np.hstack((pbase, A_def))
             (delta_z_i,
              ts_cor_i,
              ts_res_i,
-             step_model_i) = estimate_dem_error(ts_data[:, i], A,
+             step_model_i) = estimate_dem_error(ts_data, A,
                                                 tbase=tbase,
                                                 drop_date=drop_date,
                                                 phaseVelocity=inps.phaseVelocity,
                                                 num_step=num_step)
-            delta_z[idx:idx+1] = delta_z_i
-            ts_cor[:, idx:idx+1] = ts_cor_i
-            ts_res[:, idx:idx+1] = ts_res_i
-            if num_step > 0:
-                step_model[:, idx:idx+1] = step_model_i
-        prog_bar.close()
-    del ts_data
-
-    ##---------------------------------------- Output  -----------------------------------------##
+            delta_z_i *= (range_dist * sin_inc_angle)
+
+        else:
+            # 3D bperp: one design matrix per pixel, solved in one batched call
+            A_geom = pbase[:, mask] / (range_dist * sin_inc_angle).reshape(1, -1)
+            (delta_z_i,
+             ts_cor_i,
+             ts_res_i,
+             step_model_i) = estimate_dem_error_batch(ts_data, A_geom, A_def,
+                                                      tbase=tbase,
+                                                      drop_date=drop_date,
+                                                      phaseVelocity=inps.phaseVelocity,
+                                                      num_step=num_step)
+        delta_z[mask] = delta_z_i
+        ts_cor[:, mask] = ts_cor_i
+        ts_res[:, mask] = ts_res_i
+        if num_step > 0:
+            step_model[:, mask] = step_model_i
+    del ts_data, pbase
+
     # prepare for output
-    ts_cor = ts_cor.reshape((num_date, ts_obj.length, ts_obj.width))
-    ts_res = ts_res.reshape((num_date, ts_obj.length, ts_obj.width))
-    delta_z = delta_z.reshape((ts_obj.length, ts_obj.width))
-    if num_step > 0:
-        step_model = step_model.reshape((num_step, ts_obj.length, ts_obj.width))
+    delta_z = delta_z.reshape((box_len, box_wid))
+    ts_cor = ts_cor.reshape((num_date, box_len, box_wid))
+    ts_res = ts_res.reshape((num_date, box_len, box_wid))
+    step_model = step_model.reshape((num_step, box_len, box_wid))
+    return delta_z, ts_cor, ts_res, step_model
+
+
+def correct_dem_error(inps, A_def):
+    """Correct DEM error of input timeseries file block by block"""
+    # Read Date Info
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open()
+    num_date = ts_obj.numDate
+    length, width = ts_obj.length, ts_obj.width
+
+    num_step = len(inps.stepFuncDate)
+    drop_date, inps.excludeDate = read_exclude_date(inps.excludeDate, ts_obj.dateList)
+    if inps.polyOrder > np.sum(drop_date):
+        raise ValueError(("input poly order {} > number of acquisition {}!"
+                          " Reduce it!").format(inps.polyOrder, np.sum(drop_date)))
+
+    ##---------------------------------- Prepare Output Files ----------------------------------##
     atr = dict(ts_obj.metadata)
 
     # config parameter
@@ -449,24 +567,56 @@ def correct_dem_error(inps, A_def):
         atr[key_prefix+key] = str(vars(inps)[key])
 
     # 1. Estimated DEM error
-    outfile = 'demErr.h5'
+    dem_err_file = 'demErr.h5'
     atr['FILE_TYPE'] = 'dem'
     atr['UNIT'] = 'm'
-    writefile.write(delta_z, out_file=outfile, metadata=atr)
+    ds_name_dict = {'dem' : [np.float32, (length, width)]}
+    writefile.layout_hdf5(dem_err_file, ds_name_dict, metadata=atr)
 
     # 2. Time-series corrected for DEM error
     atr['FILE_TYPE'] = 'timeseries'
-    writefile.write(ts_cor, out_file=inps.outfile, metadata=atr, ref_file=ts_obj.file)
+    atr['UNIT'] = ts_obj.metadata.get('UNIT', 'm')
+    ds_name_dict = {'timeseries' : [np.float32, (num_date, length, width)]}
+    writefile.layout_hdf5(inps.outfile, ds_name_dict, metadata=atr, ref_file=ts_obj.file)
 
     # 3. Time-series of inversion residual
-    ts_ref_file = os.path.join(os.path.dirname(inps.outfile), 'timeseriesResidual.h5')
-    writefile.write(ts_res, out_file=ts_ref_file, metadata=atr, ref_file=ts_obj.file)
+    ts_res_file = os.path.join(os.path.dirname(inps.outfile), 'timeseriesResidual.h5')
+    writefile.layout_hdf5(ts_res_file, ds_name_dict, metadata=atr, ref_file=ts_obj.file)
 
     # 4. Time-series of estimated Step Model
     if num_step > 0:
-        atr.pop('REF_DATE')
-        step_obj = timeseries(os.path.join(os.path.dirname(inps.outfile), 'timeseriesStepModel.h5'))
-        step_obj.write2hdf5(data=step_model, metadata=atr, dates=inps.stepFuncDate)
+        step_file = os.path.join(os.path.dirname(inps.outfile), 'timeseriesStepModel.h5')
+        atr.pop('REF_DATE', None)
+        ds_name_dict = {'timeseries' : [np.float32, (num_step, length, width)],
+                        'date'       : [np.dtype('S8'), (num_step,), np.array(inps.stepFuncDate, np.string_)]}
+        writefile.layout_hdf5(step_file, ds_name_dict, metadata=atr)
+
+    ##-------------------------------- Loop for L2-norm inversion  --------------------------------##
+    print('inverting DEM error ...')
+    box_list = split2boxes(inps.timeseries_file,
+                           geom_file=inps.geom_file,
+                           max_memory=inps.maxMemory)
+    num_box = len(box_list)
+    for i, box in enumerate(box_list):
+        if num_box > 1:
+            print('\n------- processing patch {} out of {} --------------'.format(i+1, num_box))
+            print('box: {}'.format(box))
+
+        delta_z, ts_cor, ts_res, step_model = correct_dem_error_patch(inps, A_def, box=box,
+                                                                      print_msg=(i == 0))
+
+        # write the block to disk
+        block = [box[1], box[3], box[0], box[2]]
+        writefile.write_hdf5_block(dem_err_file, data=delta_z, datasetName='dem', block=block)
+
+        block = [0, num_date] + block
+        writefile.write_hdf5_block(inps.outfile, data=ts_cor, datasetName='timeseries', block=block)
+        writefile.write_hdf5_block(ts_res_file, data=ts_res, datasetName='timeseries', block=block)
+
+        if num_step > 0:
+            block[1] = num_step
+            writefile.write_hdf5_block(step_file, data=step_model, datasetName='timeseries', block=block)
+        del delta_z, ts_cor, ts_res, step_model
 
     ## 5. Time-series of estimated Deformation Model = poly model + step model
     #ts_def_obj = timeseries(os.path.join(os.path.dirname(inps.outfile), 'timeseriesDefModel.h5'))
@@ -485,8 +635,6 @@ def main(iargs=None):
         return inps.outfile
 
     start_time = time.time()
-    inps = read_geometry(inps)
-
     A_def = design_matrix4deformation(inps)
 
     inps = correct_dem_error(inps, A_def)
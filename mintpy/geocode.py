@@ -12,6 +12,7 @@ import time
 import argparse
 import warnings
 import multiprocessing
+import h5py
 import numpy as np
 from mintpy.objects.resample import resample
 from mintpy.utils import readfile, writefile, utils as ut
@@ -31,6 +32,7 @@ EXAMPLE = """example:
   geocode.py velocity.h5
   geocode.py velocity.h5 -b -0.5 -0.25 -91.3 -91.1
   geocode.py velocity.h5 timeseries.h5 -t smallbaselineApp.cfg --outdir ./geo --update
+  geocode.py timeseries.h5 --mem 2GB
 
   # radar-code file in geo coordinates
   geocode.py swbdLat_S02_N01_Lon_W092_W090.wbd -l geometryRadar.h5 -o waterMask.rdr --geo2radar
@@ -75,6 +77,9 @@ def create_parser():
                              'Note: Do not use more processes than available processor cores.')
     parser.add_argument('-p','--processor', dest='processor', type=str, choices={'pyresample', 'scipy'},
                         help='processor module used for interpolation.')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use per block, e.g. 8GB, 512MB, or number in GB (default: %(default)s).\n'
+                             '3D datasets in HDF5 files are geocoded in blocks of 2D slices.')
 
     parser.add_argument('--update', dest='updateMode', action='store_true',
                         help='skip resampling if output file exists and newer than input file')
@@ -156,6 +161,10 @@ def read_template2inps(template_file, inps):
                 else:
                     inps_dict[key] = float(value)
 
+    key = 'mintpy.compute.maxMemory'
+    if template.get(key, None):
+        inps_dict['maxMemory'] = template[key]
+
     inps.laloStep = [inps.latStep, inps.lonStep]
     if None in inps.laloStep:
         inps.laloStep = None
@@ -265,6 +274,68 @@ def auto_output_filename(infile, inps):
     return outfile
 
 
+def run_geocode_block(infile, outfile, res_obj, atr, inps):
+    """Geocode all 2D/3D datasets of the HDF5 file, with 3D datasets in blocks of 2D slices,
+    read only the source area used by the resampling plan, and write into the pre-laid-out output file,
+    to keep the memory usage proportional to one block.
+    Parameters: infile  : str, path of input HDF5 file
+                outfile : str, path of output HDF5 file
+                res_obj : resample object
+                atr     : dict, metadata of the output file
+                inps    : Namespace, input arguments
+    Returns:    outfile : str
+    """
+    res_obj.prepare_resample_plan(interp_method=inps.interpMethod, nprocs=inps.nprocs)
+    src_box = res_obj.get_src_box()
+    src_size = (src_box[2] - src_box[0]) * (src_box[3] - src_box[1])
+    dest_size = res_obj.length * res_obj.width
+    max_memory = ut.get_memory_size(inps.maxMemory) / 1024**3
+    print('read source data in box: {}'.format(src_box))
+
+    # output file layout
+    dsNames = readfile.get_dataset_list(infile)
+    with h5py.File(infile, 'r') as f:
+        ds_info = dict((dsName, (f[dsName].dtype, f[dsName].shape, f[dsName].chunks)) for dsName in dsNames)
+    ds_name_dict = dict((dsName, [dtype, tuple(shape[:-2]) + (res_obj.length, res_obj.width)])
+                        for dsName, (dtype, shape, chunks) in ds_info.items())
+    writefile.layout_hdf5(outfile, ds_name_dict, metadata=atr, ref_file=infile)
+
+    # resample block by block
+    for dsName in dsNames:
+        dtype, shape, chunks = ds_info[dsName]
+        num_slice = shape[0] if len(shape) == 3 else 1
+        slice_list = ut.split_slice2blocks(num_slice,
+                                           array_list=[(dtype, src_size),
+                                                       (dtype, dest_size),
+                                                       (np.float64, dest_size)],
+                                           max_memory=inps.maxMemory,
+                                           chunk_depth=chunks[0] if chunks and len(shape) == 3 else 1)
+        num_block = len(slice_list)
+        for i, (i0, i1) in enumerate(slice_list):
+            print('resampling {} {}/{} in slices {}-{} ...'.format(dsName, i+1, num_block, i0, i1))
+            with h5py.File(infile, 'r') as f:
+                if len(shape) == 3:
+                    data = f[dsName][i0:i1, src_box[1]:src_box[3], src_box[0]:src_box[2]]
+                else:
+                    data = f[dsName][src_box[1]:src_box[3], src_box[0]:src_box[2]]
+
+            res_data = res_obj.run_resample(src_data=data,
+                                            interp_method=inps.interpMethod,
+                                            fill_value=inps.fillValue,
+                                            nprocs=inps.nprocs,
+                                            max_memory=max_memory,
+                                            src_box=src_box,
+                                            print_msg=False)
+
+            if len(shape) == 3:
+                block = [i0, i1, 0, res_obj.length, 0, res_obj.width]
+            else:
+                block = [0, res_obj.length, 0, res_obj.width]
+            writefile.write_hdf5_block(outfile, res_data, datasetName=dsName, block=block, print_msg=False)
+    print('finished writing to {}'.format(outfile))
+    return outfile
+
+
 def run_geocode(inps):
     """geocode all input files"""
     start_time = time.time()
@@ -287,6 +358,18 @@ def run_geocode(inps):
             print('update mode is ON, skip geocoding.')
             continue
 
+        # geocode 3D datasets block by block
+        if ext == '.h5' and not inps.dset:
+            with h5py.File(infile, 'r') as f:
+                num_3d = sum(f[i].ndim == 3 for i in readfile.get_dataset_list(infile))
+            if num_3d > 0:
+                if inps.radar2geo:
+                    atr = metadata_radar2geo(atr, res_obj)
+                else:
+                    atr = metadata_geo2radar(atr, res_obj)
+                run_geocode_block(infile, outfile, res_obj, atr, inps)
+                continue
+
         # read source data and resample
         dsNames = readfile.get_dataset_list(infile, datasetName=inps.dset)
         maxDigit = max([len(i) for i in dsNames])
@@ -309,6 +392,7 @@ def run_geocode(inps):
                                             interp_method=inps.interpMethod,
                                             fill_value=inps.fillValue,
                                             nprocs=inps.nprocs,
+                                            max_memory=ut.get_memory_size(inps.maxMemory) / 1024**3,
                                             print_msg=True)
             dsResDict[dsName] = res_data
 
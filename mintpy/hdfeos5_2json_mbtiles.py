@@ -9,13 +9,13 @@
 import json
 import numpy as np
 from datetime import date
-import math
 import time
 import os
 import sys
 import geocoder
 from mintpy.objects import HDFEOS
 from mintpy.mask import mask_matrix
+from mintpy.utils import parallel, utils as ut
 import argparse
 import pickle
 
@@ -63,9 +63,27 @@ def serialize_dictionary(dictionary, fileName):
     return
 
 
+# ---------------------------------------------------------------------------------------
+# encode the points of one chunk from arrays into json features and write into json file,
+# run in the worker processes
+def write_json_chunk(data):
+    chunk_num, longitude, latitude, displacement, slope, point_num, dates, json_path = data
+    points = [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {"d": d, "m": m, "p": p}
+        } for lon, lat, d, m, p in zip(longitude.tolist(),
+                                       latitude.tolist(),
+                                       displacement.T.tolist(),
+                                       slope.tolist(),
+                                       range(point_num, point_num + longitude.size))]
+    return make_json_file(chunk_num, points, dates, json_path, folder_name=None)
+
+
 # ---------------------------------------------------------------------------------------
 # convert h5 file to json and upload it. folder_name == unavco_name
-def convert_data(attributes, decimal_dates, timeseries_datasets, dates, json_path, folder_name):
+def convert_data(attributes, decimal_dates, file_name, dates, json_path, folder_name,
+                 should_mask=True, num_worker=1, max_memory=4):
 
     project_name = attributes["PROJECT_NAME"]
     region = region_name_from_project_name(project_name)
@@ -76,63 +94,78 @@ def convert_data(attributes, decimal_dates, timeseries_datasets, dates, json_pat
     y_first = float(attributes["Y_FIRST"])
     num_columns = int(attributes["WIDTH"])
     num_rows = int(attributes["LENGTH"])
+    num_date = len(dates)
     print("columns: %d" % num_columns)
     print("rows: %d" % num_rows)
-    # create a siu_man array to store json point objects
-    siu_man = []
-    displacement_values = []
-    displacements = '{'
+
     # np array of decimal dates, x parameter in linear regression equation
+    # y = mx + c -> we want m = slope of the linear regression line,
+    # solved for all pixels at once as the 1st row of pinv(A) * y
     x = decimal_dates
     A = np.vstack([x, np.ones(len(x))]).T
-    y = []
-    chunk_num = 1
-    point_num = 0
+    A_inv = np.linalg.pinv(A)
     CHUNK_SIZE = 20000
 
-    # iterate through h5 file timeseries
-    for (row, col), value in np.ndenumerate(timeseries_datasets[dates[0]]):
-        longitude = x_first + (col * x_step)
-        latitude = y_first + (row * y_step) 
-        displacement = float(value) 
-        # if value is not equal to naN, create a new json point object and append to siu_man array
-        if not math.isnan(displacement):
-            # get displacement values for all the dates into array for json and string for pgsql
-            for datei in dates:
-                displacement = timeseries_datasets[datei][row][col]
-                displacements += (str(displacement) + ",")
-                displacement_values.append(float(displacement))
-            displacements = displacements[:len(displacements) - 1] + '}'
-
-            # np array of displacement values, y parameter in linear regression equation
-            y = displacement_values
-
-            # y = mx + c -> we want m = slope of the linear regression line 
-            m, c = np.linalg.lstsq(A, y)[0]
-
-            data = {
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [longitude, latitude]},    
-            "properties": {"d": displacement_values, "m": m, "p": point_num}
-            }   
-
-            siu_man.append(data)
-
-            # clear displacement array for json and the other string for dictionary, for next point
-            displacement_values = []
-            displacements = '{'
-            point_num += 1
-            # break;    # for testing purposes convert only 1 point
+    # read the displacement in blocks of rows within the memory budget
+    he_obj = HDFEOS(file_name)
+    he_obj.open(print_msg=False)
+    row_list = ut.split_slice2blocks(num_rows,
+                                     array_list=[(np.float32, num_date * num_columns),
+                                                 (np.float32, num_date * num_columns)],
+                                     max_memory=max_memory,
+                                     print_msg=False)
+
+    def read_chunks():
+        # points of the current chunk
+        buffers = {"lon": [np.zeros(0)],
+                   "lat": [np.zeros(0)],
+                   "d": [np.zeros((num_date, 0), dtype=np.float32)],
+                   "m": [np.zeros(0)]}
+        buffer_size = 0
+        chunk_num = 1
+        point_num = 0
+
+        def split_chunk(num_point):
+            # concatenate the points in the buffers and split the 1st num_point points out
+            chunk = {}
+            for key in buffers.keys():
+                values = np.concatenate(buffers[key], axis=-1)
+                chunk[key] = values[..., :num_point]
+                buffers[key] = [values[..., num_point:]]
+            return (chunk_num, chunk["lon"], chunk["lat"], chunk["d"], chunk["m"], point_num, dates, json_path)
+
+        for row0, row1 in row_list:
+            box = (0, row0, num_columns, row1)
+            data = he_obj.read(datasetName='displacement', box=box, print_msg=False)
+            data = np.array(data, dtype=np.float32).reshape(num_date, row1 - row0, num_columns)
+            if should_mask:
+                mask = he_obj.read(datasetName='mask', box=box, print_msg=False)
+                data = mask_matrix(data, mask)
+
+            # pixels with valid value on the 1st date, in row-major order
+            rows, cols = np.nonzero(~np.isnan(data[0]))
+            displacement = data[:, rows, cols]
+            del data
+            buffers["lon"].append(x_first + (cols * x_step))
+            buffers["lat"].append(y_first + ((rows + row0) * y_step))
+            buffers["d"].append(displacement)
+            buffers["m"].append(np.dot(A_inv[0], displacement))
+            buffer_size += rows.size
 
             # if chunk_size limit is reached, write chunk into a json file
-            # then increment chunk number and clear siu_man array
-            if len(siu_man) == CHUNK_SIZE:
-                make_json_file(chunk_num, siu_man, dates, json_path, folder_name)
+            while buffer_size >= CHUNK_SIZE:
+                yield split_chunk(CHUNK_SIZE)
+                buffer_size -= CHUNK_SIZE
                 chunk_num += 1
-                siu_man = []
+                point_num += CHUNK_SIZE
+
+        # write the last chunk that might be smaller than chunk_size
+        yield split_chunk(buffer_size)
 
-    # write the last chunk that might be smaller than chunk_size
-    make_json_file(chunk_num, siu_man, dates, json_path, folder_name)
+    if should_mask:
+        print("Masking displacement")
+    # chunks are encoded and written into json files by a local pool of num_worker processes
+    parallel.run_pipeline(write_json_chunk, read_chunks(), num_worker=num_worker, print_msg=False)
 
     # dictionary to contain metadata needed by db to be written to a file
     # and then be read by json_mbtiles2insarmaps.py
@@ -204,10 +237,8 @@ def make_json_file(chunk_num, points, dates, json_path, folder_name):
     }
 
     chunk = "chunk_" + str(chunk_num) + ".json"
-    json_file = open(json_path + "/" + chunk, "w")
-    string_json = json.dumps(data, indent=4, separators=(',',':'))
-    json_file.write("%s" % string_json)
-    json_file.close()
+    with open(json_path + "/" + chunk, "w") as json_file:
+        json.dump(data, json_file, separators=(',',':'))
 
     print("converted chunk " + str(chunk_num))
     return chunk
@@ -219,7 +250,10 @@ def build_parser():
     required = parser.add_argument_group("required arguments")
     required.add_argument("file", help="unavco file to ingest")
     required.add_argument("outputDir", help="directory to place json files and mbtiles file")
-
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of processes to write json files (default: %(default)s).')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use per block, e.g. 8GB, 512MB, or number in GB (default: %(default)s).')
     return parser
 
 # ---------------------------------------------------------------------------------------
@@ -234,62 +268,20 @@ def main():
 
     path_name_and_extension = os.path.basename(file_name).split(".")
     path_name = path_name_and_extension[0]
+    num_worker = max(1, min(parseArgs.numWorker, os.cpu_count() or 1))
     # ---------------------------------------------------------------------------------------
     # start clock to track how long conversion process takes
-    start_time = time.clock()
+    start_time = time.time()
 
-    # use h5py to open specified group(s) in the h5 file 
-    # then read datasets from h5 file into memory for faster reading of data
+    # get the dates and attributes of the h5 file,
+    # the displacement is read in blocks of rows while converting
     he_obj = HDFEOS(file_name)
     he_obj.open(print_msg=False)
-    displacement_3d_matrix = he_obj.read(datasetName='displacement')
-    mask = he_obj.read(datasetName='mask')
-    if should_mask:
-        print("Masking displacement")
-        displacement_3d_matrix = mask_matrix(displacement_3d_matrix, mask)
-    del mask
-
     dates = he_obj.dateList
     attributes = dict(he_obj.metadata)
 
-    #file = h5py.File(file_name,  "r")
-    #timeseries_group = file["HDFEOS"]["GRIDS"]["timeseries"]
-    #displacement_3d_matrix = timeseries_group["observation"]["displacement"]
-
-    # get attributes (stored at root) of UNAVCO timeseries file
-    #attributes = dict(file.attrs)
-
-    # in timeseries displacement_3d_matrix, there are datasets
-    # need to get datasets with dates - strings that can be converted to integers
-    #dates = displacement_3d_matrix.attrs["DATE_TIMESERIES"].split(" ")
-
     # array that stores dates from dates that have been converted to decimal
-    decimal_dates = []
-
-    # read datasets in the group into a dictionary of 2d arrays and intialize decimal dates
-    timeseries_datasets = {}
-    num_date = len(dates)
-    for i in range(num_date):
-        timeseries_datasets[dates[i]] = np.squeeze(displacement_3d_matrix[i, :, :])
-        d = get_date(dates[i])
-        decimal = get_decimal_date(d)
-        decimal_dates.append(decimal)
-    del displacement_3d_matrix
-
-    #for displacement_2d_matrix in displacement_3d_matrix:
-    #    dataset = displacement_2d_matrix[:]
-    #    if should_mask:
-    #        print("Masking " + dates[i])
-    #        mask = timeseries_group["quality"]["mask"][:]
-    #        dataset = mask_matrix(dataset, mask)
-    #    timeseries_datasets[dates[i]] = dataset
-    #    d = get_date(dates[i])
-    #    decimal = get_decimal_date(d)
-    #    decimal_dates.append(decimal)
-    #    i += 1
-
-    # close h5 file
-    #file.close()
+    decimal_dates = [get_decimal_date(get_date(i)) for i in dates]
 
     path_list = path_name.split("/")
     folder_name = path_name.split("/")[len(path_list)-1]
@@ -300,7 +292,10 @@ def main():
         print(output_folder + " already exists")
 
     # read and convert the datasets, then write them into json files and insert into database
-    convert_data(attributes, decimal_dates, timeseries_datasets, dates, output_folder, folder_name)
+    convert_data(attributes, decimal_dates, file_name, dates, output_folder, folder_name,
+                 should_mask=should_mask,
+                 num_worker=num_worker,
+                 max_memory=parseArgs.maxMemory)
 
     # run tippecanoe command to get mbtiles file
     os.chdir(os.path.abspath(output_folder))
@@ -308,7 +303,7 @@ def main():
 
     # ---------------------------------------------------------------------------------------
     # check how long it took to read h5 file data and create json files
-    end_time =  time.clock()
+    end_time =  time.time()
     print(("time elapsed: " + str(end_time - start_time)))
     return
 
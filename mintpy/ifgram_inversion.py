@@ -18,7 +18,7 @@ import h5py
 import numpy as np
 from scipy import linalg   # more effieint than numpy.linalg
 from mintpy.objects import ifgramStack, timeseries
-from mintpy.utils import readfile, writefile, ptime, utils as ut
+from mintpy.utils import readfile, writefile, ptime, parallel, utils as ut
 from mintpy.simulation import decorrelation as decor
 
 
@@ -41,10 +41,16 @@ EXAMPLE = """example:
   ifgram_inversion.py  inputs/ifgramStack.h5 -w fim
   ifgram_inversion.py  inputs/ifgramStack.h5 -w coh
 
+  # append mode: invert the new acquisitions only, with the existing time-series fixed
+  ifgram_inversion.py  inputs/ifgramStack.h5 -t smallbaselineApp.cfg --update --append
+
   # parallel processing for HPC
   # support LSF job scheduler, PBS should also work out of the box after changing module import
   ifgram_inversion.py  inputs/ifgramStack.h5 -w var --parallel
   ifgram_inversion.py  inputs/ifgramStack.h5 -w var --parallel --parallel-workers-num 25
+
+  # parallel processing on a local multicore machine with a process pool
+  ifgram_inversion.py  inputs/ifgramStack.h5 -w var --cluster local --num-worker 8
 """
 
 TEMPLATE = """
@@ -66,10 +72,16 @@ mintpy.networkInversion.minRedundancy   = auto #[1-inf], auto for 1.0, min num_i
 mintpy.networkInversion.waterMaskFile   = auto #[filename / no], auto for waterMask.h5 or no [if no waterMask.h5 found]
 mintpy.networkInversion.minNormVelocity = auto #[yes / no], auto for yes, min-norm deformation velocity or phase
 mintpy.networkInversion.residualNorm    = auto #[L2 ], auto for L2, norm minimization solution
+mintpy.networkInversion.appendMode      = auto #[yes / no], auto for no, invert the new acquisitions only
 
-## Parallel processing with Dask for HPC
-mintpy.networkInversion.parallel  = auto #[yes / no], auto for no, parallel processing using dask
-mintpy.networkInversion.numWorker = auto #[int > 0], auto for 40, number of works for dask cluster to use
+## Append mode for new acquisitions after the existing time-series:
+## the existing time-series is kept fixed, and only the new acquisitions are estimated
+## from the interferograms connected to them, instead of inverting the whole network again.
+
+## Parallel processing with Dask for HPC or with a local process pool for multicore workstation
+mintpy.networkInversion.parallel  = auto #[yes / no], auto for no, parallel processing using dask or local process pool
+mintpy.networkInversion.cluster   = auto #[lsf / local], auto for lsf, dask LSFCluster or local process pool
+mintpy.networkInversion.numWorker = auto #[int > 0], auto for 40, number of works for dask cluster / local pool to use
 mintpy.networkInversion.walltime  = auto #[HH:MM], auto for 00:40, walltime for dask workers
 
 ## Temporal coherence is calculated and used to generate final mask (Pepe & Lanari, 2006, IEEE-TGRS)
@@ -129,9 +141,12 @@ def create_parser():
     parser.add_argument('--norm', dest='residualNorm', default='L2', choices=['L1', 'L2'],
                         help='Inverse method used to residual optimization, L1 or L2 norm minimization. Default: L2')
 
-    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
-                        help='max number of data (= ifgram_num * num_row * num_col) to read per loop\n' +
-                        'default: 0.2 G; adjust it according to your computer memory.')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use per patch, e.g. 8GB, 512MB, or number in GB (default: %(default)s).\n' +
+                        'adjust it according to your computer memory.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float,
+                        help='(deprecated, use --memory instead) max number of float32 data elements\n' +
+                        'of the unwrapped phase to read per patch, converted to --memory in GB.')
 
     parser.add_argument('--skip-reference', dest='skip_ref', action='store_true',
                         help='Skip checking reference pixel value, for simulation testing.')
@@ -142,6 +157,9 @@ def create_parser():
     parser.add_argument('--update', dest='update_mode', action='store_true',
                         help='Enable update mode, and skip inversion if output timeseries file already exists,\n' +
                         'readable and newer than input interferograms file')
+    parser.add_argument('--append', dest='appendMode', action='store_true',
+                        help='Enable append mode, and invert the new acquisitions only, if output timeseries file\n' +
+                        'already exists with all its dates before the new ones, and with the same configuration.')
     parser.add_argument('--water-mask', '-m', dest='waterMaskFile',
                         help='Skip inversion on the masked out region, i.e. water.')
     #parser.add_argument('--split-file', dest='split_file', action='store_true',
@@ -152,11 +170,16 @@ def create_parser():
                              '\t--mask-dset = no\n'+
                              'This is equivalent to SBAS algorithm (Berardino et al., 2002)')
 
-    par = parser.add_argument_group('parallel', 'parallel processing configuration for Dask')
+    par = parser.add_argument_group('parallel', 'parallel processing configuration for Dask / local process pool')
     par.add_argument('--parallel', dest='parallel', action='store_true',
                      help='Enable parallel processing for the pixelwise weighted inversion.')
-    par.add_argument('--parallel-workers-num','--par-workers-num','--parallel-num', dest='numWorker', type=int,
-                     default=40, help='Specify the number of workers the Dask cluster should use. Default: 40')
+    par.add_argument('--cluster', dest='cluster', default='lsf', choices={'lsf', 'local'},
+                     help='Cluster type for parallel processing (default: %(default)s):\n' +
+                          'lsf   - Dask LSFCluster for HPC\n' +
+                          'local - process pool on the local machine, enables --parallel')
+    par.add_argument('--parallel-workers-num','--par-workers-num','--parallel-num','--num-worker', dest='numWorker',
+                     type=int, default=40,
+                     help='Specify the number of workers the Dask cluster / local pool should use. Default: 40')
     par.add_argument('--parallel-walltime','--par-walltime','--parallel-walltime', dest='walltime', type=str,
                      default='00:40', help='Specify the walltime for each dask worker. Default: 00:40')
 
@@ -174,11 +197,26 @@ def cmd_line_parse(iargs=None):
     if inps.templateFile:
         inps = read_template2inps(inps.templateFile, inps)
 
+    # --chunk-size option (deprecated), with higher priority than the template
+    if inps.chunk_size:
+        inps.maxMemory = inps.chunk_size * 4 / 1024**3
+        print('WARNING: --chunk-size is deprecated, use --memory instead.')
+        print('\tconvert --chunk-size {:.1E} to --memory {:.2f} GB'.format(inps.chunk_size, inps.maxMemory))
+
     inps.timeseriesFile, inps.tempCohFile = inps.outfile
 
     if inps.waterMaskFile and not os.path.isfile(inps.waterMaskFile):
         inps.waterMaskFile = None
 
+    # --cluster local option
+    if inps.cluster == 'local':
+        inps.parallel = True
+        num_core = os.cpu_count()
+        if inps.numWorker > num_core:
+            print('number of workers ({}) > number of CPU cores ({}), use {} instead.'.format(
+                inps.numWorker, num_core, num_core))
+            inps.numWorker = num_core
+
     # --fast option
     if inps.fast:
         print("Enable fast network inversion.")
@@ -214,15 +252,23 @@ def read_template2inps(template_file, inps):
         value = template[key_prefix+key]
         if key in ['maskDataset', 'minNormVelocity', 'parallel']:
             iDict[key] = value
+        elif key in ['appendMode']:
+            # command line input has higher priority
+            iDict[key] = iDict[key] or value
         elif value:
             if key in ['numWorker']:
                 iDict[key] = int(value)
-            elif key in ['walltime']:
+            elif key in ['walltime', 'cluster']:
                 iDict[key] = str(value)
             elif key in ['maskThreshold', 'minRedundancy']:
                 iDict[key] = float(value)
             elif key in ['weightFunc', 'residualNorm', 'waterMaskFile']:
                 iDict[key] = value
+
+    # computing configurations
+    key = 'mintpy.compute.maxMemory'
+    if template.get(key, None):
+        iDict['maxMemory'] = template[key]
     return inps
 
 
@@ -267,6 +313,64 @@ def run_or_skip(inps):
     return flag
 
 
+def run_or_append(inps):
+    """Check whether the existing time-series can be extended with the new acquisitions only."""
+    print('-'*50)
+    print('append mode: ON')
+    flag = 'append'
+    num_inv_file = 'numInvIfgram.h5'
+    date_list = ifgramStack(inps.ifgramStackFile).get_date_list(dropIfgram=True)
+
+    # check output files
+    if not all(os.path.isfile(i) for i in inps.outfile + [num_inv_file]):
+        flag = 'run'
+        print('1) NOT ALL output files found: {}.'.format(inps.outfile + [num_inv_file]))
+    else:
+        print('1) output files already exist: {}.'.format(inps.outfile + [num_inv_file]))
+
+    # check dates: all existing dates are before the new ones
+    if flag == 'append':
+        date_list_old = timeseries(inps.timeseriesFile).get_date_list()
+        date_list_new = sorted(list(set(date_list) - set(date_list_old)))
+        if not set(date_list_old).issubset(set(date_list)):
+            flag = 'run'
+            print('2) NOT all existing dates are in the input interferograms.')
+        elif len(date_list_new) == 0:
+            flag = 'run'
+            print('2) NO new acquisition found in the input interferograms.')
+        elif date_list_new[0] <= date_list_old[-1]:
+            flag = 'run'
+            print('2) NOT all new acquisitions are after the existing ones: {}.'.format(date_list_new))
+        elif not any(i.split('_')[0] in date_list_old and i.split('_')[1] in date_list_new
+                     for i in ifgramStack(inps.ifgramStackFile).get_date12_list(dropIfgram=True)):
+            flag = 'run'
+            print('2) NO interferogram connects the new acquisitions with the existing ones.')
+        else:
+            print('2) {} new acquisitions found: {}.'.format(len(date_list_new), date_list_new))
+
+    # check configuration, with the interferograms between the existing dates
+    if flag == 'append':
+        meta_keys = ['REF_Y', 'REF_X']
+        atr_ifg = readfile.read_attribute(inps.ifgramStackFile)
+        atr_ts = readfile.read_attribute(inps.timeseriesFile)
+        date12_list = ifgramStack(inps.ifgramStackFile).get_date12_list(dropIfgram=True)
+        inps.numIfgram = len([i for i in date12_list
+                              if all(j in date_list_old for j in i.split('_'))])
+
+        if any(str(vars(inps)[key]) != atr_ts.get(key_prefix+key, 'None') for key in configKeys):
+            flag = 'run'
+            print('3) NOT all key configration parameters are the same: {}'.format(configKeys))
+        elif any(atr_ts[key] != atr_ifg[key] for key in meta_keys):
+            flag = 'run'
+            print('3) NOT all the metadata are the same: {}'.format(meta_keys))
+        else:
+            print('3) all key configuration parameters are the same: {}.'.format(configKeys))
+
+    # result
+    print('run or append: {}.'.format(flag))
+    return flag
+
+
 #################################### Weight Functions #####################################
 def coherence2phase_variance(coherence, L=32, epsilon=1e-3, print_msg=False):
     """Convert coherence to phase variance based on DS phase PDF (Tough et al., 1995)"""
@@ -454,6 +558,157 @@ def estimate_timeseries(A, B, tbase_diff, ifgram, weight_sqrt=None, min_norm_vel
     return ts, temp_coh, num_inv_ifg
 
 
+def estimate_timeseries_batch(A, B, tbase_diff, ifgram, weight_sqrt=None, min_norm_velocity=True,
+                              rcond=1e-5, min_redundancy=1., chunk_size=20e6, print_msg=True):
+    """Estimate time-series for a batch of pixels with (potentially) different valid-interferogram
+    patterns, as the vectorized version of calling estimate_timeseries() pixel by pixel.
+
+    Pixels are grouped by their pattern of valid (non-zero) interferograms. For each group,
+    the redundancy and rank of the design matrix is checked only once:
+    1. groups with redundancy < min_redundancy are skipped (zero output), same as pixelwise;
+    2. groups with full rank design matrix are solved together in one batched call of the
+       weighted normal equations, (G^T W G) X = G^T W y, with W = 0 for invalid interferograms;
+    3. groups with rank deficient design matrix fall back to the SVD solution (estimate_timeseries),
+       pixel by pixel for WLS and group by group for OLS.
+    Large OLS groups are also solved group by group, as one SVD with multiple right hand sides
+    is cheaper than the batched normal equations.
+
+    Parameters: A/B/tbase_diff/ifgram/weight_sqrt/min_norm_velocity/rcond/min_redundancy
+                    - same as estimate_timeseries()
+                chunk_size - float, max number of float64 elements of the stacked normal equations
+                    to allocate per batch, to limit memory usage
+    Returns:    ts          - 2D np.array in size of (num_date, num_pixel), phase time-series
+                temp_coh    - 1D np.array in size of (num_pixel), temporal coherence
+                num_inv_ifg - 1D np.array in size of (num_pixel), number of ifgrams used
+    """
+    ifgram = ifgram.reshape(A.shape[0], -1)
+    if weight_sqrt is not None:
+        weight_sqrt = weight_sqrt.reshape(A.shape[0], -1)
+    num_ifgram, num_date = A.shape[0], A.shape[1] + 1
+    num_pixel = ifgram.shape[1]
+    G = B if min_norm_velocity else A
+
+    # Initial output value
+    ts = np.zeros((num_date, num_pixel), np.float32)
+    temp_coh = np.zeros(num_pixel, np.float32)
+    num_inv_ifg = np.zeros(num_pixel, np.int16)
+    if num_pixel == 0:
+        return ts, temp_coh, num_inv_ifg
+
+    # group pixels by their pattern of valid interferograms
+    mask = ifgram != 0.
+    patterns, pattern_idx = np.unique(np.packbits(mask, axis=0).T, axis=0, return_inverse=True)
+    pattern_idx = pattern_idx.flatten()
+    pattern_mask = np.unpackbits(patterns, axis=1)[:, :num_ifgram].astype(np.bool_)
+    num_pattern = pattern_mask.shape[0]
+    pixel_order = np.argsort(pattern_idx, kind='mergesort')
+    pixel_groups = np.split(pixel_order, np.cumsum(np.bincount(pattern_idx, minlength=num_pattern))[:-1])
+    if print_msg:
+        print('number of valid-interferogram patterns: {} for {} pixels'.format(num_pattern, num_pixel))
+
+    # check redundancy for all patterns at once
+    # skipped for pixels with valid phase in all ifgrams, same as estimate_timeseries()
+    redundancy = np.dot(pattern_mask.astype(np.float32), (A != 0.).astype(np.float32)).min(axis=1)
+    flag_redundant = np.logical_or(redundancy >= min_redundancy, np.all(pattern_mask, axis=1))
+
+    idx_batch = []
+    for i in np.where(flag_redundant)[0]:
+        idx = pixel_groups[i]
+        Gi = G[pattern_mask[i], :]
+
+        # large OLS group: one SVD with multiple right hand sides
+        if weight_sqrt is None and idx.size >= G.shape[1]:
+            (ts[:, idx],
+             temp_coh[idx],
+             num_inv_ifg[idx]) = estimate_timeseries(A, B, tbase_diff,
+                                                     ifgram=ifgram[:, idx],
+                                                     weight_sqrt=None,
+                                                     min_norm_velocity=min_norm_velocity,
+                                                     rcond=rcond,
+                                                     min_redundancy=min_redundancy)
+            continue
+
+        # check rank of the design matrix
+        s = linalg.svd(Gi, compute_uv=False)
+        if s.size == G.shape[1] and s[-1] > rcond * s[0]:
+            idx_batch.append(idx)
+
+        # rank deficient: SVD solution
+        elif weight_sqrt is None:
+            (ts[:, idx],
+             temp_coh[idx],
+             num_inv_ifg[idx]) = estimate_timeseries(A, B, tbase_diff,
+                                                     ifgram=ifgram[:, idx],
+                                                     weight_sqrt=None,
+                                                     min_norm_velocity=min_norm_velocity,
+                                                     rcond=rcond,
+                                                     min_redundancy=min_redundancy)
+        else:
+            for j in idx:
+                (ts[:, j:j+1],
+                 temp_coh[j:j+1],
+                 num_inv_ifg[j:j+1]) = estimate_timeseries(A, B, tbase_diff,
+                                                           ifgram=ifgram[:, j],
+                                                           weight_sqrt=weight_sqrt[:, j],
+                                                           min_norm_velocity=min_norm_velocity,
+                                                           rcond=rcond,
+                                                           min_redundancy=min_redundancy)
+
+    if len(idx_batch) == 0:
+        return ts, temp_coh, num_inv_ifg
+
+    # batched solution of the weighted normal equations for all full rank pixels
+    idx_batch = np.sort(np.hstack(idx_batch))
+    num_pixel2inv = idx_batch.size
+    step = max(1, int(chunk_size / (num_ifgram * G.shape[1] + G.shape[1]**2)))
+    if print_msg:
+        print('solving normal equations for {} pixels in batches of {} ...'.format(num_pixel2inv, step))
+    prog_bar = ptime.progressBar(maxValue=num_pixel2inv, print_msg=print_msg)
+    for i0 in range(0, num_pixel2inv, step):
+        idx = idx_batch[i0:i0+step]
+        y = np.array(ifgram[:, idx], np.float64)
+        maski = mask[:, idx]
+        if weight_sqrt is not None:
+            w = np.square(weight_sqrt[:, idx], dtype=np.float64) * maski
+        else:
+            w = maski.astype(np.float64)
+
+        # stacked normal equations in size of (num_pixel, num_param, num_param)
+        Gw = np.multiply(G[np.newaxis, :, :], w.T[:, :, np.newaxis]).transpose(0, 2, 1)
+        N = np.matmul(Gw, G)
+        rhs = np.dot(G.T, w * y).T[:, :, np.newaxis]
+        del Gw
+        try:
+            X = np.linalg.solve(N, rhs)[:, :, 0].T
+        except np.linalg.LinAlgError:
+            # numerically singular for some pixels: SVD solution pixel by pixel
+            for j in idx:
+                wj = None if weight_sqrt is None else weight_sqrt[:, j]
+                (ts[:, j:j+1],
+                 temp_coh[j:j+1],
+                 num_inv_ifg[j:j+1]) = estimate_timeseries(A, B, tbase_diff,
+                                                           ifgram=ifgram[:, j],
+                                                           weight_sqrt=wj,
+                                                           min_norm_velocity=min_norm_velocity,
+                                                           rcond=rcond,
+                                                           min_redundancy=min_redundancy)
+            continue
+        del N, rhs
+
+        if min_norm_velocity:
+            ts[1:, idx] = np.cumsum(X * tbase_diff, axis=0)
+        else:
+            ts[1:, idx] = X
+
+        # temporal coherence from the residual of valid interferograms only
+        ifgram_diff = y - np.dot(G, X)
+        num_inv_ifg[idx] = np.sum(maski, axis=0)
+        temp_coh[idx] = np.abs(np.sum(np.exp(1j*ifgram_diff) * maski, axis=0)) / num_inv_ifg[idx]
+        prog_bar.update(i0+idx.size, every=1, suffix='{}/{} pixels'.format(i0+idx.size, num_pixel2inv))
+    prog_bar.close()
+    return ts, temp_coh, num_inv_ifg
+
+
 ###################################### File IO ############################################
 def write2hdf5_file(ifgram_file, metadata, ts, temp_coh, num_inv_ifg=None,
                     suffix='', inps=None):
@@ -522,7 +777,7 @@ def write2hdf5_auxFiles(metadata, temp_coh, num_inv_ifg=None, suffix='', inps=No
     return None
 
 
-def split_ifgram_file(ifgram_file, chunk_size=100e6):
+def split_ifgram_file(ifgram_file, max_memory=4):
     """Split ifgramStack file into several smaller files."""
     stack_obj = ifgramStack(ifgram_file)
     stack_obj.open(print_msg=False)
@@ -532,9 +787,7 @@ def split_ifgram_file(ifgram_file, chunk_size=100e6):
     ref_phase = stack_obj.get_reference_phase(dropIfgram=False)
 
     # get list of boxes
-    box_list = split2boxes(dataset_shape=stack_obj.get_size(),
-                           chunk_size=chunk_size,
-                           print_msg=True)
+    box_list = split2boxes(ifgram_file, max_memory=max_memory, print_msg=True)
     num_box = len(box_list)
 
     # read/write each patch file
@@ -562,34 +815,39 @@ def split_ifgram_file(ifgram_file, chunk_size=100e6):
     return outfile_list
 
 
-def split2boxes(dataset_shape, chunk_size=100e6, print_msg=True):
+def split2boxes(ifgram_file, max_memory=4, print_msg=True):
     """Split into chunks in rows to reduce memory usage
-    Parameters:
+    Parameters: ifgram_file - str, path of ifgramStack file
+                max_memory  - str / float, max memory to use per patch, e.g. 8GB, or number in GB
+                print_msg   - bool
+    Returns:    box_list    - list of tuple of 4 int in (x0, y0, x1, y1)
     """
-    # Get r_step / chunk_num
-    r_step = chunk_size / (dataset_shape[0] * dataset_shape[2])         # split in lines
-    r_step = int(ut.round_to_1(r_step))
-    chunk_num = int((dataset_shape[1]-1)/r_step) + 1
-
-    if print_msg and chunk_num > 1:
-        print('maximum chunk size: %.1E' % chunk_size)
-        print('split %d lines into %d patches for processing' % (dataset_shape[1], chunk_num))
-        print('    with each patch up to %d lines' % r_step)
-
-    # Computing the inversion
-    box_list = []
-    for i in range(chunk_num):
-        r0 = i * r_step
-        r1 = min([dataset_shape[1], r0+r_step])
-        box = (0, r0, dataset_shape[2], r1)
-        box_list.append(box)
+    stack_obj = ifgramStack(ifgram_file)
+    stack_obj.open(print_msg=False)
+    num_ifgram = stack_obj.get_size(dropIfgram=True)[0]
+    num_date = len(stack_obj.get_date_list(dropIfgram=True))
+
+    # memory allocated per pixel by ifgram_inversion_patch()
+    array_list = [(np.float32,    num_ifgram),  # unwrapPhase
+                  (np.float32,    num_ifgram),  # coherence / mask
+                  (np.float64,    num_ifgram),  # weight in coherence2weight()
+                  (np.float32,    num_date),    # ts
+                  (np.float64,    num_ifgram),  # ifgram / residual in lstsq
+                  (np.complex128, num_ifgram),  # exp(j*residual) for temporal coherence
+                  (np.float64,    num_date)]    # X in lstsq
+
+    box_list = ut.split_box2blocks((stack_obj.length, stack_obj.width),
+                                   array_list=array_list,
+                                   max_memory=max_memory,
+                                   chunk_shape=ut.get_chunk_shape(ifgram_file, 'unwrapPhase'),
+                                   print_msg=print_msg)
     return box_list
 
 
 def subsplit_boxes4_workers(box, num_split, dimension='y'):
     """ This is a bit hacky, but after creating the patches,
     this function further divides the box size into `num_split` different subboxes.
-    Note that `split2boxes`  splits based on chunk_size (memory-based).
+    Note that `split2boxes`  splits based on max_memory (memory-based).
 
     :param box: [x0, y0, x1, y1]: list[int] of size 4
     :param num_split: int, the number of subboxes to split a box into
@@ -604,14 +862,14 @@ def subsplit_boxes4_workers(box, num_split, dimension='y'):
         y_diff = y1 - y0
         # `start` and `end` are the new bounds of the subdivided box
         for i in range(num_split):
-            start = (i * y_diff) // num_split
-            end = ((i + 1) * y_diff) // num_split
+            start = y0 + (i * y_diff) // num_split
+            end = y0 + ((i + 1) * y_diff) // num_split
             subboxes.append([x0, start, x1, end])
     elif dimension == 'x':
         x_diff = x1 - x0
         for i in range(num_split):
-            start = (i * x_diff) // num_split
-            end = ((i + 1) * x_diff) // num_split
+            start = x0 + (i * x_diff) // num_split
+            end = x0 + ((i + 1) * x_diff) // num_split
             subboxes.append([start, y0, end, y1])
     else:
         raise Exception("Unknown value for dimension parameter:", dimension)
@@ -621,13 +879,15 @@ def subsplit_boxes4_workers(box, num_split, dimension='y'):
 def check_design_matrix(ifgram_file, weight_func='var'):
     """Check Rank of Design matrix for weighted inversion"""
     date12_list = ifgramStack(ifgram_file).get_date12_list(dropIfgram=True)
-    A = ifgramStack.get_design_matrix4timeseries(date12_list)[0]
+    A = ifgramStack.get_design_matrix4timeseries(date12_list, sparse=True)[0]
+    # singular design matrix <--> network with multiple subsets
+    num_subset = ifgramStack.get_number_of_network_subsets(date12_list)
     if weight_func == 'no':
-        if np.linalg.matrix_rank(A) < A.shape[1]:
+        if num_subset > 1:
             print('WARNING: singular design matrix! Inversion result can be biased!')
             print('continue using its SVD solution on all pixels')
     else:
-        if np.linalg.matrix_rank(A) < A.shape[1]:
+        if num_subset > 1:
             print('ERROR: singular design matrix!')
             print('    Input network of interferograms is not fully connected!')
             print('    Can not invert the weighted least square solution.')
@@ -639,19 +899,32 @@ def check_design_matrix(ifgram_file, weight_func='var'):
     return A
 
 
+def get_dataset_name4read(stack_obj, dsName, dropIfgram=True, date12_list=None):
+    """Get the number of interferograms and the dataset name(s) to read from ifgramStack file,
+    for all kept interferograms, or for the ones in date12_list only, if given."""
+    if date12_list is None:
+        num_ifgram = stack_obj.get_size(dropIfgram=dropIfgram)[0]
+    else:
+        num_ifgram = len(date12_list)
+        dsName = ['{}-{}'.format(dsName, i) for i in date12_list]
+    return num_ifgram, dsName
+
+
 def read_unwrap_phase(stack_obj, box, ref_phase, unwDatasetName='unwrapPhase', dropIfgram=True,
-                      print_msg=True):
+                      print_msg=True, date12_list=None):
     """Read unwrapPhase from ifgramStack file
     Parameters: stack_obj : ifgramStack object
                 box : tuple of 4 int
                 ref_phase : 1D array or None
+                date12_list : list of str, interferograms to read, in the order of the file,
+                    instead of all the kept ones
     Returns:    pha_data : 2D array of unwrapPhase in size of (num_ifgram, num_pixel)
     """
     # Read unwrapPhase
-    num_ifgram = stack_obj.get_size(dropIfgram=dropIfgram)[0]
+    num_ifgram, dsName = get_dataset_name4read(stack_obj, unwDatasetName, dropIfgram, date12_list)
     if print_msg:
         print('reading {} in {} * {} ...'.format(unwDatasetName, box, num_ifgram))
-    pha_data = stack_obj.read(datasetName=unwDatasetName,
+    pha_data = stack_obj.read(datasetName=dsName,
                               box=box,
                               dropIfgram=dropIfgram,
                               print_msg=False).reshape(num_ifgram, -1)
@@ -680,13 +953,13 @@ def read_unwrap_phase(stack_obj, box, ref_phase, unwDatasetName='unwrapPhase', d
 
 
 def mask_unwrap_phase(pha_data, stack_obj, box, mask_ds_name=None, mask_threshold=0.4, dropIfgram=True,
-                      print_msg=True):
+                      print_msg=True, date12_list=None):
     # Read/Generate Mask
-    num_ifgram = stack_obj.get_size(dropIfgram=dropIfgram)[0]
     if mask_ds_name and mask_ds_name in stack_obj.datasetNames:
+        num_ifgram, dsName = get_dataset_name4read(stack_obj, mask_ds_name, dropIfgram, date12_list)
         if print_msg:
             print('reading {} in {} * {} ...'.format(mask_ds_name, box, num_ifgram))
-        msk_data = stack_obj.read(datasetName=mask_ds_name,
+        msk_data = stack_obj.read(datasetName=dsName,
                                   box=box,
                                   dropIfgram=dropIfgram,
                                   print_msg=False).reshape(num_ifgram, -1)
@@ -703,11 +976,11 @@ def mask_unwrap_phase(pha_data, stack_obj, box, mask_ds_name=None, mask_threshol
     return pha_data
 
 
-def read_coherence(stack_obj, box, dropIfgram=True, print_msg=True):
-    num_ifgram = stack_obj.get_size(dropIfgram=dropIfgram)[0]
+def read_coherence(stack_obj, box, dropIfgram=True, print_msg=True, date12_list=None):
+    num_ifgram, dsName = get_dataset_name4read(stack_obj, 'coherence', dropIfgram, date12_list)
     if print_msg:
         print('reading coherence in {} * {} ...'.format(box, num_ifgram))
-    coh_data = stack_obj.read(datasetName='coherence',
+    coh_data = stack_obj.read(datasetName=dsName,
                               box=box,
                               dropIfgram=dropIfgram,
                               print_msg=False).reshape(num_ifgram, -1)
@@ -858,21 +1131,13 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, unwDatasetName
         if np.sum(mask_part_net) > 0:
             print(('inverting pixels with valid phase in some ifgrams'
                    ' ({:.0f} pixels) ...').format(np.sum(mask_part_net)))
-            num_pixel2inv = int(np.sum(mask_part_net))
-            idx_pixel2inv = np.where(mask_part_net)[0]
-            prog_bar = ptime.progressBar(maxValue=num_pixel2inv)
-            for i in range(num_pixel2inv):
-                idx = idx_pixel2inv[i]
-                tsi, tcohi, num_ifgi = estimate_timeseries(A, B, tbase_diff,
-                                                           ifgram=pha_data[:, idx],
-                                                           weight_sqrt=None,
-                                                           min_norm_velocity=min_norm_velocity,
-                                                           min_redundancy=min_redundancy)
-                ts[:, idx] = tsi.flatten()
-                temp_coh[idx] = tcohi
-                num_inv_ifg[idx] = num_ifgi
-                prog_bar.update(i+1, every=2000, suffix='{}/{} pixels'.format(i+1, num_pixel2inv))
-            prog_bar.close()
+            (ts[:, mask_part_net],
+             temp_coh[mask_part_net],
+             num_inv_ifg[mask_part_net]) = estimate_timeseries_batch(A, B, tbase_diff,
+                                                                     ifgram=pha_data[:, mask_part_net],
+                                                                     weight_sqrt=None,
+                                                                     min_norm_velocity=min_norm_velocity,
+                                                                     min_redundancy=min_redundancy)
 
     # Inversion - WLS
     else:
@@ -881,21 +1146,15 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, unwDatasetName
         weight = coherence2weight(weight, weight_func=weight_func, L=L, epsilon=5e-2)
         weight = np.sqrt(weight)
 
-        # Weighted Inversion pixel by pixel
+        # Weighted Inversion in batches of pixels
         print('inverting network of interferograms into time-series ...')
-        prog_bar = ptime.progressBar(maxValue=num_pixel2inv)
-        for i in range(num_pixel2inv):
-            idx = idx_pixel2inv[i]
-            tsi, tcohi, num_ifgi = estimate_timeseries(A, B, tbase_diff,
-                                                       ifgram=pha_data[:, idx],
-                                                       weight_sqrt=weight[:, idx],
-                                                       min_norm_velocity=min_norm_velocity,
-                                                       min_redundancy=min_redundancy)
-            ts[:, idx] = tsi.flatten()
-            temp_coh[idx] = tcohi
-            num_inv_ifg[idx] = num_ifgi
-            prog_bar.update(i+1, every=2000, suffix='{}/{} pixels'.format(i+1, num_pixel2inv))
-        prog_bar.close()
+        (ts[:, idx_pixel2inv],
+         temp_coh[idx_pixel2inv],
+         num_inv_ifg[idx_pixel2inv]) = estimate_timeseries_batch(A, B, tbase_diff,
+                                                                 ifgram=pha_data[:, idx_pixel2inv],
+                                                                 weight_sqrt=weight[:, idx_pixel2inv],
+                                                                 min_norm_velocity=min_norm_velocity,
+                                                                 min_redundancy=min_redundancy)
         del weight
     del pha_data
 
@@ -927,7 +1186,8 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
 
     stack_obj = ifgramStack(ifgram_file)
     stack_obj.open(print_msg=False)
-    A = stack_obj.get_design_matrix4timeseries(stack_obj.get_date12_list(dropIfgram=True))[0]
+    date12_list = stack_obj.get_date12_list(dropIfgram=True)
+    A = stack_obj.get_design_matrix4timeseries(date12_list, sparse=True)[0]
     num_ifgram, num_date = A.shape[0], A.shape[1]+1
     length, width = stack_obj.length, stack_obj.width
     inps.numIfgram = num_ifgram
@@ -953,7 +1213,7 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
     else:
         msg += 'mask: no\n'
 
-    if np.linalg.matrix_rank(A) < A.shape[1]:
+    if ifgramStack.get_number_of_network_subsets(date12_list) > 1:
         msg += '***WARNING: the network is NOT fully connected.\n'
         msg += '\tInversion result can be biased!\n'
         msg += '\tContinue to use SVD to resolve the offset between different subsets.\n'
@@ -966,7 +1226,7 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
     print('number of columns : {}'.format(width))
 
     # split ifgram_file into blocks to save memory
-    box_list = split2boxes(dataset_shape=stack_obj.get_size(), chunk_size=inps.chunk_size)
+    box_list = split2boxes(ifgram_file, max_memory=inps.maxMemory)
     num_box = len(box_list)
 
     # read ifgram_file in small patches and write them together
@@ -995,7 +1255,7 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
     metadata['UNIT'] = 'm'
 
     # Loop
-    if not inps.parallel:
+    if not inps.parallel or inps.cluster == 'local':
         # instantiate a timeseries object
         ts_file = '{}.h5'.format(os.path.splitext(inps.outfile[0])[0])
         ts_obj = timeseries(ts_file)
@@ -1012,34 +1272,82 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
 
         # invert & write block by block
         phase2range = -1*float(metadata['WAVELENGTH']) / (4.*np.pi)
-        for i in range(num_box):
-            box = box_list[i]
-            if num_box > 1:
-                print('\n------- Processing Patch {} out of {} --------------'.format(i+1, num_box))
-
-            # invert the network
-            (tsi,
-             temp_cohi,
-             ifg_numi) = ifgram_inversion_patch(ifgram_file,
-                                                box=box,
-                                                ref_phase=ref_phase,
-                                                unwDatasetName=inps.unwDatasetName,
-                                                weight_func=inps.weightFunc,
-                                                min_norm_velocity=inps.minNormVelocity,
-                                                mask_dataset_name=inps.maskDataset,
-                                                mask_threshold=inps.maskThreshold,
-                                                min_redundancy=inps.minRedundancy,
-                                                water_mask_file=inps.waterMaskFile)
-
-            # write the block of timeseries to disk
-            print('converting phase to range')
-            tsi *= phase2range
-            block = [0, num_date, box[1], box[3], box[0], box[2]]
-            ts_obj.write2hdf5_block(tsi, datasetName='timeseries', block=block)
-
-            # save the block of aux datasets
-            temp_coh[box[1]:box[3], box[0]:box[2]] = temp_cohi
-            num_inv_ifg[box[1]:box[3], box[0]:box[2]] = ifg_numi
+        if not inps.parallel:
+            for i in range(num_box):
+                box = box_list[i]
+                if num_box > 1:
+                    print('\n------- Processing Patch {} out of {} --------------'.format(i+1, num_box))
+
+                # invert the network
+                (tsi,
+                 temp_cohi,
+                 ifg_numi) = ifgram_inversion_patch(ifgram_file,
+                                                    box=box,
+                                                    ref_phase=ref_phase,
+                                                    unwDatasetName=inps.unwDatasetName,
+                                                    weight_func=inps.weightFunc,
+                                                    min_norm_velocity=inps.minNormVelocity,
+                                                    mask_dataset_name=inps.maskDataset,
+                                                    mask_threshold=inps.maskThreshold,
+                                                    min_redundancy=inps.minRedundancy,
+                                                    water_mask_file=inps.waterMaskFile)
+
+                # write the block of timeseries to disk
+                print('converting phase to range')
+                tsi *= phase2range
+                block = [0, num_date, box[1], box[3], box[0], box[2]]
+                ts_obj.write2hdf5_block(tsi, datasetName='timeseries', block=block)
+
+                # save the block of aux datasets
+                temp_coh[box[1]:box[3], box[0]:box[2]] = temp_cohi
+                num_inv_ifg[box[1]:box[3], box[0]:box[2]] = ifg_numi
+
+        # Parallel loop with local process pool
+        else:
+            # each box from split2boxes is split further into one sub-box per worker,
+            # so that the sub-boxes in flight together take about one box in memory.
+            num_worker = inps.numWorker
+            all_boxes = []
+            for box in box_list:
+                all_boxes += [b for b in subsplit_boxes4_workers(box, num_split=num_worker, dimension='x')
+                              if b[2] > b[0]]
+            num_subbox = len(all_boxes)
+            print('invert {} sub-boxes with a local pool of {} workers'.format(num_subbox, num_worker))
+
+            # workers read the ifgramStack file and invert the network of each sub-box,
+            # while the main process is the only writer of the timeseries file.
+            data_list = [(ifgram_file,
+                          subbox,
+                          ref_phase,
+                          inps.unwDatasetName,
+                          inps.weightFunc,
+                          inps.minNormVelocity,
+                          inps.maskDataset,
+                          inps.maskThreshold,
+                          inps.minRedundancy,
+                          inps.waterMaskFile) for subbox in all_boxes]
+
+            start_time_subboxes = time.time()
+            num_done = [0]
+            def write_func(i, out):
+                tsi, temp_cohi, ifg_numi, subbox = out
+                num_done[0] += 1
+                print('sub-box {}/{} {} complete in {:.1f} seconds'.format(
+                    num_done[0], num_subbox, subbox, time.time() - start_time_subboxes))
+
+                # write the block of timeseries to disk
+                tsi *= phase2range
+                block = [0, num_date, subbox[1], subbox[3], subbox[0], subbox[2]]
+                ts_obj.write2hdf5_block(tsi, datasetName='timeseries', block=block)
+
+                # save the block of aux datasets
+                temp_coh[subbox[1]:subbox[3], subbox[0]:subbox[2]] = temp_cohi
+                num_inv_ifg[subbox[1]:subbox[3], subbox[0]:subbox[2]] = ifg_numi
+
+            parallel.run_pipeline(parallel_ifgram_inversion_patch, data_list, write_func,
+                                  num_worker=num_worker,
+                                  max_queue_size=num_worker,
+                                  print_msg=False)
 
         # write date and bperp to disk
         print('-'*50)
@@ -1047,7 +1355,7 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
         ts_obj.write2hdf5_block(date_list_utf8, datasetName='date')
         ts_obj.write2hdf5_block(pbase, datasetName='bperp')
 
-    # Parallel loop
+    # Parallel loop with Dask
     else:
         try:
             from dask.distributed import Client, as_completed
@@ -1137,7 +1445,7 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
     num_inv_ifg[ref_y, ref_x] = num_ifgram
     temp_coh[ref_y, ref_x] = 1.
 
-    if inps.parallel:
+    if inps.parallel and inps.cluster != 'local':
         # for dask still use the old function to write. This needs also migrate to block-by-block writing
         write2hdf5_file(ifgram_file, metadata, ts, temp_coh, num_inv_ifg, suffix='', inps=inps)
     else:
@@ -1148,9 +1456,206 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
     return
 
 
+def ifgram_inversion_append(ifgram_file='ifgramStack.h5', inps=None):
+    """Extend the existing time-series with the new acquisitions, which are all after the existing ones.
+
+    The existing time-series is kept fixed and used as known parameters, thus only the interferograms
+    with the slave date in the new acquisitions are used, with their master date moved onto the last
+    existing acquisition, i.e. for interferogram (m, s) with m in the existing dates:
+        phase(m, s) + ts(m) - ts(last) = ts(s) - ts(last)
+    which is a small network inversion of the new acquisitions with the last existing one as the reference,
+    solved with the same weight function, mask and min-norm options as the whole network.
+
+    Temporal coherence of the whole network is approximated as the average of the existing and the new one,
+    weighted by the number of interferograms, which is exact for pixels with small residuals, and its upper
+    bound otherwise. Pixels without any valid new interferogram keep the value of the last existing
+    acquisition, and are marked as invalid with zero temporal coherence and number of interferograms.
+
+    Parameters: ifgram_file : str, HDF5 file name of the interferograms stack
+                inps        : namespace, with the same options as ifgram_inversion()
+    Returns:    None
+    """
+    start_time = time.time()
+
+    stack_obj = ifgramStack(ifgram_file)
+    stack_obj.open(print_msg=False)
+    length, width = stack_obj.length, stack_obj.width
+    date_list = stack_obj.get_date_list(dropIfgram=True)
+    date12_list = stack_obj.get_date12_list(dropIfgram=True)
+    num_date, num_ifgram = len(date_list), len(date12_list)
+    inps.numIfgram = num_ifgram
+
+    ts_file, tcoh_file = inps.outfile
+    num_inv_file = 'numInvIfgram.h5'
+    date_list_old = timeseries(ts_file).get_date_list()
+    date_list_new = date_list[len(date_list_old):]
+    num_date_old, num_date_new = len(date_list_old), len(date_list_new)
+
+    # interferograms connected to the new acquisitions,
+    # with the master date before the last existing acquisition moved onto it.
+    idx_ifgram = [i for i, date12 in enumerate(date12_list) if date12.split('_')[1] in date_list_new]
+    date12_list_new = [date12_list[i] for i in idx_ifgram]
+    date12_list_sub = []
+    m_idx_list = []
+    for date12 in date12_list_new:
+        m_date, s_date = date12.split('_')
+        if m_date in date_list_old:
+            date12_list_sub.append('{}_{}'.format(date_list_old[-1], s_date))
+            m_idx_list.append(date_list_old.index(m_date))
+        else:
+            date12_list_sub.append(date12)
+            m_idx_list.append(None)
+
+    date_list_sub = [date_list_old[-1]] + date_list_new
+    A, B = ifgramStack.get_design_matrix4timeseries(date12_list_sub)[0:2]
+    tbase = np.array(ptime.date_list2tbase(date_list_sub)[0], np.float32) / 365.25
+    tbase_diff = np.diff(tbase).reshape(-1, 1)
+
+    print('-'*50)
+    print('number of interferograms      : {} ({} new)'.format(num_ifgram, len(date12_list_new)))
+    print('number of acquisitions        : {} ({} new)'.format(num_date, num_date_new))
+    print('reference date of the new ones: {}'.format(date_list_old[-1]))
+    if ifgramStack.get_number_of_network_subsets(date12_list_sub) > 1:
+        print('***WARNING: the network of the new acquisitions is NOT fully connected.')
+    print('number of lines   : {}'.format(length))
+    print('number of columns : {}'.format(width))
+
+    ref_phase = stack_obj.get_reference_phase(unwDatasetName=inps.unwDatasetName,
+                                              skip_reference=inps.skip_ref,
+                                              dropIfgram=True).reshape(-1)[idx_ifgram]
+    phase2range = -1*float(stack_obj.metadata['WAVELENGTH']) / (4.*np.pi)
+    L = int(stack_obj.metadata['ALOOKS']) * int(stack_obj.metadata['RLOOKS'])
+
+    # metadata
+    metadata = dict(stack_obj.metadata)
+    for key in configKeys:
+        metadata[key_prefix+key] = str(vars(inps)[key])
+    metadata['REF_DATE'] = date_list[0]
+    metadata['FILE_TYPE'] = 'timeseries'
+    metadata['UNIT'] = 'm'
+
+    # layout the output file next to the existing one, and replace it at the end
+    ts_file_tmp = os.path.join(os.path.dirname(ts_file), 'tmp_{}'.format(os.path.basename(ts_file)))
+    ts_obj = timeseries(ts_file_tmp)
+    dsNameDict = {
+        "date": ((np.dtype('S8'), (num_date,))),
+        "bperp": (np.float32, (num_date,)),
+        "timeseries": (np.float32, (num_date, length, width)),
+    }
+    ts_obj.layout_hdf5(dsNameDict, metadata)
+
+    temp_coh = np.zeros((length, width), np.float32)
+    num_inv_ifg = np.zeros((length, width), np.int16)
+
+    box_list = split2boxes(ifgram_file, max_memory=inps.maxMemory)
+    num_box = len(box_list)
+    for i, box in enumerate(box_list):
+        if num_box > 1:
+            print('\n------- Processing Patch {} out of {} --------------'.format(i+1, num_box))
+        num_pixel = (box[2] - box[0]) * (box[3] - box[1])
+
+        # existing time-series, referenced to the first date, in case reference_date.py is applied
+        ts_old = timeseries(ts_file).read(box=box, squeeze=False, print_msg=False)
+        ts_old = (ts_old - ts_old[0:1, :, :]).reshape(num_date_old, -1)
+
+        # Read/Mask unwrapPhase of the new interferograms
+        pha_data = read_unwrap_phase(stack_obj,
+                                     box,
+                                     ref_phase,
+                                     unwDatasetName=inps.unwDatasetName,
+                                     dropIfgram=True,
+                                     date12_list=date12_list_new)
+
+        pha_data = mask_unwrap_phase(pha_data,
+                                     stack_obj,
+                                     box,
+                                     dropIfgram=True,
+                                     mask_ds_name=inps.maskDataset,
+                                     mask_threshold=inps.maskThreshold,
+                                     date12_list=date12_list_new)
+
+        # move master date onto the last existing acquisition
+        for j, m_idx in enumerate(m_idx_list):
+            if m_idx is not None and m_idx != num_date_old - 1:
+                flag = pha_data[j, :] != 0.
+                pha_data[j, flag] += (ts_old[m_idx, flag] - ts_old[-1, flag]) / phase2range
+
+        # Mask for pixels to invert: non-zero phase in some new ifgrams, not on water
+        mask = np.any(pha_data, axis=0)
+        if inps.waterMaskFile:
+            dsName = [i for i in readfile.get_dataset_list(inps.waterMaskFile)
+                      if i in ['waterMask', 'mask']][0]
+            mask *= readfile.read(inps.waterMaskFile, datasetName=dsName, box=box)[0].flatten().astype(np.bool_)
+        idx_pixel2inv = np.where(mask)[0]
+        print('number of pixels to invert: {} out of {} ({:.1f}%)'.format(
+            idx_pixel2inv.size, num_pixel, idx_pixel2inv.size/num_pixel*100))
+
+        weight = None
+        if inps.weightFunc not in ['no', 'sbas'] and idx_pixel2inv.size > 0:
+            weight = read_coherence(stack_obj, box=box, dropIfgram=True, date12_list=date12_list_new)
+            weight = coherence2weight(weight[:, idx_pixel2inv], weight_func=inps.weightFunc, L=L, epsilon=5e-2)
+            weight = np.sqrt(weight)
+
+        # invert the network of the new acquisitions
+        ts_new = np.zeros((num_date_new, num_pixel), np.float32)
+        temp_coh_new = np.zeros(num_pixel, np.float32)
+        num_inv_ifg_new = np.zeros(num_pixel, np.int16)
+        (tsi,
+         temp_coh_new[idx_pixel2inv],
+         num_inv_ifg_new[idx_pixel2inv]) = estimate_timeseries_batch(A, B, tbase_diff,
+                                                                     ifgram=pha_data[:, idx_pixel2inv],
+                                                                     weight_sqrt=weight,
+                                                                     min_norm_velocity=inps.minNormVelocity,
+                                                                     min_redundancy=inps.minRedundancy)
+        del pha_data, weight
+        # pixels without any valid new interferogram carry the last existing acquisition forward,
+        # and are marked as invalid in the temporal coherence and number of interferograms below
+        ts_new[:, idx_pixel2inv] = tsi[1:, :] * phase2range
+        ts_new += ts_old[-1, :]
+
+        # write the block of timeseries to disk
+        ts = np.vstack((ts_old, ts_new)).reshape(num_date, box[3]-box[1], box[2]-box[0])
+        block = [0, num_date, box[1], box[3], box[0], box[2]]
+        ts_obj.write2hdf5_block(ts, datasetName='timeseries', block=block)
+        del ts_old, ts_new, ts
+
+        # temporal coherence / number of interferograms of the whole network
+        temp_coh_old = readfile.read(tcoh_file, box=box)[0].flatten()
+        num_inv_ifg_old = readfile.read(num_inv_file, box=box)[0].flatten()
+        num_inv_ifgi = num_inv_ifg_old + num_inv_ifg_new
+        temp_cohi = np.array(temp_coh_old, np.float32)
+        flag = num_inv_ifgi > 0
+        temp_cohi[flag] = ((temp_coh_old[flag] * num_inv_ifg_old[flag]
+                            + temp_coh_new[flag] * num_inv_ifg_new[flag]) / num_inv_ifgi[flag])
+        temp_cohi[num_inv_ifg_new == 0] = 0.
+        num_inv_ifgi[num_inv_ifg_new == 0] = 0
+        temp_coh[box[1]:box[3], box[0]:box[2]] = temp_cohi.reshape(box[3]-box[1], box[2]-box[0])
+        num_inv_ifg[box[1]:box[3], box[0]:box[2]] = num_inv_ifgi.reshape(box[3]-box[1], box[2]-box[0])
+
+    # write date and bperp to disk
+    print('-'*50)
+    date_list_utf8 = [dt.encode('utf-8') for dt in date_list]
+    ts_obj.write2hdf5_block(date_list_utf8, datasetName='date')
+    ts_obj.write2hdf5_block(stack_obj.get_perp_baseline_timeseries(dropIfgram=True), datasetName='bperp')
+    print('move {} to {}'.format(ts_file_tmp, ts_file))
+    os.replace(ts_file_tmp, ts_file)
+
+    # reference pixel
+    ref_y = int(stack_obj.metadata['REF_Y'])
+    ref_x = int(stack_obj.metadata['REF_X'])
+    num_inv_ifg[ref_y, ref_x] = num_ifgram
+    temp_coh[ref_y, ref_x] = 1.
+    write2hdf5_auxFiles(metadata, temp_coh, num_inv_ifg, suffix='', inps=inps)
+
+    m, s = divmod(time.time()-start_time, 60)
+    print('time used: {:02.0f} mins {:02.1f} secs.\n'.format(m, s))
+    return
+
+
 def parallel_ifgram_inversion_patch(data):
     """
-    This is the starting point for Dask futures. Futures start executing code here.
+    This is the starting point for Dask futures and local process pool workers.
+    Futures start executing code here.
     :param data:
     :return: The box
     """
@@ -1188,7 +1693,10 @@ def main(iargs=None):
 
     # Network Inversion
     if inps.residualNorm == 'L2':
-        ifgram_inversion(inps.ifgramStackFile, inps)
+        if inps.appendMode and run_or_append(inps) == 'append':
+            ifgram_inversion_append(inps.ifgramStackFile, inps)
+        else:
+            ifgram_inversion(inps.ifgramStackFile, inps)
     else:
         raise NotImplementedError('L1 norm minimization is not fully tested.')
         #ut.timeseries_inversion_L1(inps.ifgramStackFile, inps.timeseriesFile)
@@ -59,9 +59,19 @@ TEMPLATE = """template:
 ## no   - save   0% disk usage, fast [default]
 ## lzf  - save ~57% disk usage, relative slow
 ## gzip - save ~62% disk usage, very slow [not recommend]
+## chunkShape for the HDF5 chunk layout of 3D datasets in ifgramStack.h5 file:
+## auto  - guessed by h5py [default]
+## image - single 2D slices, fast for reading 2D images, i.e. view.py, geocode.py
+## pixel - full depth over small boxes, fast for reading time-series, i.e. ifgram_inversion.py, tsview.py
+##         slow to load for large stacks, use repack_hdf5.py after loading instead.
+## appendMode to load the new pairs only, e.g. for new acquisitions of an on-going monitoring:
+## existing ifgramStack.h5 with the same size is extended, instead of re-written, if all its pairs are in the input
 mintpy.load.processor      = auto  #[isce,snap,gamma,roipac], auto for isce
 mintpy.load.updateMode     = auto  #[yes / no], auto for yes, skip re-loading if HDF5 files are complete
 mintpy.load.compression    = auto  #[gzip / lzf / no], auto for no.
+mintpy.load.chunkShape     = auto  #[auto / image / pixel / z,y,x], auto for auto.
+mintpy.load.numWorker      = auto  #[int > 0], auto for 1, number of threads to read interferograms
+mintpy.load.appendMode     = auto  #[yes / no], auto for no, append the new pairs to the existing ifgramStack.h5
 ##---------for ISCE only:
 mintpy.load.metaFile       = auto  #[path2metadata_file], i.e.: ./master/IW1.xml, ./masterShelve/data.dat
 mintpy.load.baselineDir    = auto  #[path2baseline_dir], i.e.: ./baselines
@@ -122,6 +132,18 @@ def create_parser():
                         help='Disable the update mode, or skip checking dataset already loaded.')
     parser.add_argument('--compression', choices={'gzip', 'lzf', None}, default=None,
                         help='compress loaded geometry while writing HDF5 file, default: None.')
+    parser.add_argument('--chunk-shape', dest='chunkShape',
+                        help='HDF5 chunk layout of 3D datasets, auto / image / pixel / z,y,x (default: auto).\n'
+                             'image - single 2D slices, fast for view.py, geocode.py\n'
+                             'pixel - full depth over small boxes, fast for ifgram_inversion.py, tsview.py')
+    parser.add_argument('--num-worker', dest='numWorker', type=int,
+                        help='number of threads to read interferograms in parallel (default: 1).')
+    parser.add_argument('--mem', '--memory', dest='maxMemory',
+                        help='max memory of the HDF5 chunk caches while writing 3D datasets,\n'
+                             'e.g. 8GB, 512MB, or number in GB (default: 4).')
+    parser.add_argument('--append', dest='appendMode', action='store_true',
+                        help='Enable the append mode, to write the new pairs only into the existing stack file,\n'
+                             'if it has the same size and all its pairs are in the input.')
 
     parser.add_argument('-o', '--output', type=str, nargs=3, dest='outfile',
                         default=['./inputs/ifgramStack.h5',
@@ -177,11 +199,23 @@ def read_inps2dict(inps):
         value = template[prefix+key]
         if key in ['processor', 'updateMode', 'compression']:
             inpsDict[key] = template[prefix+key]
+        elif key in ['chunkShape', 'numWorker']:
+            # command line input has higher priority
+            if inpsDict[key] is None:
+                inpsDict[key] = template[prefix+key]
+        elif key in ['appendMode']:
+            inpsDict[key] = inpsDict[key] or template[prefix+key]
         elif value:
             inpsDict[prefix+key] = template[prefix+key]
 
     if inpsDict['compression'] == False:
         inpsDict['compression'] = None
+    if not inpsDict['chunkShape']:
+        inpsDict['chunkShape'] = 'auto'
+    # computing configurations, command line input has higher priority
+    if not inpsDict['maxMemory']:
+        inpsDict['maxMemory'] = template.get('mintpy.compute.maxMemory', None) or 4
+    inpsDict['numWorker'] = int(inpsDict['numWorker']) if inpsDict['numWorker'] else 1
 
     # PROJECT_NAME --> PLATFORM
     if not inpsDict['PROJECT_NAME']:
@@ -558,6 +592,35 @@ def update_object(outFile, inObj, box, updateMode=True):
     return write_flag
 
 
+def get_stack_access_mode(outFile, inObj, box, appendMode=False):
+    """Get the access mode to write ifgramStackDict into h5 file:
+        a - append the new pairs only, if: 1) appendMode is True,
+                                           2) h5 exists and readable,
+                                           3) it has the same size and datasets as ifgramStackDict,
+                                           4) all its date12 are in ifgramStackDict, in sorted order
+        w - write the whole file, otherwise.
+    """
+    access_mode = 'w'
+    if appendMode and ut.run_or_skip(outFile, check_readable=True) == 'skip':
+        in_size = inObj.get_size(box=box)[1:]
+        in_date12_list = inObj.get_date12_list()
+        in_dsNames = inObj.get_dataset_list()
+
+        outObj = ifgramStack(outFile)
+        outObj.open(print_msg=False)
+        out_size = outObj.get_size()[1:]
+        out_date12_list = outObj.get_date12_list(dropIfgram=False)
+
+        if (out_size == in_size
+                and set(out_date12_list).issubset(set(in_date12_list))
+                and out_date12_list == sorted(out_date12_list)
+                and all(i in outObj.datasetNames for i in in_dsNames)):
+            print('All date12 in file {} exist in the input with same size, append the new ones.'.format(
+                os.path.basename(outFile)))
+            access_mode = 'a'
+    return access_mode
+
+
 def prepare_metadata(inpsDict):
     processor = inpsDict['processor']
     script_name = 'prep_{}.py'.format(processor)
@@ -596,12 +659,15 @@ def prepare_metadata(inpsDict):
 def print_write_setting(inpsDict):
     updateMode = inpsDict['updateMode']
     comp = inpsDict['compression']
+    chunk = inpsDict['chunkShape']
     print('-'*50)
     print('updateMode : {}'.format(updateMode))
     print('compression: {}'.format(comp))
+    print('chunkShape : {}'.format(chunk))
+    print('appendMode : {}'.format(inpsDict['appendMode']))
     box = inpsDict['box']
     boxGeo = inpsDict['box4geo_lut']
-    return updateMode, comp, box, boxGeo
+    return updateMode, comp, chunk, box, boxGeo
 
 
 def get_extra_metadata(inpsDict):
@@ -632,7 +698,7 @@ def main(iargs=None):
     geomRadarObj, geomGeoObj = read_inps_dict2geometry_dict_object(inpsDict)
 
     # prepare wirte
-    updateMode, comp, box, boxGeo = print_write_setting(inpsDict)
+    updateMode, comp, chunk, box, boxGeo = print_write_setting(inpsDict)
     if any([stackObj, geomRadarObj, geomGeoObj]) and not os.path.isdir(inps.outdir):
         os.makedirs(inps.outdir)
         print('create directory: {}'.format(inps.outdir))
@@ -640,11 +706,21 @@ def main(iargs=None):
     # write
     if stackObj and update_object(inps.outfile[0], stackObj, box, updateMode=updateMode):
         print('-'*50)
-        stackObj.write2hdf5(outputFile=inps.outfile[0],
-                            access_mode='w',
-                            box=box,
-                            compression=comp,
-                            extra_metadata=extraDict)
+        appendMode = updateMode and inpsDict['appendMode']
+        if get_stack_access_mode(inps.outfile[0], stackObj, box, appendMode=appendMode) == 'a':
+            stackObj.append2hdf5(outputFile=inps.outfile[0],
+                                 box=box,
+                                 num_worker=inpsDict['numWorker'],
+                                 max_memory=inpsDict['maxMemory'])
+        else:
+            stackObj.write2hdf5(outputFile=inps.outfile[0],
+                                access_mode='w',
+                                box=box,
+                                compression=comp,
+                                extra_metadata=extraDict,
+                                chunk_layout=chunk,
+                                num_worker=inpsDict['numWorker'],
+                                max_memory=inpsDict['maxMemory'])
 
     if geomRadarObj and update_object(inps.outfile[1], geomRadarObj, box, updateMode=updateMode):
         print('-'*50)
@@ -652,14 +728,18 @@ def main(iargs=None):
                                 access_mode='w',
                                 box=box,
                                 compression='lzf',
-                                extra_metadata=extraDict)
+                                extra_metadata=extraDict,
+                                chunk_layout=chunk,
+                                max_memory=inpsDict['maxMemory'])
 
     if geomGeoObj and update_object(inps.outfile[2], geomGeoObj, boxGeo, updateMode=updateMode):
         print('-'*50)
         geomGeoObj.write2hdf5(outputFile=inps.outfile[2],
                               access_mode='w',
                               box=boxGeo,
-                              compression='lzf')
+                              compression='lzf',
+                              chunk_layout=chunk,
+                              max_memory=inpsDict['maxMemory'])
 
     return inps.outfile
 
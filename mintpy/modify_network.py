@@ -380,7 +380,7 @@ def get_date12_to_drop(inps):
     # connection number threshold
     if inps.connNumMax:
         seq_date12_list = pnet.select_pairs_sequential(dateList, inps.connNumMax)
-        seq_date12_list = ptime.yyyymmdd_date12(seq_date12_list)
+        seq_date12_list = set(ptime.yyyymmdd_date12(seq_date12_list))
         tempList = [i for i in date12ListAll if i not in seq_date12_list]
         date12_to_drop += tempList
         print('--------------------------------------------------')
@@ -447,6 +447,10 @@ def get_date12_to_drop(inps):
     date_to_drop = sorted(list(set(dateList) - set(date_to_keep)))
     if len(date_to_drop) > 0:
         print('number of acquisitions to remove: {}\n{}'.format(len(date_to_drop), date_to_drop))
+    if len(date12_to_keep) > 0:
+        num_subset = ifgramStack.get_number_of_network_subsets(date12_to_keep)
+        if num_subset > 1:
+            print('WARNING: the network to keep is NOT fully connected, with {} subsets!'.format(num_subset))
 
     date12ListKept = obj.get_date12_list(dropIfgram=True)
     date12ListDropped = sorted(list(set(date12ListAll) - set(date12ListKept)))
@@ -7,13 +7,25 @@
 #   from mintpy.utils import utils as ut
 
 
+import os
 from argparse import Namespace
+from collections import OrderedDict
 import numpy as np
+from scipy.spatial import cKDTree
 from mintpy.utils import readfile
 from mintpy.utils.utils0 import *
 from mintpy.utils.utils1 import *
 
 
+# spatial index of the recently used lookup tables shared among coordinate objects, in memory only,
+# {stamp: (tree, index)}, with the least recently used one dropped first
+LOOKUP_TREE_CACHE_SIZE = 2  # max number of lookup tables in the cache
+_lookup_tree_cache = OrderedDict()
+# min number of points to build the spatial index for, scan the lookup table point by point otherwise,
+# as building the index of a lookup table in 5M pixels takes as long as ~300 scans
+LOOKUP_TREE_MIN_NUM_POINT = 200
+
+
 #####################################  coordinate class begin ##############################################
 class coordinate:
     """
@@ -51,6 +63,7 @@ class coordinate:
         self.lookup_file = lookup_file
         self.lut_y = None
         self.lut_x = None
+        self.lut_tree = None
 
     def open(self):
         try:
@@ -185,6 +198,103 @@ class coordinate:
         return row, col
 
 
+    def _get_lookup_tree_stamp(self):
+        """Get the stamp of lookup table file(s) to check the validity of its spatial index"""
+        stamp = []
+        for fname in self.lookup_file:
+            fstat = os.stat(fname)
+            stamp.append((os.path.abspath(fname), fstat.st_size, fstat.st_mtime_ns))
+        return tuple(stamp)
+
+
+    def get_lookup_tree(self, print_msg=True):
+        """Get the spatial index (cKDTree) of the y/x values of the lookup table.
+        It is cached in memory for the recently used lookup tables,
+        and re-built whenever the lookup table file is changed.
+        Returns: tree : cKDTree object of the valid (y, x) values of the lookup table
+                 idx  : 1D np.ndarray of int, flattened index of the valid pixels in the lookup table
+        """
+        if self.lut_tree is not None:
+            return self.lut_tree
+
+        stamp = self._get_lookup_tree_stamp()
+        if stamp in _lookup_tree_cache.keys():
+            _lookup_tree_cache.move_to_end(stamp)
+            self.lut_tree = _lookup_tree_cache[stamp]
+            return self.lut_tree
+
+        # build from the lookup table
+        if self.lut_y is None or self.lut_x is None:
+            self.read_lookup_table(print_msg=print_msg)
+        lut_y = self.lut_y.flatten()
+        lut_x = self.lut_x.flatten()
+        valid = np.isfinite(lut_y) * np.isfinite(lut_x)
+        if 'Y_FIRST' in self.lut_metadata.keys():
+            # azimuth/rangeCoord of zero for no-data
+            valid *= (lut_y >= 0.5) * (lut_x >= 0.5)
+        idx = np.where(valid)[0]
+        if print_msg:
+            print('build spatial index of lookup table for {} pixels'.format(idx.size))
+        tree = cKDTree(np.hstack((lut_y[idx].reshape(-1, 1),
+                                  lut_x[idx].reshape(-1, 1))))
+        self.lut_tree = (tree, idx)
+
+        _lookup_tree_cache[stamp] = self.lut_tree
+        while len(_lookup_tree_cache) > LOOKUP_TREE_CACHE_SIZE:
+            _lookup_tree_cache.popitem(last=False)
+        return self.lut_tree
+
+
+    def _get_lookup_row_col_batch(self, y, x, y_factor=10, x_factor=10, print_msg=True):
+        """Get row/col number in y/x value matrix for a batch of input y/x, vectorized version of
+        _get_lookup_row_col() based on the spatial index of the lookup table,
+        or via _get_lookup_row_col() for a few points if the spatial index is not built yet.
+        Parameters: y/x          : 1D np.ndarray of float, y/x values to search
+                    y/x_factor   : float, half size of the searching buffer in y/x direction
+        Returns:    row/col      : 1D np.ndarray of float, mean row/col number of the buffer overlap
+        """
+        y = np.array(y, dtype=np.float64).flatten()
+        x = np.array(x, dtype=np.float64).flatten()
+
+        # scan the lookup table point by point
+        if (y.size < LOOKUP_TREE_MIN_NUM_POINT
+                and self.lut_tree is None
+                and self._get_lookup_tree_stamp() not in _lookup_tree_cache.keys()):
+            if self.lut_y is None or self.lut_x is None:
+                self.read_lookup_table(print_msg=print_msg)
+            geo_coord = 'Y_FIRST' not in self.lut_metadata.keys()
+            row = np.zeros(y.size)
+            col = np.zeros(y.size)
+            for i in range(y.size):
+                row[i], col[i] = self._get_lookup_row_col(y[i], x[i], y_factor, x_factor, geo_coord=geo_coord)
+            return row, col
+
+        tree, idx = self.get_lookup_tree(print_msg=print_msg)
+        width = self.lut_x.shape[1] if self.lut_x is not None else int(self.lut_metadata['WIDTH'])
+
+        # candidates within the square buffer, then within the rectangle buffer
+        pts = np.hstack((y.reshape(-1, 1), x.reshape(-1, 1)))
+        cand_list = tree.query_ball_point(pts, r=max(y_factor, x_factor), p=np.inf)
+        num_cand = np.array([len(i) for i in cand_list], dtype=np.int64)
+        cand = np.array(np.concatenate(cand_list), dtype=np.int64) if num_cand.sum() > 0 else np.zeros(0, np.int64)
+        pt_idx = np.repeat(np.arange(y.size), num_cand)
+
+        yx_cand = tree.data[cand]
+        flag = ((np.abs(yx_cand[:, 0] - y[pt_idx]) <= y_factor) *
+                (np.abs(yx_cand[:, 1] - x[pt_idx]) <= x_factor))
+        pt_idx = pt_idx[flag]
+        row_cand, col_cand = np.divmod(idx[cand[flag]], width)
+
+        # mean of row/col numbers
+        num = np.bincount(pt_idx, minlength=y.size)
+        if np.any(num == 0):
+            i = np.where(num == 0)[0][0]
+            raise RuntimeError('No coresponding coordinate found for y/x: {}/{}'.format(y[i], x[i]))
+        row = np.bincount(pt_idx, weights=row_cand, minlength=y.size) / num
+        col = np.bincount(pt_idx, weights=col_cand, minlength=y.size) / num
+        return row, col
+
+
     def read_lookup_table(self, print_msg=True):
         if 'Y_FIRST' in self.lut_metadata.keys():
             self.lut_y = readfile.read(self.lookup_file[0],
@@ -236,11 +346,11 @@ class coordinate:
         # read lookup table
         if self.lookup_file is None:
             raise FileNotFoundError('No lookup table file found!')
-        if self.lut_y is None or self.lut_x is None:
-            self.read_lookup_table(print_msg=print_msg)
 
         # For lookup table in geo-coord, read value directly (GAMMA and ROI_PAC)
         if 'Y_FIRST' in self.lut_metadata.keys():
+            if self.lut_y is None or self.lut_x is None:
+                self.read_lookup_table(print_msg=print_msg)
             lut = self._read_geo_lut_metadata()
 
             # if source data file is subsetted before
@@ -279,21 +389,33 @@ class coordinate:
             az, rg = np.zeros(lat.shape), np.zeros(lat.shape)
             x_factor = 10
             y_factor = 10
+            if debug_mode and (self.lut_y is None or self.lut_x is None):
+                self.read_lookup_table(print_msg=print_msg)
 
             # search the overlap area of buffer in x/y direction and use the cross center
-            if lat.size == 1:
-                az, rg = self._get_lookup_row_col(lat, lon,
-                                                  y_factor*az_step_deg,
-                                                  x_factor*rg_step_deg,
-                                                  geo_coord=True,
-                                                  debug_mode=debug_mode)
+            if debug_mode:
+                if lat.size == 1:
+                    az, rg = self._get_lookup_row_col(lat, lon,
+                                                      y_factor*az_step_deg,
+                                                      x_factor*rg_step_deg,
+                                                      geo_coord=True,
+                                                      debug_mode=debug_mode)
+                else:
+                    for i in range(rg.size):
+                        az[i], rg[i] = self._get_lookup_row_col(lat[i], lon[i],
+                                                                y_factor*az_step_deg,
+                                                                x_factor*rg_step_deg,
+                                                                geo_coord=True,
+                                                                debug_mode=debug_mode)
             else:
-                for i in range(rg.size):
-                    az[i], rg[i] = self._get_lookup_row_col(lat[i], lon[i],
-                                                            y_factor*az_step_deg,
-                                                            x_factor*rg_step_deg,
-                                                            geo_coord=True,
-                                                            debug_mode=debug_mode)
+                az, rg = self._get_lookup_row_col_batch(lat, lon,
+                                                        y_factor*az_step_deg,
+                                                        x_factor*rg_step_deg,
+                                                        print_msg=print_msg)
+                if lat.size == 1:
+                    az, rg = az[0], rg[0]
+                else:
+                    az, rg = az.reshape(lat.shape), rg.reshape(lat.shape)
             az = np.floor(az).astype(int)
             rg = np.floor(rg).astype(int)
 
@@ -322,8 +444,9 @@ class coordinate:
         # read lookup table file
         if self.lookup_file is None:
             raise FileNotFoundError('No lookup table file found!')
-        if self.lut_y is None or self.lut_x is None:
-            self.read_lookup_table(print_msg=print_msg)
+        if debug_mode or 'Y_FIRST' not in self.lut_metadata.keys():
+            if self.lut_y is None or self.lut_x is None:
+                self.read_lookup_table(print_msg=print_msg)
 
         # For lookup table in geo-coord, search the buffer and use center pixel
         if 'Y_FIRST' in self.lut_metadata.keys():
@@ -345,15 +468,23 @@ class coordinate:
 
             lut_row = np.zeros(rg.shape)
             lut_col = np.zeros(rg.shape)
-            if rg.size == 1:
-                lut_row, lut_col = self._get_lookup_row_col(az, rg, y_factor, x_factor,
-                                                            debug_mode=debug_mode)
+            if debug_mode:
+                if rg.size == 1:
+                    lut_row, lut_col = self._get_lookup_row_col(az, rg, y_factor, x_factor,
+                                                                debug_mode=debug_mode)
+                else:
+                    for i in range(rg.size):
+                        (lut_row[i],
+                         lut_col[i]) = self._get_lookup_row_col(az[i], rg[i],
+                                                                y_factor, x_factor,
+                                                                debug_mode=debug_mode)
             else:
-                for i in range(rg.size):
-                    (lut_row[i],
-                     lut_col[i]) = self._get_lookup_row_col(az[i], rg[i],
-                                                            y_factor, x_factor,
-                                                            debug_mode=debug_mode)
+                lut_row, lut_col = self._get_lookup_row_col_batch(az, rg, y_factor, x_factor,
+                                                                  print_msg=print_msg)
+                if rg.size == 1:
+                    lut_row, lut_col = lut_row[0], lut_col[0]
+                else:
+                    lut_row, lut_col = lut_row.reshape(rg.shape), lut_col.reshape(rg.shape)
             lat = (lut_row + 0.5) * lut.lat_step_deg + lut.lat0
             lon = (lut_col + 0.5) * lut.lon_step_deg + lut.lon0
             lat_resid = abs(y_factor * lut.lat_step_deg)
@@ -12,6 +12,7 @@ import os
 import time
 import codecs
 from datetime import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pyproj import Geod
 from urllib.request import urlretrieve
@@ -23,6 +24,22 @@ from mintpy.utils import ptime, readfile, utils0 as ut
 
 unr_site_list_file = 'http://geodesy.unr.edu/NGLStationPages/DataHoldings.txt'
 
+# columns of the tenv3 file to read, and their names in the parsed data
+# link: http://geodesy.unr.edu/gps_timeseries/README_tenv3.txt
+TENV3_COLUMNS = {
+    'date'    : 1,
+    'ref_lon' : 6,
+    'e0'      : 7,
+    'dis_e'   : 8,
+    'n0'      : 9,
+    'dis_n'   : 10,
+    'dis_u'   : 12,
+    'std_e'   : 14,
+    'std_n'   : 15,
+    'std_u'   : 16,
+}
+MONTH_NAMES = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
 
 def dload_site_list(print_msg=True):
     """download DataHoldings.txt"""
@@ -103,6 +120,53 @@ def get_baseline_change(dates1, pos_x1, pos_y1, pos_z1,
     return dates, bases
 
 
+def yymmmdd2datetime64(date_strs):
+    """Convert dates in YYMMMDD format (e.g. 18JUN25) into np.datetime64, in a vectorized way,
+    with the same century rule as time.strptime('%y'), i.e. 69-99 for 19XX and 00-68 for 20XX.
+    Parameters: date_strs : 1D np.ndarray / list of str in YYMMMDD format
+    Returns:    dates     : 1D np.ndarray of datetime64[D]
+    """
+    date_strs = np.char.upper(np.asarray(date_strs, dtype='U7'))
+    chars = date_strs.view('U1').reshape(-1, 7)
+
+    year = np.char.add(chars[:, 0], chars[:, 1]).astype(np.int64)
+    year += np.where(year < 69, 2000, 1900)
+    day = np.char.add(chars[:, 5], chars[:, 6]).astype(np.int64)
+
+    # month names via the unique values only
+    mon_strs = np.char.add(np.char.add(chars[:, 2], chars[:, 3]), chars[:, 4])
+    mon_uniq, mon_idx = np.unique(mon_strs, return_inverse=True)
+    month = np.array([MONTH_NAMES.index(i) + 1 for i in mon_uniq], dtype=np.int64)[mon_idx.flatten()]
+
+    dates = ((year - 1970) * 12 + month - 1).astype('datetime64[M]').astype('datetime64[D]')
+    dates += (day - 1).astype('timedelta64[D]')
+    return dates
+
+
+def read_tenv3_file(fname):
+    """Read the GPS time-series file in tenv3 format from Nevada Geodetic Lab, column by column.
+    Parameters: fname : str, path of the tenv3 file
+    Returns:    data  : dict of 1D np.ndarray, with keys of TENV3_COLUMNS:
+                        date      - datetime64[D]
+                        ref_lon   - float64, reference longitude in degrees
+                        e0/n0     - float64, integer part of the east/north position in meters
+                        dis_e/n/u - float32, displacement in meters
+                        std_e/n/u - float32, displacement STD in meters
+    """
+    names = list(TENV3_COLUMNS.keys())
+    cols = np.loadtxt(fname, dtype=str, skiprows=1, usecols=list(TENV3_COLUMNS.values()), ndmin=2).T
+
+    data = dict()
+    for name, col in zip(names, cols):
+        if name == 'date':
+            data[name] = yymmmdd2datetime64(col)
+        elif name in ['ref_lon', 'e0', 'n0']:
+            data[name] = col.astype(np.float64)
+        else:
+            data[name] = col.astype(np.float32)
+    return data
+
+
 ## GPS-GSI: utility functions
 def read_pos_file(fname):
     fcp = codecs.open(fname, encoding = 'cp1252')
@@ -205,10 +269,12 @@ class GPS:
         # list of stations from Nevada Geodetic Lab
         self.site_list_file = os.path.join(data_dir, 'DataHoldings.txt')
 
+        # parsed time-series, kept in memory
+        self.data = None
+
         # directories for data files and plot files
         for fdir in [data_dir, os.path.dirname(self.plot_file)]:
-            if not os.path.isdir(fdir):
-                os.makedirs(fdir)
+            os.makedirs(fdir, exist_ok=True)
 
     def open(self, print_msg=True):
         if not os.path.isfile(self.file):
@@ -218,25 +284,42 @@ class GPS:
 
     def dload_site(self, print_msg=True):
         if print_msg:
-            print('downloading {} from {}'.format(self.site, url))
+            print('downloading {} from {}'.format(self.site, self.file_url))
 
         urlretrieve(self.file_url, self.file)
         urlretrieve(self.plot_file_url, self.plot_file)
 
         return self.file
 
+    def get_source_stamp(self):
+        """Get the stamp of the tenv3 file to identify outdated data in memory"""
+        fstat = os.stat(self.file)
+        return '{}_{}'.format(fstat.st_size, fstat.st_mtime_ns)
+
+    def read_tenv3(self, print_msg=True):
+        """Read the whole time-series of the tenv3 file, once per object unless the file changes.
+        Returns: data : dict of 1D np.ndarray, as returned by read_tenv3_file()
+        """
+        if not os.path.isfile(self.file):
+            self.dload_site(print_msg=print_msg)
+        stamp = self.get_source_stamp()
+        if self.data is not None and self.data['stamp'] == stamp:
+            return self.data
+
+        data = read_tenv3_file(self.file)
+        data['stamp'] = stamp
+        self.data = data
+        return self.data
+
     def get_stat_lat_lon(self, print_msg=True):
         """Get station lat/lon"""
         if print_msg:
             print('calculating station lat/lon')
-        if not os.path.isfile(self.file):
-            self.dload_site(print_msg=print_msg)
+        data = self.read_tenv3(print_msg=print_msg)
 
-        data = np.loadtxt(self.file, dtype=bytes, skiprows=1).astype(str)
-        ref_lon, ref_lat = float(data[0, 6]), 0.
-        e0, e_off, n0, n_off = data[0, 7:11].astype(np.float)
-        e0 += e_off
-        n0 += n_off
+        ref_lon, ref_lat = float(data['ref_lon'][0]), 0.
+        e0 = data['e0'][0] + float(data['dis_e'][0])
+        n0 = data['n0'][0] + float(data['dis_n'][0])
 
         az = np.arctan2(e0, n0) / np.pi * 180.
         dist = np.sqrt(e0**2 + n0**2)
@@ -251,39 +334,24 @@ class GPS:
                     dis_e/n/u : 1D np.ndarray of displacement in meters in np.float32
                     std_e/n/u : 1D np.ndarray of displacement STD in meters in np.float32
         """
-        # download file if it's not exists.
-        if not os.path.isfile(self.file):
-            self.dload_site(print_msg=print_msg)
-
         # read dates, dis_e, dis_n, dis_u
         if print_msg:
             print('reading time and displacement in east/north/vertical direction')
-        data = np.loadtxt(self.file, dtype=bytes, skiprows=1).astype(str)
-        self.dates = np.array([dt(*time.strptime(i, "%y%b%d")[0:5])
-                               for i in data[:, 1]])
-        #self.dates = np.array([ptime.decimal_year2datetime(i) for i in data[:, 2]])
-        (self.dis_e,
-         self.dis_n,
-         self.dis_u,
-         self.std_e,
-         self.std_n,
-         self.std_u) = data[:, (8,10,12,14,15,16)].astype(np.float32).T
+        data = self.read_tenv3(print_msg=print_msg)
 
         # cut out the specified time range
-        t_flag = np.ones(len(self.dates), np.bool_)
+        t_flag = np.ones(data['date'].size, np.bool_)
         if start_date:
-            t0 = ptime.date_list2vector([start_date])[0][0]
-            t_flag[self.dates < t0] = 0
+            t_flag *= data['date'] >= np.datetime64(dt.strptime(start_date, '%Y%m%d'), 'D')
         if end_date:
-            t1 = ptime.date_list2vector([end_date])[0][0]
-            t_flag[self.dates > t1] = 0
-        self.dates = self.dates[t_flag]
-        self.dis_e = self.dis_e[t_flag]
-        self.dis_n = self.dis_n[t_flag]
-        self.dis_u = self.dis_u[t_flag]
-        self.std_e = self.std_e[t_flag]
-        self.std_n = self.std_n[t_flag]
-        self.std_u = self.std_u[t_flag]
+            t_flag *= data['date'] <= np.datetime64(dt.strptime(end_date, '%Y%m%d'), 'D')
+        self.dates = data['date'][t_flag].astype('datetime64[s]').astype(object)
+        self.dis_e = data['dis_e'][t_flag]
+        self.dis_n = data['dis_n'][t_flag]
+        self.dis_u = data['dis_u'][t_flag]
+        self.std_e = data['std_e'][t_flag]
+        self.std_n = data['std_n'][t_flag]
+        self.std_u = data['std_u'][t_flag]
 
         if display:
             import matplotlib.pyplot as plt
@@ -368,7 +436,8 @@ class GPS:
         Parameters: geom_obj : dict / str, metadata of InSAR file, or geometry file path
                     start_date : string in YYYYMMDD format
                     end_date   : string in YYYYMMDD format
-                    ref_site   : string, reference GPS site
+                    ref_site   : string / GPS object, reference GPS site,
+                                 pass the GPS object to reuse its data read already
                     gps_comp   : string, GPS components used to convert to LOS direction
         Returns:    dates : 1D np.array of datetime.datetime object
                     dis   : 1D np.array of displacement in meters
@@ -384,21 +453,24 @@ class GPS:
 
         # get LOS displacement relative to another GPS site
         if ref_site:
-            ref_obj = GPS(site=ref_site, data_dir=self.data_dir)
+            if isinstance(ref_site, GPS):
+                ref_obj = ref_site
+            else:
+                ref_obj = GPS(site=ref_site, data_dir=self.data_dir, version=self.version)
             ref_obj.read_displacement(start_date, end_date, print_msg=print_msg)
             inc_angle, head_angle = ref_obj.get_los_geometry(geom_obj)
             ref_obj.displacement_enu2los(inc_angle, head_angle, gps_comp=gps_comp)
             ref_site_lalo = ref_obj.get_stat_lat_lon(print_msg=print_msg)
 
             # get relative LOS displacement on common dates
-            dates = np.array(sorted(list(set(self.dates) & set(ref_obj.dates))))
-            dis = np.zeros(dates.shape, np.float32)
-            std = np.zeros(dates.shape, np.float32)
-            for i in range(len(dates)):
-                idx1 = np.where(self.dates == dates[i])[0][0]
-                idx2 = np.where(ref_obj.dates == dates[i])[0][0]
-                dis[i] = self.dis_los[idx1] - ref_obj.dis_los[idx2]
-                std[i] = (self.std_los[idx1]**2 + ref_obj.std_los[idx2]**2)**0.5
+            # dates are unique and sorted in the tenv3 file
+            idx1, idx2 = np.intersect1d(self.dates.astype('datetime64[s]'),
+                                        ref_obj.dates.astype('datetime64[s]'),
+                                        assume_unique=True,
+                                        return_indices=True)[1:]
+            dates = self.dates[idx1]
+            dis = (self.dis_los[idx1] - ref_obj.dis_los[idx2]).astype(np.float32)
+            std = ((self.std_los[idx1]**2 + ref_obj.std_los[idx2]**2)**0.5).astype(np.float32)
         else:
             ref_site_lalo = None
 
@@ -420,3 +492,33 @@ class GPS:
         return self.velocity
 
 #################################### End of GPS-UNR class ####################################
+
+
+def read_gps_sites(site_names, data_dir='./GPS', version='IGS14', start_date=None, end_date=None,
+                   num_worker=4, print_msg=True):
+    """Read the displacement time-series of multiple GPS sites concurrently
+    Parameters: site_names : list of str, GPS site names
+                data_dir   : str, directory of the tenv3 files
+                start_date : str in YYYYMMDD format
+                end_date   : str in YYYYMMDD format
+                num_worker : int, number of threads to download / read the files
+    Returns:    gps_objs   : dict of GPS objects, with site_lat/lon, dates, dis_e/n/u and std_e/n/u read,
+                             ready for displacement_enu2los()
+    """
+    site_names = list(dict.fromkeys(site_names))
+    num_worker = max(1, min(num_worker, len(site_names)))
+
+    def read_site(site):
+        obj = GPS(site, data_dir=data_dir, version=version)
+        obj.get_stat_lat_lon(print_msg=False)
+        obj.read_displacement(start_date, end_date, print_msg=False)
+        return obj
+
+    gps_objs = dict()
+    prog_bar = ptime.progressBar(maxValue=len(site_names), print_msg=print_msg)
+    with ThreadPoolExecutor(max_workers=num_worker) as executor:
+        for i, obj in enumerate(executor.map(read_site, site_names)):
+            gps_objs[obj.site] = obj
+            prog_bar.update(i+1, suffix=obj.site)
+    prog_bar.close()
+    return gps_objs
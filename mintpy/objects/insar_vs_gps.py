@@ -9,18 +9,67 @@
 
 import sys
 import numpy as np
-from scipy import stats
-from scipy.interpolate import griddata
+from scipy import stats, sparse
+from scipy.spatial import Delaunay, cKDTree
 import time
 from datetime import datetime as dt
 from dateutil.relativedelta import relativedelta
 
 from mintpy.objects import timeseries, giantTimeseries
 from mintpy.utils import readfile, plot as pp, utils as ut
-from mintpy.objects.gps import GPS
+from mintpy.objects.gps import read_gps_sites
 from mintpy.defaults.plot import *
 
 
+def get_interpolation_matrix(src_pts, dest_pts, method='linear'):
+    """Get the sparse matrix to interpolate values at the scattered source points onto the destination points,
+    with one triangulation / KD-tree for all the values in the same source points, e.g. all acquisitions:
+        dest_value = W.dot(src_value), with src_value in size of (num_src, ...)
+    It is equivalent to scipy.interpolate.griddata(src_pts, src_value, dest_pts, method=method).
+    Parameters: src_pts  : 2D np.ndarray in size of (num_src, 2)
+                dest_pts : 2D np.ndarray in size of (num_dest, 2)
+                method   : str, nearest or linear
+    Returns:    W        : 2D scipy.sparse.csr_matrix in size of (num_dest, num_src)
+                flag     : 1D np.ndarray of bool in size of (num_dest,),
+                           False for destination points outside of the convex hull of the source points,
+                           which are NaN in griddata() with linear method.
+    """
+    num_dest = dest_pts.shape[0]
+    if method == 'nearest':
+        idx = cKDTree(src_pts).query(dest_pts)[1]
+        W = sparse.csr_matrix((np.ones(num_dest), (np.arange(num_dest), idx)),
+                              shape=(num_dest, src_pts.shape[0]))
+        flag = np.ones(num_dest, dtype=np.bool_)
+
+    elif method == 'linear':
+        # barycentric coordinates of the destination points in the enclosing triangle
+        tri = Delaunay(src_pts)
+        simplex = tri.find_simplex(dest_pts)
+        flag = simplex >= 0
+        trans = tri.transform[simplex[flag]]
+        bary = np.einsum('ijk,ik->ij', trans[:, :2, :], dest_pts[flag] - trans[:, 2, :])
+        weight = np.hstack((bary, 1. - np.sum(bary, axis=1, keepdims=True)))
+        W = sparse.csr_matrix((weight.flatten(),
+                               (np.repeat(np.where(flag)[0], 3), tri.simplices[simplex[flag]].flatten())),
+                              shape=(num_dest, src_pts.shape[0]))
+
+    else:
+        raise ValueError('un-supported interpolation method: {}'.format(method))
+    return W, flag
+
+
+def get_common_date_index(dates1, dates2):
+    """Get the index of the common dates in the two lists of datetime objects.
+    Parameters: dates1/2       : 1D array / list of datetime.datetime objects
+    Returns:    comm_dates     : 1D np.ndarray of datetime.datetime objects, common dates in ascending order
+                comm_idx1/2    : 1D np.ndarray of int, index of the first occurrence of comm_dates in dates1/2
+    """
+    dates1 = np.array(dates1, dtype='datetime64[s]')
+    dates2 = np.array(dates2, dtype='datetime64[s]')
+    comm_dates, comm_idx1, comm_idx2 = np.intersect1d(dates1, dates2, return_indices=True)
+    return comm_dates.astype(object), comm_idx1, comm_idx2
+
+
 class insar_vs_gps:
     """ Comparing InSAR time-series with GPS time-series in LOS direction
     Parameters: ts_file        : str, time-series HDF5 file
@@ -106,17 +155,27 @@ class insar_vs_gps:
         return
 
     def read_gps(self):
+        # download / read all sites and the reference site at once
+        print('reading {} GPS sites'.format(len(self.site_names)))
+        site_names = list(self.site_names)
+        if self.ref_site:
+            site_names.append(self.ref_site)
+        gps_objs = read_gps_sites(site_names,
+                                  data_dir=self.gps_dir,
+                                  start_date=self.start_date,
+                                  end_date=self.end_date)
+        ref_obj = gps_objs[self.ref_site] if self.ref_site else None
+
         for sname in self.site_names:
             site = {}
             site['name'] = sname
-            gps_obj = GPS(sname, data_dir=self.gps_dir)
-            gps_obj.open(print_msg=False)
+            gps_obj = gps_objs[sname]
             site['lat'] = gps_obj.site_lat
             site['lon'] = gps_obj.site_lon
             (site['gps_datetime'],
              site['gps_dis'],
              site['gps_std']) = gps_obj.read_gps_los_displacement(self.geom_file, self.start_date, self.end_date,
-                                                                  ref_site=self.ref_site,
+                                                                  ref_site=ref_obj,
                                                                   gps_comp='enu2los')[0:3]
             site['reference_site'] = self.ref_site
             self.ds[sname] = site
@@ -142,26 +201,30 @@ class insar_vs_gps:
             dest_pts[i,:] = site['lat'], site['lon']
 
         # 2.2 interpolation - displacement / temporal coherence
-        interp_method = 'linear'   #nearest, linear, cubic
+        # with the same interpolation weights for all acquisitions
+        interp_method = 'linear'   #nearest, linear
+        print('calculate the {} interpolation weights of {} sites'.format(interp_method, self.num_site))
+        W, flag = get_interpolation_matrix(src_pts, dest_pts, method=interp_method)
+
+        print('reading InSAR acquisitions')
         src_value, atr = readfile.read(self.insar_file, box=pix_box)
         src_value = src_value.reshape(self.num_date, -1)
         if atr['FILE_TYPE'] == 'giantTimeseries':
             src_value *= 0.001
-        insar_dis = np.zeros((self.num_site, self.num_date))
-        for i in range(self.num_date):
-            insar_dis[:,i] = griddata(src_pts, src_value[i,:], dest_pts, method=interp_method)
-            sys.stdout.write(('\rreading InSAR acquisition {}/{}'
-                              ' with {} interpolation').format(i+1, self.num_date, interp_method))
-            sys.stdout.flush()
-        print()
+        insar_dis = np.array(W.dot(src_value.T), dtype=np.float64)
+        insar_dis[~flag, :] = np.nan
 
         print('reading temporal coherence')
         src_value = readfile.read(self.temp_coh_file, box=pix_box)[0].flatten()
-        temp_coh = griddata(src_pts, src_value, dest_pts, method=interp_method)
+        temp_coh = np.array(W.dot(src_value), dtype=np.float64)
+        temp_coh[~flag] = np.nan
 
         # 2.3 write interpolation result
         self.insar_dis_name = 'insar_dis_{}'.format(interp_method)
-        insar_dis_ref = insar_dis[self.site_names.index(self.ref_site),:]
+        if self.ref_site:
+            insar_dis_ref = insar_dis[self.site_names.index(self.ref_site),:]
+        else:
+            insar_dis_ref = 0.
         for i in range(self.num_site):
             site = self.ds[self.site_names[i]]
             site['insar_datetime'] = self.insar_datetime
@@ -175,22 +238,18 @@ class insar_vs_gps:
             gps_date = site['gps_datetime']
             insar_date = site['insar_datetime']
 
-            # find common reference date
+            # find common reference date: the 1st common date since min_ref_date
             ref_date = dt(*time.strptime(self.min_ref_date, "%Y%m%d")[0:5])
-            ref_idx = insar_date.tolist().index(ref_date)
-            while ref_idx < self.num_date:
-                if insar_date[ref_idx] not in gps_date:
-                    ref_idx += 1
-                else:
-                    break
-            if ref_idx == self.num_date:
+            comm_idx_insar, comm_idx_gps = get_common_date_index(insar_date, gps_date)[1:]
+            flag = np.array(insar_date)[comm_idx_insar] >= ref_date
+            if not np.any(flag):
                 raise RuntimeError('InSAR and GPS do not share ANY date for site: {}'.format(site['name']))
-            comm_date = insar_date[ref_idx]
+            ref_idx = comm_idx_insar[flag][0]
 
             # reference insar in time
             site[self.insar_dis_name] -= site[self.insar_dis_name][ref_idx]
             # reference gps dis/std in time
-            ref_idx_gps = np.where(gps_date == comm_date)[0][0]
+            ref_idx_gps = comm_idx_gps[flag][0]
             site['gps_dis'] -= site['gps_dis'][ref_idx_gps]
             site['gps_std'] = np.sqrt(site['gps_std']**2 + site['gps_std'][ref_idx_gps]**2)
             site['gps_std_mean'] = np.mean(site['gps_std'])
@@ -203,17 +262,12 @@ class insar_vs_gps:
             site = self.ds[self.site_names[i]]
             gps_date = site['gps_datetime']
             insar_date = site['insar_datetime']
-            comm_dates = np.array(sorted(list(set(gps_date) & set(insar_date))))
+            comm_dates, idx1, idx2 = get_common_date_index(gps_date, insar_date)
             num_comm_date = len(comm_dates)
-        
+
             # get displacement at common dates
-            comm_dis_insar = np.zeros(num_comm_date, np.float32)
-            comm_dis_gps   = np.zeros(num_comm_date, np.float32)
-            for j in range(num_comm_date):
-                idx1 = np.where(gps_date   == comm_dates[j])[0][0]
-                idx2 = np.where(insar_date == comm_dates[j])[0][0]
-                comm_dis_gps[j]   = site['gps_dis'][idx1]
-                comm_dis_insar[j] = site[self.insar_dis_name][idx2]
+            comm_dis_gps   = np.array(site['gps_dis'][idx1], np.float32)
+            comm_dis_insar = np.array(site[self.insar_dis_name][idx2], np.float32)
             site['comm_dis_gps'] = comm_dis_gps
             site['comm_dis_insar'] = comm_dis_insar
             site['r_square'] = stats.linregress(comm_dis_gps, comm_dis_insar)[2]
@@ -0,0 +1,220 @@
+############################################################
+# Program is part of MintPy                                #
+# Copyright (c) 2013, Zhang Yunjun, Heresh Fattahi         #
+############################################################
+# Recommend import:
+#     from mintpy.objects.overview import overview
+
+
+import os
+import h5py
+import numpy as np
+from mintpy.utils import ptime, readfile, utils as ut
+from mintpy.multilook import multilook_data, multilook_attribute
+
+
+class overview:
+    """
+    Multi-resolution overview pyramid of a HDF5 file for fast display, e.g. in view.py and tsview.py.
+
+    Each level is a sidecar HDF5 file next to the source file, e.g. .timeseries_ovr4.h5 for level 4,
+    with the same structure as the source file, and all 2D/3D datasets in the size of (LENGTH, WIDTH)
+    multilooked by the level factor, thus it can be read with readfile.read() as the source file.
+    The sidecar files are only written by build(), i.e. on explicit request.
+    All levels are multilooked from the source file directly, thus the same as multilooking the data
+    in full resolution: float / complex datasets are averaged with multilook_data(), the others are decimated.
+    Each level file records the size and modification time of the source file,
+    and is considered outdated once the source file changes.
+
+    Example:
+        ovr_obj = overview('timeseries.h5')
+        ovr_obj.build(max_memory=4)
+        level = ovr_obj.select_level(box, out_shape=(600, 800))
+        data = ovr_obj.read(level, datasetName=date_list, box=box)[0]
+    """
+
+    def __init__(self, file, min_size=256):
+        self.file = file
+        self.min_size = min_size
+        self.metadata = readfile.read_attribute(file)
+        self.length = int(self.metadata['LENGTH'])
+        self.width = int(self.metadata['WIDTH'])
+
+        # all possible levels, coarsest level with at least min_size pixels in each dimension
+        self.level_list = []
+        level = 2
+        while min(self.length, self.width) // level >= self.min_size:
+            self.level_list.append(level)
+            level *= 2
+
+    def get_level_file(self, level):
+        """Get the file name of the overview in the input level"""
+        fdir, fbase = os.path.split(os.path.abspath(self.file))
+        fbase, fext = os.path.splitext(fbase)
+        return os.path.join(fdir, '.{}_ovr{}{}'.format(fbase, level, fext))
+
+    def get_source_stamp(self):
+        """Get the stamp of the source file to identify outdated overviews"""
+        fstat = os.stat(self.file)
+        return '{}_{}'.format(fstat.st_size, fstat.st_mtime_ns)
+
+    def is_valid(self, level):
+        """Check whether the overview of the input level exists and is up to date"""
+        ovr_file = self.get_level_file(level)
+        if not os.path.isfile(ovr_file):
+            return False
+        try:
+            with h5py.File(ovr_file, 'r') as f:
+                stamp = f.attrs.get('OVERVIEW_SOURCE_STAMP', None)
+        except OSError:
+            return False
+        if isinstance(stamp, bytes):
+            stamp = stamp.decode('utf8')
+        return stamp == self.get_source_stamp()
+
+    def get_valid_level_list(self):
+        return [i for i in self.level_list if self.is_valid(i)]
+
+    def build(self, max_memory=4, print_msg=True):
+        """Build / update the overviews of all levels
+        Parameters: max_memory : float, max memory in GB to use per block
+        Returns:    level_list : list of int, levels of the valid overviews
+        """
+        if os.path.splitext(self.file)[1] not in ['.h5', '.he5']:
+            raise ValueError('overview is only supported for HDF5 file: {}'.format(self.file))
+
+        src_shape = (self.length, self.width)
+        for level in self.level_list:
+            if not self.is_valid(level):
+                ovr_file = self.get_level_file(level)
+                if print_msg:
+                    print('build overview of {} in level {}: {}'.format(self.file, level, ovr_file))
+                self.build_level(self.file, ovr_file, src_shape, level,
+                                 max_memory=max_memory,
+                                 print_msg=print_msg)
+        return self.get_valid_level_list()
+
+    def build_level(self, src_file, ovr_file, src_shape, lks, max_memory=4, print_msg=True):
+        """Build the overview file by multilooking the source file
+        Parameters: src_file   : str, source file in full resolution
+                    ovr_file   : str, output overview file
+                    src_shape  : tuple of 2 int, (length, width) of src_file
+                    lks        : int, number of looks in y/x direction
+                    max_memory : float, max memory in GB to use per block
+        """
+        # list of datasets / groups
+        ds_list_2d3d = []
+        ds_list_other = []
+        grp_list = []
+        def get_item_list(name, obj):
+            if isinstance(obj, h5py.Group):
+                grp_list.append(name)
+            elif obj.ndim in [2, 3] and obj.shape[-2:] == src_shape:
+                ds_list_2d3d.append(name)
+            else:
+                ds_list_other.append(name)
+
+        def get_ovr_attrs(attrs):
+            atr = dict(attrs)
+            if 'LENGTH' in atr.keys() and 'WIDTH' in atr.keys():
+                atr = multilook_attribute(atr, lks, lks, print_msg=False)
+            return atr
+
+        out_shape = (src_shape[0] // lks, src_shape[1] // lks)
+        with h5py.File(ovr_file, 'w') as fo:
+            with h5py.File(src_file, 'r') as fi:
+                fi.visititems(get_item_list)
+
+                # groups and attributes
+                for key, value in get_ovr_attrs(fi.attrs).items():
+                    if key != 'OVERVIEW_SOURCE_STAMP':
+                        fo.attrs[key] = value
+                for grp_name in grp_list:
+                    grp = fo.create_group(grp_name)
+                    for key, value in get_ovr_attrs(fi[grp_name].attrs).items():
+                        grp.attrs[key] = value
+
+                # small datasets, e.g. date, bperp, dropIfgram
+                for ds_name in ds_list_other:
+                    fi.copy(fi[ds_name], fo[os.path.dirname(ds_name) or '/'], name=os.path.basename(ds_name))
+
+                # 2D/3D datasets
+                for ds_name in ds_list_2d3d:
+                    ds = fi[ds_name]
+                    num_slice = ds.shape[0] if ds.ndim == 3 else 1
+                    average = np.issubdtype(ds.dtype, np.floating) or np.issubdtype(ds.dtype, np.complexfloating)
+                    dso = fo.create_dataset(ds_name,
+                                            shape=ds.shape[:-2] + out_shape,
+                                            dtype=ds.dtype,
+                                            chunks=True,
+                                            compression=ds.compression)
+                    for key, value in ds.attrs.items():
+                        dso.attrs[key] = value
+
+                    # read / multilook / write in blocks of slices
+                    slice_list = ut.split_slice2blocks(num_slice,
+                                                       array_list=[(ds.dtype, src_shape[0] * src_shape[1]),
+                                                                   (np.float64, src_shape[0] * src_shape[1])],
+                                                       max_memory=max_memory,
+                                                       chunk_depth=(ds.chunks[0] if ds.chunks and ds.ndim == 3 else 1),
+                                                       print_msg=False)
+                    prog_bar = ptime.progressBar(maxValue=num_slice, print_msg=print_msg)
+                    for i0, i1 in slice_list:
+                        data = ds[i0:i1] if ds.ndim == 3 else ds[:]
+                        if average:
+                            data = multilook_data(data, lks, lks)
+                        else:
+                            data = data[..., :out_shape[0]*lks:lks, :out_shape[1]*lks:lks]
+                        if ds.ndim == 3:
+                            dso[i0:i1] = data
+                        else:
+                            dso[:] = data
+                        prog_bar.update(i1, suffix='{} {}/{}'.format(ds_name, i1, num_slice))
+                    prog_bar.close()
+
+            # stamp the source file at last, thus an interrupted building is outdated
+            fo.attrs['OVERVIEW_SOURCE_STAMP'] = self.get_source_stamp()
+        return ovr_file
+
+    def select_level(self, box, out_shape=None, multilook_num=None):
+        """Select the coarsest valid level for display
+        Parameters: box           : tuple of 4 int, (x0, y0, x1, y1) of the area to display
+                    out_shape     : tuple of 2 int, min (length, width) in pixels to display,
+                                    i.e. the size of the figure in pixels
+                    multilook_num : int, number of looks for display, the level has to be equal to it
+        Returns:    level         : int, level of the overview, 1 for the full resolution
+        """
+        level = 1
+        for i in self.get_valid_level_list():
+            # aligned with the first row/column of the box
+            if box[0] % i != 0 or box[1] % i != 0:
+                continue
+            if multilook_num and multilook_num != i:
+                continue
+            if out_shape and ((box[3] - box[1]) // i < out_shape[0]
+                              or (box[2] - box[0]) // i < out_shape[1]):
+                continue
+            level = max(level, i)
+        return level
+
+    def read(self, level, datasetName=None, box=None, print_msg=True):
+        """Read data from the overview of the input level
+        Parameters: level       : int, level of the overview, 1 for the source file in full resolution
+                    datasetName : str / list of str, dataset(s) to read, the same as readfile.read()
+                    box         : tuple of 4 int, (x0, y0, x1, y1) in the full resolution
+        Returns:    data        : 2D/3D np.ndarray, in size of the box divided by level
+                    atr         : dict, metadata of the overview
+        """
+        if level == 1:
+            return readfile.read(self.file, datasetName=datasetName, box=box, print_msg=print_msg)
+        if box is None:
+            box = (0, 0, self.width, self.length)
+        ovr_box = (box[0] // level, box[1] // level,
+                   box[0] // level + (box[2] - box[0]) // level,
+                   box[1] // level + (box[3] - box[1]) // level)
+        if print_msg:
+            print('read from overview in level {}: {}'.format(level, self.get_level_file(level)))
+        return readfile.read(self.get_level_file(level),
+                             datasetName=datasetName,
+                             box=ovr_box,
+                             print_msg=False)
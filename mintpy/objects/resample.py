@@ -12,12 +12,19 @@ try:
 except ImportError:
     raise ImportError('Can not import pyresample!')
 
+import os
+from collections import OrderedDict
 import numpy as np
 from scipy import ndimage
-from scipy.interpolate import RegularGridInterpolator as RGI
 from mintpy.utils import readfile, ptime, utils0 as ut
 
 
+# resampling plans of the recently used lookup tables, in memory only,
+# {plan_key: plan}, with the least recently used one dropped first
+RESAMPLE_PLAN_CACHE_SIZE = 2  # max number of resampling plans in the cache
+_resample_plan_cache = OrderedDict()
+
+
 class resample:
     """
     Geometry Definition objects for geocoding using:
@@ -25,9 +32,14 @@ class resample:
     2) scipy.interpolate.RegularGridInterpolator:
        (https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.RegularGridInterpolator.html)
 
+    The resampling plan, i.e. the neighbour index and weights between the source and destination
+    pixels, is computed once and cached in memory, then applied to all input datasets as vectorized gathers.
+
     Example:
         res_obj = resample(lookupFile='./inputs/geometryGeo.h5', dataFile='velocity.h5')
         res_obj = resample(lookupFile='./inputs/geometryRadar.h5', dataFile='temporalCoherence.h5')
+        res_obj.open()
+        geo_data = res_obj.run_resample(src_data, interp_method='nearest')
     """
 
     def __init__(self, lookupFile, dataFile, SNWE=None, laloStep=None, processor=None):
@@ -37,6 +49,7 @@ class resample:
         self.laloStep = laloStep
         self.processor = processor
         self.valid_index = None
+        self.plan = None
 
     def open(self):
         """Prepare aux data before interpolation operation"""
@@ -60,55 +73,270 @@ class resample:
         elif self.processor == 'scipy' and 'Y_FIRST' in self.lut_metadata.keys():
             self.prepare_regular_grid_interpolator()
 
-    def run_resample(self, src_data, interp_method='nearest', fill_value=np.nan, nprocs=1, print_msg=True):
+    def run_resample(self, src_data, interp_method='nearest', fill_value=np.nan, nprocs=1, max_memory=4,
+                     src_box=None, print_msg=True):
         """Run interpolation operation for input 2D/3D data
         Parameters: src_data      : 2D/3D np.array, source data to be geocoded
                     interp_method : string, nearest | linear
                     fill_value    : NaN or number
                     nprocs        : int, number of processes to be used
+                    max_memory    : float, max memory in GB to use for the temporary arrays of 3D data
+                    src_box       : tuple of 4 int, (x0, y0, x1, y1) of src_data in the source file,
+                                    i.e. from get_src_box(), None for the whole source file
                     print_msg     : bool
         Returns:    geo_data      : 2D/3D np.array
         """
-        # use pyresample
+        if src_data.dtype == np.bool_:
+            fill_value = False
+            if print_msg:
+                print('restrict fill value to False for bool type source data')
+        elif np.isnan(fill_value) and not np.issubdtype(src_data.dtype, np.inexact):
+            fill_value = 0
+            if print_msg:
+                print('input source data is not float, change fill_value from NaN to 0.')
+
+        # prepare resampling plan: neighbour index and weights
+        self.prepare_resample_plan(interp_method=interp_method, nprocs=nprocs, print_msg=print_msg)
+
+        # apply resampling plan
+        if print_msg:
+            print('resampling using {} with {} interpolation ...'.format(self.processor, interp_method))
+        geo_data = self.run_resample_plan(src_data,
+                                          fill_value=fill_value,
+                                          max_memory=max_memory,
+                                          src_box=src_box,
+                                          print_msg=print_msg)
+        return geo_data
+
+
+    def get_src_box(self):
+        """Get the bounding box of the source pixels used by the resampling plan,
+        to read only the needed part of the source data.
+        Returns: src_box : tuple of 4 int in (x0, y0, x1, y1)
+        """
+        length = int(self.src_metadata['LENGTH'])
+        width = int(self.src_metadata['WIDTH'])
+        if self.plan is None or 'src_idx' not in self.plan.keys() or self.plan['src_idx'].size == 0:
+            return (0, 0, width, length)
+
+        rows, cols = np.divmod(self.plan['src_idx'], width)
+        # one more row/col on the lower right for linear interpolation
+        pad = 2 if 'ty' in self.plan.keys() else 1
+        src_box = (int(np.min(cols)),
+                   int(np.min(rows)),
+                   min(int(np.max(cols)) + pad, width),
+                   min(int(np.max(rows)) + pad, length))
+        return src_box
+
+
+    def get_plan_key(self, interp_method='nearest'):
+        """Get the identifier of the resampling plan,
+        keyed on the lookup table file, the source data grid and the output SNWE / laloStep.
+        Returns: plan_key : str, identifier of the resampling plan
+        """
+        fstat = os.stat(self.file)
+        key_list = [os.path.abspath(self.file), fstat.st_size, fstat.st_mtime_ns,
+                    self.processor, interp_method, self.SNWE, self.laloStep]
+        key_list += [self.src_metadata.get(i, None) for i in ['LENGTH', 'WIDTH',
+                                                              'SUBSET_YMIN', 'SUBSET_XMIN',
+                                                              'Y_FIRST', 'X_FIRST', 'Y_STEP', 'X_STEP']]
+        plan_key = str(key_list)
+        return plan_key
+
+
+    def prepare_resample_plan(self, interp_method='nearest', nprocs=1, print_msg=True):
+        """Prepare the resampling plan, read it from the in-memory cache if exists, calculate otherwise.
+        Plan for nearest resampling       : dest_idx, src_idx, in 1D np.ndarray of int
+            flattened index of destination pixels and their nearest source pixels
+        Plan for linear resampling (scipy): dest_idx, src_idx, ty, tx, in 1D np.ndarray
+            flattened index of destination pixels, their upper left source pixels and fractional distance
+        Plan for linear resampling (pyresample): t, s, input_idxs, idx_arr
+            bilinear resampling info from pyresample.bilinear.get_bil_info()
+        """
+        if self.plan is not None and self.plan['interp_method'] == interp_method:
+            return self.plan
+
+        # read from cache
+        plan_key = self.get_plan_key(interp_method)
+        if plan_key in _resample_plan_cache.keys():
+            _resample_plan_cache.move_to_end(plan_key)
+            self.plan = _resample_plan_cache[plan_key]
+            return self.plan
+
+        # calculate
+        if print_msg:
+            print('calculating resampling plan for {} interpolation ...'.format(interp_method))
         if self.processor == 'pyresample':
-            if len(src_data.shape) == 3:
-                src_data = np.moveaxis(src_data, 0, -1)
+            plan = self.prepare_pyresample_plan(interp_method, nprocs=nprocs, print_msg=print_msg)
+        else:
+            plan = self.prepare_regular_grid_plan(interp_method)
+        plan['interp_method'] = interp_method
+        self.plan = plan
+
+        _resample_plan_cache[plan_key] = self.plan
+        while len(_resample_plan_cache) > RESAMPLE_PLAN_CACHE_SIZE:
+            _resample_plan_cache.popitem(last=False)
+        return self.plan
+
+
+    def run_resample_plan(self, src_data, fill_value=np.nan, max_memory=4, src_box=None, print_msg=True):
+        """Resample 2D/3D data with the resampling plan, in blocks of 2D slices for 3D data
+        Parameters: src_data   : 2D/3D np.ndarray, source data
+                    fill_value : number, value for destination pixels without source pixels
+                    max_memory : float, max memory in GB to use for the temporary arrays
+                    src_box    : tuple of 4 int, (x0, y0, x1, y1) of src_data in the source file
+        Returns:    dest_data  : 2D/3D np.ndarray, destination data
+        """
+        plan = self.plan
+        src_length = int(self.src_metadata['LENGTH'])
+        src_width = int(self.src_metadata['WIDTH'])
+        if src_box is not None and tuple(src_box) == (0, 0, src_width, src_length):
+            src_box = None
+
+        src_ndim = src_data.ndim
+        num_slice = 1 if src_ndim == 2 else src_data.shape[0]
+        src_data = src_data.reshape(num_slice, -1)
+        dest_data = np.empty((num_slice, self.length * self.width), src_data.dtype)
+        dest_data.fill(fill_value)
+
+        if 'idx_arr' in plan.keys():
+            # pyresample bilinear, slice by slice, for the whole source file only
+            if src_box is not None:
+                raise ValueError('source box is not supported for pyresample bilinear interpolation!')
+            if self.valid_index is not None:
+                src_data = src_data[:, self.valid_index.flatten()]
+            prog_bar = ptime.progressBar(maxValue=num_slice, print_msg=num_slice > 1 and print_msg)
+            for i in range(num_slice):
+                data = pr.bilinear.get_sample_from_bil_info(src_data[i].astype(np.float64),
+                                                            plan['t'],
+                                                            plan['s'],
+                                                            plan['input_idxs'],
+                                                            plan['idx_arr'],
+                                                            output_shape=None).flatten()
+                data[np.isnan(data)] = fill_value
+                dest_data[i] = data
+                prog_bar.update(i+1)
+            prog_bar.close()
 
-            if src_data.dtype == np.bool_:
-                fill_value = False
-                print('restrict fill value to False for bool type source data')
+        else:
+            # number of slices per block, based on the size of the temporary arrays
+            num_tmp = 3 if 'ty' in plan.keys() else 1
+            slice_size = plan['dest_idx'].size * max(src_data.itemsize, 8) * num_tmp
+            step = max(1, int(max_memory * 1024**3 / max(slice_size, 1)))
+            dest_idx = plan['dest_idx']
+            src_idx = plan['src_idx']
+
+            # convert source index into the source box
+            if src_box is not None:
+                rows, cols = np.divmod(src_idx, src_width)
+                src_width = src_box[2] - src_box[0]
+                src_idx = (rows - src_box[1]) * src_width + (cols - src_box[0])
+            for i0 in range(0, num_slice, step):
+                i1 = min(i0 + step, num_slice)
+                if 'ty' in plan.keys():
+                    # bilinear interpolation with the 4 surrounding source pixels
+                    ty, tx = plan['ty'], plan['tx']
+                    data = src_data[i0:i1, src_idx] * ((1 - ty) * (1 - tx))
+                    data += src_data[i0:i1, src_idx + 1] * ((1 - ty) * tx)
+                    data += src_data[i0:i1, src_idx + src_width] * (ty * (1 - tx))
+                    data += src_data[i0:i1, src_idx + src_width + 1] * (ty * tx)
+                    dest_data[i0:i1, dest_idx] = data
+                else:
+                    dest_data[i0:i1, dest_idx] = src_data[i0:i1, src_idx]
+
+        if src_ndim == 2:
+            dest_data = dest_data.reshape(self.length, self.width)
+        else:
+            dest_data = dest_data.reshape(num_slice, self.length, self.width)
+        return dest_data
+
+
+    def prepare_regular_grid_plan(self, interp_method='nearest'):
+        """Prepare the resampling plan for source data in regular grid,
+        with the same result as scipy.interpolate.RegularGridInterpolator"""
+        src_length = self.src_pts[0].size
+        src_width = self.src_pts[1].size
+        dest_idx = np.where(self.interp_mask.flatten())[0]
+        y = self.dest_pts[:, 0].astype(np.float64)
+        x = self.dest_pts[:, 1].astype(np.float64)
 
-            # resample source data into target data
-            geo_data = self.run_pyresample(src_data=src_data,
-                                           interp_method=interp_method,
-                                           fill_value=fill_value,
-                                           nprocs=nprocs,
-                                           radius=None,
-                                           print_msg=True)
+        # points out of the source grid are filled
+        flag = (y >= 0) * (y <= src_length - 1) * (x >= 0) * (x <= src_width - 1)
+        dest_idx, y, x = dest_idx[flag], y[flag], x[flag]
 
-            if len(geo_data.shape) == 3:
-                geo_data = np.moveaxis(geo_data, -1, 0)
+        # index of the upper left source pixel, as in RGI
+        y0 = np.clip(np.floor(y).astype(np.int64), 0, max(src_length - 2, 0))
+        x0 = np.clip(np.floor(x).astype(np.int64), 0, max(src_width - 2, 0))
+        ty = y - y0
+        tx = x - x0
 
-        # use scipy.interpolater.RegularGridInterpolator
+        plan = dict()
+        plan['dest_idx'] = dest_idx
+        if interp_method.startswith('near'):
+            y0[ty > 0.5] += 1
+            x0[tx > 0.5] += 1
+            plan['src_idx'] = y0 * src_width + x0
         else:
-            if print_msg:
-                print('resampling using scipy.interpolate.RegularGridInterpolator ...')
-            if len(src_data.shape) == 3:
-                geo_data = np.empty((src_data.shape[0], self.length, self.width), src_data.dtype)
-                prog_bar = ptime.progressBar(maxValue=src_data.shape[0])
-                for i in range(src_data.shape[0]):
-                    geo_data[i, :, :] = self.run_regular_grid_interpolator(src_data=src_data[i, :, :],
-                                                                           interp_method=interp_method,
-                                                                           fill_value=fill_value,
-                                                                           print_msg=True)
-                    prog_bar.update(i+1)
-                prog_bar.close()
+            plan['src_idx'] = y0 * src_width + x0
+            plan['ty'] = ty
+            plan['tx'] = tx
+        return plan
+
+
+    def prepare_pyresample_plan(self, interp_method='nearest', nprocs=1, radius=None, print_msg=True):
+        """Prepare the resampling plan with pyresample,
+        i.e. the neighbour info of kd_tree.resample_nearest() or bilinear.resample_bilinear()"""
+        if not radius:
+            # geo2radar
+            if 'Y_FIRST' in self.src_metadata.keys():
+                radius = 100e3
+            # radar2geo
             else:
-                geo_data = self.run_regular_grid_interpolator(src_data=src_data,
-                                                              interp_method=interp_method,
-                                                              fill_value=fill_value,
-                                                              print_msg=True)
-        return geo_data
+                radius = self.get_radius_of_influence()
+        num_segment = self.get_segment_number()
+
+        plan = dict()
+        if interp_method.startswith('near'):
+            if print_msg:
+                msg = 'nearest neighbour search with kd_tree '
+                msg += 'using {} processor cores in {} segments ...'.format(nprocs, num_segment)
+                print(msg)
+            (valid_input_index,
+             valid_output_index,
+             index_array) = pr.kd_tree.get_neighbour_info(self.src_def,
+                                                          self.dest_def,
+                                                          radius_of_influence=radius,
+                                                          neighbours=1,
+                                                          epsilon=0.5,
+                                                          nprocs=nprocs,
+                                                          segments=num_segment)[0:3]
+
+            # convert to the flattened index of the full source / destination matrix
+            src_idx = np.where(np.array(valid_input_index).flatten())[0]
+            dest_idx = np.where(np.array(valid_output_index).flatten())[0]
+            index_array = np.array(index_array).flatten()
+            flag = index_array < src_idx.size
+            plan['dest_idx'] = dest_idx[flag]
+            plan['src_idx'] = src_idx[index_array[flag]]
+            if self.valid_index is not None:
+                plan['src_idx'] = np.where(self.valid_index.flatten())[0][plan['src_idx']]
+
+        elif interp_method.endswith('linear'):
+            if print_msg:
+                print('bilinear neighbour search using {} processor cores ...'.format(nprocs))
+            (plan['t'],
+             plan['s'],
+             plan['input_idxs'],
+             plan['idx_arr']) = pr.bilinear.get_bil_info(self.src_def,
+                                                         self.dest_def,
+                                                         radius=radius,
+                                                         neighbours=32,
+                                                         nprocs=nprocs,
+                                                         masked=False,
+                                                         segments=num_segment,
+                                                         epsilon=0)
+        return plan
+
 
     def prepare_regular_grid_interpolator(self):
         """Prepare aux data for RGI module"""
@@ -142,24 +370,6 @@ class resample:
                      lon0,
                      lon0 + lon_step * (self.width - 1))
 
-    def run_regular_grid_interpolator(self, src_data, interp_method='nearest', fill_value=np.nan, print_msg=True):
-        """Interpolate 2D matrix"""
-        # prepare interpolation function
-        rgi_func = RGI(self.src_pts,
-                       src_data,
-                       method=interp_method,
-                       bounds_error=False,
-                       fill_value=fill_value)
-
-        # prepare output matrix
-        geo_data = np.empty((self.length, self.width), src_data.dtype)
-        geo_data.fill(fill_value)
-
-        # interpolate output matrix
-        geo_data[self.interp_mask] = rgi_func(self.dest_pts)
-        return geo_data
-
-
     def prepare_geometry_definition_radar(self):
         """Get src_def and dest_def for lookup table from ISCE, DORIS"""
 
@@ -401,83 +611,3 @@ class resample:
     def get_segment_number(self, unit_size=1e6):
         num_segment = int(self.dest_def.size / unit_size + 0.5)
         return num_segment
-
-
-    def run_pyresample(self, src_data, interp_method='nearest', fill_value=np.nan, nprocs=1,
-                       radius=None, print_msg=True):
-        """
-        Resample input src_data into dest_data
-        Parameters: src_data : 2D np.array
-                    interp_method : str,
-                    fill_value : number
-                    nprocs : int
-                    print_msg : bool
-        Returns:    dest_data
-        Example:    dest_data = reObj.run_pyresample(src_data, src_def, dest_def,
-                                                     interp_method=inps.interpMethod,
-                                                     fill_value=np.fillValue, nprocs=4)
-        """
-        if not radius:
-            # geo2radar
-            if 'Y_FIRST' in self.src_metadata.keys():
-                radius = 100e3
-            # radar2geo
-            else:
-                radius = self.get_radius_of_influence()
-
-        if np.isnan(fill_value) and src_data.dtype not in [np.float32, np.float64, np.float128,
-                                                           np.complex64, np.complex128]:
-            fill_value = 0
-            if print_msg:
-                print('input source data is not float, change fill_value from NaN to 0.')
-
-        # reduction of swath data
-        if self.valid_index is not None:
-            src_data = src_data[self.valid_index]
-
-        # get number of segments
-        num_segment = self.get_segment_number()
-
-        if interp_method.startswith('near'):
-            if print_msg:
-                msg = 'nearest resampling with kd_tree '
-                msg += 'using {} processor cores in {} segments ...'.format(nprocs, num_segment)
-                print(msg)
-            dest_data = pr.kd_tree.resample_nearest(self.src_def,
-                                                    src_data,
-                                                    self.dest_def,
-                                                    nprocs=nprocs,
-                                                    fill_value=fill_value,
-                                                    radius_of_influence=radius,
-                                                    segments=num_segment,
-                                                    epsilon=0.5)
-
-        elif interp_method.endswith('linear'):
-            if print_msg:
-                print('bilinear resampling using {} processor cores ...'.format(nprocs))
-            dest_data = pr.bilinear.resample_bilinear(src_data,
-                                                      self.src_def,
-                                                      self.dest_def,
-                                                      nprocs=nprocs,
-                                                      fill_value=fill_value,
-                                                      radius=radius,
-                                                      neighbours=32,
-                                                      segments=num_segment,
-                                                      epsilon=0)
-
-        # for debug
-        debug_mode = False
-        if debug_mode:
-            import matplotlib.pyplot as plt
-            fig, ((ax11, ax12, ax13), (ax21, ax22, ax23)) = plt.subplots(nrows=2, ncols=3, figsize=(12, 8))
-            dest_lats = np.array(self.dest_def.lats); dest_lats[dest_lats == 90.] = np.nan
-            dest_lons = np.array(self.dest_def.lons); dest_lons[dest_lons == 0.] = np.nan
-            im = ax11.imshow(self.src_def.lats);    fig.colorbar(im, ax=ax11);   ax11.set_title('src_lats')
-            im = ax12.imshow(self.src_def.lons);    fig.colorbar(im, ax=ax12);   ax12.set_title('src_lons')
-            im = ax13.imshow(src_data);             fig.colorbar(im, ax=ax13);   ax13.set_title('src_data')
-            im = ax21.imshow(dest_lats);            fig.colorbar(im, ax=ax21);   ax21.set_title('dest_lats')
-            im = ax22.imshow(dest_lons);            fig.colorbar(im, ax=ax22);   ax22.set_title('dest_lons')
-            im = ax23.imshow(dest_data);            fig.colorbar(im, ax=ax23);   ax23.set_title('dest_data')
-            plt.show()
-
-        return dest_data
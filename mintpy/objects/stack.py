@@ -12,8 +12,11 @@ import os
 import sys
 import time
 import datetime as dt
+from collections import OrderedDict
 import h5py
 import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
 
 
 BOOL_ZERO = np.bool_(0)
@@ -124,6 +127,107 @@ datasetUnitDict = {'unwrapPhase'        :'radian',
 
 
 
+##------------------ HDF5 chunk layout ---------------------##
+# chunk layout of 2D/3D datasets in HDF5 files:
+# auto  - chunk shape guessed by h5py
+# image - chunk in single 2D slices, fast for reading 2D images, e.g. view.py, geocode.py
+# pixel - chunk in full depth over small boxes, fast for reading per-pixel time-series,
+#         e.g. ifgram_inversion.py, tsview.py
+chunkLayoutNames = ['auto', 'image', 'pixel']
+CHUNK_SIZE = 1024**2         # target chunk size in bytes
+CHUNK_CACHE_SIZE = 1024**3   # default max size in bytes of the chunk caches of all datasets open together
+
+##------------------ Design matrix cache ---------------------##
+# design matrices of the recently used networks, in scipy.sparse format,
+# as they are rebuilt for the same list of interferograms by many steps / functions
+DESIGN_MATRIX_CACHE_SIZE = 8  # max number of networks in the cache
+_design_matrix_cache = OrderedDict()
+
+
+def _get_cached_design_matrix(key, func):
+    """Get the cached design matrices of the input key, call func() to build them if not exist."""
+    if key in _design_matrix_cache.keys():
+        _design_matrix_cache.move_to_end(key)
+    else:
+        _design_matrix_cache[key] = func()
+        while len(_design_matrix_cache) > DESIGN_MATRIX_CACHE_SIZE:
+            _design_matrix_cache.popitem(last=False)
+    return _design_matrix_cache[key]
+
+
+def chunk_shape4layout(shape, layout='auto', dtype=dataType):
+    """Get the HDF5 chunk shape for a dataset with the given chunk layout.
+    Parameters: shape  : tuple of int, dataset shape
+                layout : str, chunk layout name in chunkLayoutNames, or
+                         str / tuple of int for explicit chunk shape in (z, y, x) or (y, x), e.g. 10,64,64
+                dtype  : numpy data type of the dataset
+    Returns:    chunks : tuple of int, or True for h5py guessed chunk shape,
+                         to be passed to h5py.File.create_dataset(chunks=chunks)
+    Examples:   chunks = chunk_shape4layout((200, 4000, 5000), layout='pixel')
+                chunks = chunk_shape4layout((200, 4000, 5000), layout='(20,128,128)')
+    """
+    if not layout or len(shape) < 2:
+        return True
+
+    # explicit chunk shape
+    if isinstance(layout, str) and layout.lower() not in chunkLayoutNames:
+        layout = [int(i) for i in layout.replace('(', '').replace(')', '').replace(',', ' ').split()]
+    if not isinstance(layout, str):
+        # (y, x) input for 3D dataset: chunk in single 2D slices
+        layout = [1] * (len(shape) - len(layout)) + list(layout)
+        chunks = tuple(max(1, min(int(i), j)) for i, j in zip(layout[-len(shape):], shape))
+        return chunks
+
+    layout = layout.lower()
+    if layout == 'auto':
+        return True
+
+    num_byte = np.dtype(dtype).itemsize
+    length, width = shape[-2:]
+    depth = shape[0] if len(shape) == 3 else 1
+    if layout == 'image':
+        # full width, rows to reach the target chunk size
+        num_row = max(1, min(length, int(CHUNK_SIZE / (width * num_byte))))
+        num_col = min(width, max(1, int(CHUNK_SIZE / num_byte)))
+        chunks = (num_row, num_col)
+        if len(shape) == 3:
+            chunks = (1,) + chunks
+
+    elif layout == 'pixel':
+        # full depth, square box to reach the target chunk size
+        step = max(1, int(np.sqrt(CHUNK_SIZE / (depth * num_byte))))
+        chunks = (min(length, step), min(width, step))
+        if len(shape) == 3:
+            chunks = (depth,) + chunks
+    return chunks
+
+
+def chunk_cache4region(region_shape, chunks, dtype=dataType, max_size=CHUNK_CACHE_SIZE, num_dset=1):
+    """Get the HDF5 chunk cache setting to hold all chunks touched by one read/write of a region,
+    so that chunks partially read/written by neighboring regions are not re-read/re-compressed.
+    Parameters: region_shape : tuple of int, shape of the region read/written at once, e.g.:
+                               (1, length, width) for writing one 2D slice of a 3D dataset
+                chunks       : tuple of int, chunk shape of the dataset
+                dtype        : numpy data type of the dataset
+                max_size     : int, max size in bytes of the chunk caches of all datasets open together
+                num_dset     : int, number of datasets open together, each one with its own chunk cache
+    Returns:    cache_kwargs : dict, keyword arguments for h5py.File()
+    Example:    with h5py.File(fname, 'a', **chunk_cache4region((1, 4000, 5000), (200, 36, 36))) as f:
+    """
+    if not chunks or chunks is True:
+        return dict()
+    # number of chunks touched by the region, allowing for misalignment
+    num_chunk = 1
+    for n, c in zip(region_shape, chunks):
+        num_chunk *= int(np.ceil(n / c)) + (1 if c > 1 else 0)
+    chunk_size = int(np.prod(chunks)) * np.dtype(dtype).itemsize
+    num_chunk = max(1, min(num_chunk, int(max_size / num_dset / chunk_size)))
+    cache_kwargs = dict(rdcc_nbytes=num_chunk * chunk_size,
+                        rdcc_nslots=max(521, num_chunk * 10) | 1,
+                        rdcc_w0=1.)
+    return cache_kwargs
+
+
 ################################ timeseries class begin ################################
 FILE_STRUCTURE_TIMESERIES = """
 /                Root level
@@ -255,7 +359,7 @@ class timeseries:
                 data = np.squeeze(data)
         return data
 
-    def layout_hdf5(self, dsNameDict, metadata, compression=None):
+    def layout_hdf5(self, dsNameDict, metadata, compression=None, chunk_layout=None):
         print('-'*50)
         print('create HDF5 file {} with w mode'.format(self.file))
         f = h5py.File(self.file, "w")
@@ -269,7 +373,9 @@ class timeseries:
             f.create_dataset(key,
                              shape=dsNameDict[key][1],
                              dtype=dsNameDict[key][0],
-                             chunks=True,
+                             chunks=chunk_shape4layout(dsNameDict[key][1],
+                                                       layout=chunk_layout,
+                                                       dtype=dsNameDict[key][0]),
                              compression=compression)
 
         # write attributes
@@ -330,7 +436,8 @@ class timeseries:
         print('close HDF5 file {}'.format(self.file))
         return self.file
 
-    def write2hdf5(self, data, outFile=None, dates=None, bperp=None, metadata=None, refFile=None, compression=None):
+    def write2hdf5(self, data, outFile=None, dates=None, bperp=None, metadata=None, refFile=None,
+                   compression=None, chunk_layout=None):
         """
         Parameters: data  : 3D array of float32
                     dates : 1D array/list of string in YYYYMMDD format
@@ -339,6 +446,7 @@ class timeseries:
                     outFile : string
                     refFile : string
                     compression : string or None
+                    chunk_layout : string, chunk layout of 3D dataset, auto/image/pixel or (z,y,x)
         Returns: outFile : string
         Examples:
             from mintpy.objects import timeseries
@@ -376,11 +484,12 @@ class timeseries:
         # 3D dataset - timeseries
         print('create timeseries HDF5 file: {} with w mode'.format(outFile))
         f = h5py.File(outFile, 'w')
+        chunks = chunk_shape4layout(data.shape, layout=chunk_layout, dtype=data.dtype)
         print(('create dataset /timeseries of {t:<10} in size of {s} '
                'with compression={c}').format(t=str(data.dtype),
                                               s=data.shape,
                                               c=compression))
-        f.create_dataset('timeseries', data=data, chunks=True, compression=compression)
+        f.create_dataset('timeseries', data=data, chunks=chunks, compression=compression)
 
         # 1D dataset - date / bperp
         print('create dataset /dates      of {:<10} in size of {}'.format(str(dates.dtype), dates.shape))
@@ -954,18 +1063,18 @@ class ifgramStack:
 
     def get_max_connection_number(self):
         date12_list = self.get_date12_list()
-        A = self.get_design_matrix4timeseries(date12_list, refDate=0)[0]
-        num_conn = np.zeros(A.shape[0], dtype=np.int16)
-        for i in range(A.shape[0]):
-            Ai = A[i, :]
-            num_conn[i] = np.where(Ai == 1)[0] - np.where(Ai == -1)[0]
+        A = self.get_design_matrix4timeseries(date12_list, refDate=0, sparse=True)[0].tocoo()
+        # column index of the secondary (1) minus the primary (-1) date, for each interferogram
+        num_conn = np.zeros(A.shape[0], dtype=np.int64)
+        np.add.at(num_conn, A.row, A.col * A.data.astype(np.int64))
         return np.max(num_conn)
 
     # Functions for Unwrap error correction
     @staticmethod
-    def get_design_matrix4triplet(date12_list):
+    def get_design_matrix4triplet(date12_list, sparse=False):
         """Generate the design matrix of ifgram triangle for unwrap error correction using phase closure
         Parameters: date12_list : list of string in YYYYMMDD_YYYYMMDD format
+                    sparse      : bool, return scipy.sparse.csr_matrix instead of np.ndarray
         Returns:    C : 2D np.array in size of (num_tri, num_ifgram) consisting 0, 1, -1
                         for 3 SAR acquisition in t1, t2 and t3 in time order,
                         ifg1 for (t1, t2) with 1
@@ -974,64 +1083,71 @@ class ifgramStack:
         Examples:   obj = ifgramStack('./inputs/ifgramStack.h5')
                     date12_list = obj.get_date12_list(dropIfgram=True)
                     C = ifgramStack.get_design_matrix4triplet(date12_list)
+                    C = ifgramStack.get_design_matrix4triplet(date12_list, sparse=True)
         """
-        # Date info
-        date12_list = list(date12_list)
+        date12_list = tuple(date12_list)
+        C = _get_cached_design_matrix(('triplet', date12_list),
+                                      lambda: ifgramStack._get_sparse_design_matrix4triplet(date12_list))
+        return C.copy() if sparse else C.toarray()
 
-        # calculate triangle_idx
+    @staticmethod
+    def _get_sparse_design_matrix4triplet(date12_list):
+        # index of the 1st ifgram of each (date1, date2), and
+        # date3 of all ifgrams starting from date1, as the adjacency graph of the network
+        ifgram_idx = dict()
+        date3_dict = dict()
+        for i, date12 in enumerate(date12_list):
+            date1, date2 = date12.split('_')
+            if (date1, date2) not in ifgram_idx.keys():
+                ifgram_idx[(date1, date2)] = i
+                date3_dict.setdefault(date1, []).append(date2)
+
+        # triangles of ifgram1 (date1, date2), ifgram2 (date1, date3) and ifgram3 (date2, date3)
         triangle_idx = []
-        for ifgram1 in date12_list:
-            # ifgram1 (date1, date2)
-            date1, date2 = ifgram1.split('_')
-
-            # ifgram2 candidates (date1, date3)
-            date3_list = []
-            for ifgram2 in date12_list:
-                if date1 == ifgram2.split('_')[0] and ifgram2 != ifgram1:
-                    date3_list.append(ifgram2.split('_')[1])
-
-            # ifgram2/3
-            if len(date3_list) > 0:
-                for date3 in date3_list:
-                    ifgram3 = '{}_{}'.format(date2, date3)
-                    if ifgram3 in date12_list:
-                        ifgram1 = '{}_{}'.format(date1, date2)
-                        ifgram2 = '{}_{}'.format(date1, date3)
-                        ifgram3 = '{}_{}'.format(date2, date3)
-                        triangle_idx.append([date12_list.index(ifgram1),
-                                             date12_list.index(ifgram2),
-                                             date12_list.index(ifgram3)])
+        for (date1, date2), idx1 in ifgram_idx.items():
+            for date3 in date3_dict[date1]:
+                idx3 = ifgram_idx.get((date2, date3), None)
+                if date3 != date2 and idx3 is not None:
+                    triangle_idx.append([idx1, ifgram_idx[(date1, date3)], idx3])
         if len(triangle_idx) == 0:
             raise ValueError("No triangles found!")
 
-        triangle_idx = np.array(triangle_idx, np.int16)
-        triangle_idx = np.unique(triangle_idx, axis=0)
+        triangle_idx = np.unique(np.array(triangle_idx, np.int64), axis=0)
 
         # triangle_idx to C
         num_triangle = triangle_idx.shape[0]
-        C = np.zeros((num_triangle, len(date12_list)), np.float32)
-        for i in range(num_triangle):
-            C[i, triangle_idx[i, 0]] = 1
-            C[i, triangle_idx[i, 1]] = -1
-            C[i, triangle_idx[i, 2]] = 1
+        C = sparse.csr_matrix((np.tile(np.array([1, -1, 1], np.float32), num_triangle),
+                               (np.repeat(np.arange(num_triangle), 3), triangle_idx.flatten())),
+                              shape=(num_triangle, len(date12_list)))
         return C
 
 
     # Functions for Network Inversion
     @staticmethod
-    def get_design_matrix4timeseries(date12_list, refDate=None):
+    def get_design_matrix4timeseries(date12_list, refDate=None, sparse=False):
         """Return design matrix of the input ifgramStack for timeseries estimation
         Parameters: date12_list : list of string in YYYYMMDD_YYYYMMDD format
                     refDate : str, date in YYYYMMDD format
+                    sparse  : bool, return scipy.sparse.csr_matrix instead of np.ndarray
         Returns:    A : 2D array of float32 in size of (num_ifgram, num_date-1)
                     B : 2D array of float32 in size of (num_ifgram, num_date-1)
         Examples:   obj = ifgramStack('./inputs/ifgramStack.h5')
                     A, B = obj.get_design_matrix4timeseries(obj.get_date12_list(dropIfgram=True))
                     A = ifgramStack.get_design_matrix4timeseries(date12_list, refDate='20101022')[0]
                     A = ifgramStack.get_design_matrix4timeseries(date12_list, refDate=0)[0] #do not omit the 1st column
+                    A = ifgramStack.get_design_matrix4timeseries(date12_list, sparse=True)[0]
         """
+        date12_list = tuple(date12_list)
+        A, B = _get_cached_design_matrix(('timeseries', date12_list, refDate),
+                                         lambda: ifgramStack._get_sparse_design_matrix4timeseries(date12_list,
+                                                                                                  refDate))
+        if sparse:
+            return A.copy(), B.copy()
+        return A.toarray(), B.toarray()
+
+    @staticmethod
+    def _get_sparse_design_matrix4timeseries(date12_list, refDate=None):
         # Date info
-        date12_list = list(date12_list)
         mDates = [i.split('_')[0] for i in date12_list]
         sDates = [i.split('_')[1] for i in date12_list]
         dateList = sorted(list(set(mDates + sDates)))
@@ -1041,23 +1157,40 @@ class ifgramStack:
         numDate = len(dateList)
 
         # calculate design matrix
-        A = np.zeros((numIfgram, numDate), np.float32)
-        B = np.zeros(A.shape, np.float32)
-        for i in range(numIfgram):
-            m_idx, s_idx = [dateList.index(j) for j in date12_list[i].split('_')]
-            A[i, m_idx] = -1
-            A[i, s_idx] = 1
-            B[i, m_idx:s_idx] = tbase[m_idx+1:s_idx+1] - tbase[m_idx:s_idx]
+        date_idx = {date: i for i, date in enumerate(dateList)}
+        m_idx = np.array([date_idx[i] for i in mDates], np.int64)
+        s_idx = np.array([date_idx[i] for i in sDates], np.int64)
+        A = sparse.csr_matrix((np.hstack((-np.ones(numIfgram, np.float32), np.ones(numIfgram, np.float32))),
+                               (np.tile(np.arange(numIfgram), 2), np.hstack((m_idx, s_idx)))),
+                              shape=(numIfgram, numDate))
+
+        # B[i, m_idx:s_idx] = tbase[m_idx+1:s_idx+1] - tbase[m_idx:s_idx]
+        num_col = np.maximum(s_idx - m_idx, 0)
+        row = np.repeat(np.arange(numIfgram), num_col)
+        col = np.arange(np.sum(num_col)) - np.repeat(np.cumsum(num_col) - num_col - m_idx, num_col)
+        B = sparse.csr_matrix((np.diff(tbase)[col], (row, col)), shape=(numIfgram, numDate))
 
         # Remove reference date as it can not be resolved
         if refDate is None:
             refDate = dateList[0]
         if refDate:
             refIndex = dateList.index(refDate)
-            A = np.hstack((A[:, 0:refIndex], A[:, (refIndex+1):]))
+            A = A[:, [i for i in range(numDate) if i != refIndex]]
             B = B[:, :-1]
         return A, B
 
+    @staticmethod
+    def get_number_of_network_subsets(date12_list):
+        """Get the number of the disconnected subsets (islands) of the network of interferograms,
+        i.e. the design matrix of timeseries estimation is rank deficient if > 1.
+        Parameters: date12_list : list of string in YYYYMMDD_YYYYMMDD format
+        Returns:    num_subset  : int
+        """
+        A = ifgramStack.get_design_matrix4timeseries(date12_list, refDate=0, sparse=True)[0]
+        # adjacency graph of the acquisitions
+        graph = abs(A.T).dot(abs(A))
+        return csgraph.connected_components(graph, directed=False)[0]
+
     def get_perp_baseline_timeseries(self, dropIfgram=True):
         """Get spatial perpendicular baseline in timeseries from ifgramStack, ignoring dropped ifgrams"""
         # read pbase of interferograms
@@ -1068,9 +1201,9 @@ class ifgramStack:
 
         # estimate pbase of time-series
         date12List = self.get_date12_list(dropIfgram=dropIfgram)
-        A = self.get_design_matrix4timeseries(date12List)[0]
+        A = self.get_design_matrix4timeseries(date12List, sparse=True)[0]
         pbaseTimeseries = np.zeros(A.shape[1]+1, dtype=np.float32)
-        pbaseTimeseries[1:] = np.linalg.lstsq(A, pbaseIfgram, rcond=None)[0]
+        pbaseTimeseries[1:] = np.linalg.lstsq(A.toarray(), pbaseIfgram, rcond=None)[0]
         return pbaseTimeseries
 
     def update_drop_ifgram(self, date12List_to_drop):
@@ -1078,10 +1211,11 @@ class ifgramStack:
         if date12List_to_drop is None:
             return
         date12ListAll = self.get_date12_list(dropIfgram=False)
+        date12Set_to_drop = set(date12List_to_drop)
         with h5py.File(self.file, 'r+') as f:
             print('open file {} with r+ mode'.format(self.file))
             print('update HDF5 dataset "/dropIfgram".')
-            f['dropIfgram'][:] = np.array([i not in date12List_to_drop
+            f['dropIfgram'][:] = np.array([i not in date12Set_to_drop
                                            for i in date12ListAll], dtype=np.bool_)
             # update MODIFICATION_TIME for all datasets in ifgramDatasetNames
             for dsName in ifgramDatasetNames:
@@ -13,6 +13,8 @@
 import os
 import time
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import h5py
 import numpy as np
 
@@ -23,8 +25,11 @@ except ImportError:
 
 from mintpy.objects import (dataTypeDict,
                             geometryDatasetNames,
-                            ifgramDatasetNames)
+                            ifgramDatasetNames,
+                            chunk_shape4layout,
+                            chunk_cache4region)
 from mintpy.utils import readfile, ptime, utils0 as ut
+from mintpy.utils.utils1 import get_memory_size
 
 
 BOOL_ZERO = np.bool_(0)
@@ -89,7 +94,52 @@ class ifgramStackDict:
             dsDataType = dataTypeDict[metadata['DATA_TYPE'].lower()]
         return dsDataType
 
-    def write2hdf5(self, outputFile='ifgramStack.h5', access_mode='w', box=None, compression=None, extra_metadata=None):
+    def read_pair(self, pair, box=None):
+        """Read all datasets and the perpendicular baseline of one pair."""
+        ifgramObj = self.pairsDict[pair]
+        dsDict = dict()
+        for dsName in self.dsNames:
+            # copy into memory, as the binary file may be read as a view of np.memmap,
+            # otherwise the actual reading is deferred to the writing in the main thread
+            dsDict[dsName] = np.array(ifgramObj.read(dsName, box=box)[0])
+        bperp = ifgramObj.get_perp_baseline()
+        return dsDict, bperp
+
+    def get_dataset_list(self):
+        ifgramObj = [v for v in self.pairsDict.values()][0]
+        dsNames = list(ifgramObj.datasetDict.keys())
+        self.dsNames = [i for i in ifgramDatasetNames if i in dsNames]
+        return self.dsNames
+
+    def read_pairs(self, box=None, num_worker=1, pairs=None):
+        """Generator of the datasets and perpendicular baseline of all pairs in order,
+        read with a thread pool of num_worker threads, and with up to 2 * num_worker pairs
+        in memory, to overlap the reading of binary files with the writing of HDF5 file.
+        """
+        if pairs is None:
+            pairs = self.pairs
+
+        if num_worker <= 1:
+            for pair in pairs:
+                yield self.read_pair(pair, box=box)
+            return
+
+        max_queue_size = num_worker * 2
+        with ThreadPoolExecutor(max_workers=num_worker) as executor:
+            queue = deque()
+            pairs = iter(pairs)
+            for pair in pairs:
+                queue.append(executor.submit(self.read_pair, pair, box))
+                if len(queue) >= max_queue_size:
+                    break
+            while queue:
+                yield queue.popleft().result()
+                for pair in pairs:
+                    queue.append(executor.submit(self.read_pair, pair, box))
+                    break
+
+    def write2hdf5(self, outputFile='ifgramStack.h5', access_mode='w', box=None, compression=None,
+                   extra_metadata=None, chunk_layout=None, num_worker=1, max_memory=4):
         '''Save/write an ifgramStackDict object into an HDF5 file with the structure below:
 
         /                  Root level
@@ -109,19 +159,28 @@ class ifgramStackDict:
                     access_mode : str, access mode of output File, e.g. w, r+
                     box : tuple, subset range in (x0, y0, x1, y1)
                     extra_metadata : dict, extra metadata to be added into output file
+                    chunk_layout : str, chunk layout of 3D datasets, auto/image/pixel or (z,y,x)
+                    num_worker : int, number of threads to read the interferograms
+                    max_memory : str / float, max memory of the chunk caches of all 3D datasets, e.g. 8GB
         Returns:    outputFile
         '''
 
-        self.outputFile = outputFile
-        f = h5py.File(self.outputFile, access_mode)
-        print('create HDF5 file {} with {} mode'.format(self.outputFile, access_mode))
-
         self.pairs = sorted([pair for pair in self.pairsDict.keys()])
-        self.dsNames = list(self.pairsDict[self.pairs[0]].datasetDict.keys())
-        self.dsNames = [i for i in ifgramDatasetNames if i in self.dsNames]
+        self.get_dataset_list()
         maxDigit = max([len(i) for i in self.dsNames])
         self.get_size(box)
 
+        # chunk cache to hold the chunks across one 2D slice, for chunks in multiple slices
+        dsShape = (self.numIfgram, self.length, self.width)
+        chunks = chunk_shape4layout(dsShape, layout=chunk_layout, dtype=dataType)
+        cache_kwargs = chunk_cache4region((1,) + dsShape[1:], chunks, dtype=dataType,
+                                          max_size=get_memory_size(max_memory),
+                                          num_dset=len(self.dsNames))
+
+        self.outputFile = outputFile
+        f = h5py.File(self.outputFile, access_mode, **cache_kwargs)
+        print('create HDF5 file {} with {} mode'.format(self.outputFile, access_mode))
+
         self.bperp = np.zeros(self.numIfgram)
         ###############################
         # 3D datasets containing unwrapPhase, coherence, connectComponent, wrapPhase, etc.
@@ -139,23 +198,31 @@ class ifgramStackDict:
                                                      t=str(dsDataType),
                                                      s=dsShape,
                                                      c=dsCompression))
-            ds = f.create_dataset(dsName,
-                                  shape=dsShape,
-                                  maxshape=(None, dsShape[1], dsShape[2]),
-                                  dtype=dsDataType,
-                                  chunks=True,
-                                  compression=dsCompression)
-
-            prog_bar = ptime.progressBar(maxValue=self.numIfgram)
-            for i in range(self.numIfgram):
-                ifgramObj = self.pairsDict[self.pairs[i]]
-                data = ifgramObj.read(dsName, box=box)[0]
-                ds[i, :, :] = data
-                self.bperp[i] = ifgramObj.get_perp_baseline()
-                prog_bar.update(i+1, suffix='{}_{}'.format(self.pairs[i][0],
-                                                           self.pairs[i][1]))
-            prog_bar.close()
-            ds.attrs['MODIFICATION_TIME'] = str(time.time())
+            f.create_dataset(dsName,
+                             shape=dsShape,
+                             maxshape=(None, dsShape[1], dsShape[2]),
+                             dtype=dsDataType,
+                             chunks=chunk_shape4layout(dsShape, layout=chunk_layout, dtype=dsDataType),
+                             compression=dsCompression)
+
+        # read all datasets of one pair at once, with reading in parallel threads,
+        # and writing in the main thread as the pairs are read, in their order
+        num_worker = max(1, min(int(num_worker), self.numIfgram))
+        if num_worker > 1:
+            print('read interferograms with {} threads, write them in a queue of up to {} pairs'.format(
+                num_worker, num_worker * 2))
+
+        prog_bar = ptime.progressBar(maxValue=self.numIfgram)
+        for i, (dsDict, bperp) in enumerate(self.read_pairs(box=box, num_worker=num_worker)):
+            for dsName, data in dsDict.items():
+                f[dsName][i, :, :] = data
+            self.bperp[i] = bperp
+            prog_bar.update(i+1, suffix='{}_{}'.format(self.pairs[i][0],
+                                                       self.pairs[i][1]))
+        prog_bar.close()
+
+        for dsName in self.dsNames:
+            f[dsName].attrs['MODIFICATION_TIME'] = str(time.time())
 
         ###############################
         # 2D dataset containing master and slave dates of all pairs
@@ -208,6 +275,116 @@ class ifgramStackDict:
         print('Finished writing to {}'.format(self.outputFile))
         return self.outputFile
 
+    def append2hdf5(self, outputFile='ifgramStack.h5', box=None, num_worker=1, max_memory=4):
+        """Append the new pairs of an ifgramStackDict object into an existing HDF5 file,
+        written by write2hdf5() for a subset of the pairs, with the same size and datasets.
+
+        The 3D datasets are resized along the 1st dimension and the pairs are kept in sorted order:
+        the existing pairs before the 1st new one are kept in place, while the rest are merged with
+        the new pairs from the end, thus only the interferograms after the 1st new pair are re-written.
+        /date, /bperp and /dropIfgram are extended, with dropIfgram of the existing pairs kept as it is.
+        The other 3D datasets, e.g. unwrapPhase_bridging from unwrap error correction, are removed,
+        as they do not cover the new pairs, and the file is repacked to free their space.
+
+        Parameters: outputFile : str, Name of the existing HDF5 file for the InSAR stack
+                    box        : tuple, subset range in (x0, y0, x1, y1)
+                    num_worker : int, number of threads to read the interferograms
+                    max_memory : str / float, max memory of the chunk caches of all 3D datasets, e.g. 8GB
+        Returns:    outputFile
+        """
+        self.get_dataset_list()
+        self.get_size(box)
+        self.outputFile = outputFile
+
+        with h5py.File(self.outputFile, 'r') as f:
+            pairs_old = [tuple(i.decode('utf8') for i in pair) for pair in f['date'][:]]
+            chunks = f[self.dsNames[0]].chunks
+        if pairs_old != sorted(pairs_old):
+            raise ValueError('existing pairs in file {} are NOT in sorted order!'.format(self.outputFile))
+        self.pairs = sorted(list(set(self.pairsDict.keys()) - set(pairs_old)))
+        num_old, num_new = len(pairs_old), len(self.pairs)
+        num_ifgram = num_old + num_new
+
+        cache_kwargs = chunk_cache4region((1, self.length, self.width), chunks, dtype=dataType,
+                                          max_size=get_memory_size(max_memory),
+                                          num_dset=len(self.dsNames))
+        f = h5py.File(self.outputFile, 'a', **cache_kwargs)
+        print('open HDF5 file {} with a mode'.format(self.outputFile))
+        print('append {} new pairs to the existing {} pairs'.format(num_new, num_old))
+
+        ###############################
+        # 3D datasets: resize the loaded ones, remove the others
+        dsNames_other = [i for i in f.keys()
+                         if (i not in self.dsNames
+                             and isinstance(f[i], h5py.Dataset)
+                             and f[i].ndim == 3)]
+        for dsName in dsNames_other:
+            print('remove dataset /{} as it does not cover the new pairs, re-generate it if needed'.format(dsName))
+            del f[dsName]
+
+        for dsName in self.dsNames:
+            print('resize dataset /{} from {} to {}'.format(dsName, f[dsName].shape, (num_ifgram, self.length, self.width)))
+            f[dsName].resize(num_ifgram, axis=0)
+
+        # merge the existing and new pairs in sorted order, from the end to the 1st new pair,
+        # so that an existing pair is always moved backward, after its slot is read.
+        pairs_all = sorted(pairs_old + self.pairs)
+        num_keep = pairs_all.index(self.pairs[0]) if num_new > 0 else num_old
+        print('re-write {} existing pairs after the 1st new one in sorted order'.format(num_old - num_keep))
+        idx_old = dict((pair, i) for i, pair in enumerate(pairs_old))
+        bperp = np.hstack((f['bperp'][:], np.zeros(num_new, dtype=dataType)))
+        drop_ifgram = np.hstack((f['dropIfgram'][:], np.ones(num_new, dtype=np.bool_)))
+
+        num_worker = max(1, min(int(num_worker), max(num_new, 1)))
+        new_pair_iter = self.read_pairs(box=box, num_worker=num_worker, pairs=self.pairs[::-1])
+        prog_bar = ptime.progressBar(maxValue=num_ifgram - num_keep)
+        for i in range(num_ifgram-1, num_keep-1, -1):
+            pair = pairs_all[i]
+            if pair in idx_old.keys():
+                # move the existing pair backward
+                j = idx_old[pair]
+                if j != i:
+                    for dsName in self.dsNames:
+                        f[dsName][i, :, :] = f[dsName][j, :, :]
+                    bperp[i], drop_ifgram[i] = bperp[j], drop_ifgram[j]
+            else:
+                # write the new pair
+                dsDict, bperpi = next(new_pair_iter)
+                for dsName, data in dsDict.items():
+                    f[dsName][i, :, :] = data
+                bperp[i], drop_ifgram[i] = bperpi, True
+            prog_bar.update(num_ifgram - i, suffix='{}_{}'.format(pair[0], pair[1]))
+        prog_bar.close()
+        new_pair_iter.close()
+
+        for dsName in self.dsNames:
+            f[dsName].attrs['MODIFICATION_TIME'] = str(time.time())
+
+        ###############################
+        # 1D/2D datasets: date, bperp, dropIfgram
+        dsDict = dict()
+        dsDict['date'] = np.array(pairs_all, dtype=np.string_).reshape(-1, 2)
+        dsDict['bperp'] = np.array(bperp, dtype=dataType)
+        dsDict['dropIfgram'] = np.array(drop_ifgram, dtype=np.bool_)
+        for dsName, data in dsDict.items():
+            print('extend dataset /{} to the size of {}'.format(dsName, data.shape))
+            del f[dsName]
+            f.create_dataset(dsName, data=data)
+
+        f.close()
+
+        # re-write the file to free the space of the removed datasets, as HDF5 does not reclaim it
+        if dsNames_other:
+            from mintpy.repack_hdf5 import repack_hdf5
+            temp_file = os.path.join(os.path.dirname(self.outputFile),
+                                     'tmp_{}'.format(os.path.basename(self.outputFile)))
+            repack_hdf5(self.outputFile, temp_file, layout=None, max_memory=max_memory)
+            print('move {} to {}'.format(temp_file, self.outputFile))
+            os.replace(temp_file, self.outputFile)
+
+        print('Finished writing to {}'.format(self.outputFile))
+        return self.outputFile
+
 
 ########################################################################################
 class ifgramDict:
@@ -410,7 +587,8 @@ class geometryDict:
         #self.metadata['PROCESSOR'] = self.processor
         return self.metadata
 
-    def write2hdf5(self, outputFile='geometryRadar.h5', access_mode='w', box=None, compression='lzf', extra_metadata=None):
+    def write2hdf5(self, outputFile='geometryRadar.h5', access_mode='w', box=None, compression='lzf',
+                   extra_metadata=None, chunk_layout=None, max_memory=4):
         '''
         /                        Root level
         Attributes               Dictionary for metadata. 'X/Y_FIRST/STEP' attribute for geocoded.
@@ -430,18 +608,26 @@ class geometryDict:
             print('No dataset file path in the object, skip HDF5 file writing.')
             return None
 
+        maxDigit = max([len(i) for i in geometryDatasetNames])
+        length, width = self.get_size(box=box)
+        self.length, self.width = self.get_size()
+
+        # chunk cache to hold the chunks across one 2D slice of 3D bperp, for chunks in multiple slices
+        cache_kwargs = dict()
+        if 'bperp' in self.dsNames:
+            dsShape = (len(self.datasetDict['bperp']), length, width)
+            chunks = chunk_shape4layout(dsShape, layout=chunk_layout, dtype=dataType)
+            cache_kwargs = chunk_cache4region((1,) + dsShape[1:], chunks, dtype=dataType,
+                                              max_size=get_memory_size(max_memory))
+
         self.outputFile = outputFile
-        f = h5py.File(self.outputFile, access_mode)
+        f = h5py.File(self.outputFile, access_mode, **cache_kwargs)
         print('create HDF5 file {} with {} mode'.format(self.outputFile, access_mode))
 
         #groupName = self.name
         #group = f.create_group(groupName)
         #print('create group   /{}'.format(groupName))
 
-        maxDigit = max([len(i) for i in geometryDatasetNames])
-        length, width = self.get_size(box=box)
-        self.length, self.width = self.get_size()
-
         ###############################
         for dsName in self.dsNames:
             # 3D datasets containing bperp
@@ -454,7 +640,7 @@ class geometryDict:
                                       shape=dsShape,
                                       maxshape=(None, dsShape[1], dsShape[2]),
                                       dtype=dsDataType,
-                                      chunks=True,
+                                      chunks=chunk_shape4layout(dsShape, layout=chunk_layout, dtype=dsDataType),
                                       compression=compression)
                 print(('create dataset /{d:<{w}} of {t:<25} in size of {s}'
                        ' with compression = {c}').format(d=dsName,
@@ -501,7 +687,7 @@ class geometryDict:
                 data = np.array(self.read(family=dsName, box=box)[0], dtype=dsDataType)
                 ds = f.create_dataset(dsName,
                                       data=data,
-                                      chunks=True,
+                                      chunks=chunk_shape4layout(dsShape, layout=chunk_layout, dtype=dsDataType),
                                       compression=compression)
 
         ###############################
@@ -528,7 +714,7 @@ class geometryDict:
                 ds = f.create_dataset(dsName,
                                       data=data,
                                       dtype=dataType,
-                                      chunks=True,
+                                      chunks=chunk_shape4layout(dsShape, layout=chunk_layout, dtype=dsDataType),
                                       compression=compression)
 
         ###############################
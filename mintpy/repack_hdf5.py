@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+############################################################
+# Program is part of MintPy                                #
+# Copyright (c) 2013, Zhang Yunjun, Heresh Fattahi         #
+############################################################
+
+
+import os
+import time
+import argparse
+import h5py
+import numpy as np
+from mintpy.objects import (chunkLayoutNames,
+                            chunk_shape4layout,
+                            chunk_cache4region)
+from mintpy.utils import ptime, readfile, utils as ut
+
+
+###########################################################################################
+EXAMPLE = """example:
+  # for time-series analysis, i.e. ifgram_inversion.py, tsview.py
+  repack_hdf5.py  inputs/ifgramStack.h5  --chunk-shape pixel
+  repack_hdf5.py  timeseries.h5          --chunk-shape pixel  -o timeseries_pixel.h5
+
+  # for 2D image display / resampling, i.e. view.py, geocode.py
+  repack_hdf5.py  timeseries_ERA5_demErr.h5  --chunk-shape image
+
+  # explicit chunk shape in (z,y,x) and memory usage
+  repack_hdf5.py  inputs/ifgramStack.h5  --chunk-shape 20,64,64  --memory 8GB
+"""
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Rewrite HDF5 file into another chunk layout',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('file', type=str, help='HDF5 file to be repacked, e.g. ifgramStack.h5, timeseries.h5')
+    parser.add_argument('-c', '--chunk-shape', dest='chunkShape', default='pixel',
+                        help='HDF5 chunk layout of 2D/3D datasets (default: %(default)s).\n'
+                             'auto  - guessed by h5py\n'
+                             'image - single 2D slices, fast for reading 2D images\n'
+                             'pixel - full depth over small boxes, fast for reading time-series\n'
+                             'z,y,x - explicit chunk shape')
+    parser.add_argument('--comp', '--compression', dest='compression', choices={'gzip', 'lzf', 'no'},
+                        help='HDF5 compression of 2D/3D datasets (default: the same as input file).')
+    parser.add_argument('-o', '--output', dest='outfile',
+                        help='output file name (default: overwrite the input file).')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use per block and for the chunk cache,\n'
+                             'e.g. 8GB, 512MB, or number in GB (default: %(default)s).')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    if os.path.splitext(inps.file)[1] not in ['.h5', '.he5']:
+        raise ValueError('input file is not HDF5: {}'.format(inps.file))
+
+    # check chunk shape input
+    if inps.chunkShape.lower() not in chunkLayoutNames:
+        chunk_shape4layout((1, 1, 1), layout=inps.chunkShape)
+    return inps
+
+
+###########################################################################################
+def repack_dataset(ds_name, in_file, fo, shape_ref, layout='pixel', compression=None, max_memory=4):
+    """Rewrite one 2D/3D dataset into the chunk layout, block by block.
+    Parameters: ds_name     : str, path of the dataset in the HDF5 file
+                in_file     : str, path of the input HDF5 file
+                fo          : h5py.File object of the output file
+                shape_ref   : tuple of 2 int, (length, width) of the file
+                layout      : str, chunk layout, the same as input if None
+                compression : str, HDF5 compression of the output dataset, the same as input if None,
+                              no compression if 'no'
+                max_memory  : str / float, max memory to use per block and for the chunk cache of the input
+    """
+    with h5py.File(in_file, 'r') as fi:
+        ds = fi[ds_name]
+        shape, dtype, in_chunks = ds.shape, ds.dtype, ds.chunks
+        maxshape = ds.maxshape
+        attrs = dict(ds.attrs)
+        compression_opts = None
+        if compression is None:
+            compression, compression_opts = ds.compression, ds.compression_opts
+        elif compression == 'no':
+            compression = None
+
+    if layout is None:
+        chunks = in_chunks if in_chunks else True
+    else:
+        chunks = chunk_shape4layout(shape, layout=layout, dtype=dtype)
+    print('repack dataset /{:<25} of {:<10} in size of {} with chunks {} --> {}'.format(
+        ds_name, str(dtype), shape, in_chunks, chunks))
+    dso = fo.create_dataset(ds_name,
+                            shape=shape,
+                            maxshape=maxshape,
+                            dtype=dtype,
+                            chunks=chunks,
+                            compression=compression,
+                            compression_opts=compression_opts)
+    for key, value in attrs.items():
+        dso.attrs[key] = value
+
+    # split into blocks aligned with the output chunks
+    depth = int(np.prod(shape[:-2]))
+    box_list = ut.split_box2blocks(shape_ref,
+                                   array_list=[(dtype, depth)],
+                                   max_memory=max_memory,
+                                   chunk_shape=(chunks if chunks is not True else None),
+                                   print_msg=False)
+
+    # chunk cache of the input file to hold the chunks touched by one block
+    box = box_list[0]
+    region = tuple(shape[:-2]) + (box[3] - box[1], box[2] - box[0])
+    cache_kwargs = chunk_cache4region(region, in_chunks, dtype=dtype,
+                                      max_size=ut.get_memory_size(max_memory))
+
+    with h5py.File(in_file, 'r', **cache_kwargs) as fi:
+        ds = fi[ds_name]
+        num_box = len(box_list)
+        prog_bar = ptime.progressBar(maxValue=num_box)
+        for i, box in enumerate(box_list):
+            dso[..., box[1]:box[3], box[0]:box[2]] = ds[..., box[1]:box[3], box[0]:box[2]]
+            prog_bar.update(i+1, suffix='{}/{}'.format(i+1, num_box))
+        prog_bar.close()
+    return
+
+
+def repack_hdf5(in_file, out_file, layout='pixel', compression=None, max_memory=4):
+    """Rewrite HDF5 file with the 2D/3D datasets in the chunk layout, and
+    the other datasets / groups / attributes copied as they are.
+    Parameters: in_file     : str, path of the input HDF5 file
+                out_file    : str, path of the output HDF5 file
+                layout      : str, chunk layout, auto/image/pixel or z,y,x, the same as input if None
+                compression : str, HDF5 compression of 2D/3D datasets, the same as input if None
+                max_memory  : str / float, max memory to use per block and for the chunk cache of the input
+    Returns:    out_file    : str
+    """
+    atr = readfile.read_attribute(in_file)
+    shape_ref = (int(atr['LENGTH']), int(atr['WIDTH']))
+
+    # list of datasets / groups
+    ds_list_2d3d = []
+    ds_list_other = []
+    grp_list = []
+    def get_item_list(name, obj):
+        if isinstance(obj, h5py.Group):
+            grp_list.append(name)
+        elif obj.ndim >= 2 and obj.shape[-2:] == shape_ref:
+            ds_list_2d3d.append(name)
+        else:
+            ds_list_other.append(name)
+
+    with h5py.File(in_file, 'r') as fi:
+        fi.visititems(get_item_list)
+
+    print('create HDF5 file: {} with w mode'.format(out_file))
+    with h5py.File(out_file, 'w') as fo:
+        with h5py.File(in_file, 'r') as fi:
+            # groups and attributes
+            for key, value in fi.attrs.items():
+                fo.attrs[key] = value
+            for grp_name in grp_list:
+                grp = fo.create_group(grp_name)
+                for key, value in fi[grp_name].attrs.items():
+                    grp.attrs[key] = value
+
+            # small datasets, e.g. date, bperp, dropIfgram
+            for ds_name in ds_list_other:
+                print('copy   dataset /{}'.format(ds_name))
+                fi.copy(fi[ds_name], fo[os.path.dirname(ds_name) or '/'], name=os.path.basename(ds_name))
+
+        # 2D/3D datasets
+        for ds_name in ds_list_2d3d:
+            repack_dataset(ds_name, in_file, fo, shape_ref,
+                           layout=layout,
+                           compression=compression,
+                           max_memory=max_memory)
+    print('finished writing to {}'.format(out_file))
+    return out_file
+
+
+###########################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    start_time = time.time()
+
+    compression = inps.compression
+    if inps.outfile and os.path.abspath(inps.outfile) != os.path.abspath(inps.file):
+        repack_hdf5(inps.file, inps.outfile,
+                    layout=inps.chunkShape,
+                    compression=compression,
+                    max_memory=inps.maxMemory)
+    else:
+        # write to a temporary file and replace the input file afterwards
+        inps.outfile = inps.file
+        temp_file = os.path.join(os.path.dirname(inps.file), 'tmp_{}'.format(os.path.basename(inps.file)))
+        repack_hdf5(inps.file, temp_file,
+                    layout=inps.chunkShape,
+                    compression=compression,
+                    max_memory=inps.maxMemory)
+        print('move {} to {}'.format(temp_file, inps.file))
+        os.replace(temp_file, inps.file)
+
+    m, s = divmod(time.time()-start_time, 60)
+    print('time used: {:02.0f} mins {:02.1f} secs.'.format(m, s))
+    return inps.outfile
+
+
+###########################################################################################
+if __name__ == '__main__':
+    main()
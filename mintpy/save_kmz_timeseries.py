@@ -12,24 +12,54 @@ except ImportError:
 
 import os
 import argparse
+from functools import reduce
+from xml.sax.saxutils import escape
 from lxml import etree
 from zipfile import ZipFile
-import shutil
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 from mintpy.objects import timeseries, deramp
-from mintpy.utils import readfile, plot, utils as ut
+from mintpy.utils import parallel, readfile, plot, utils as ut
 from mintpy.save_kmz import generate_cbar_element
 
 
+# Region KML file in the same layout as the pretty printed pyKML document, with one Placemark per data point
+KML_REGION_HEAD = """<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:atom="http://www.w3.org/2005/Atom" xmlns:gx="http://www.google.com/kml/ext/2.2">
+  <Document>
+    <Folder>
+      <name>Data</name>
+"""
+KML_REGION_TAIL = """    </Folder>
+  </Document>
+</kml>
+"""
+PLACEMARK_TEMPLATE = """      <Placemark>
+        <Style>
+          <IconStyle>
+            <color>{color}</color>
+            <scale>0.5</scale>
+            <Icon>
+              <href>{dot_file}</href>
+            </Icon>
+          </IconStyle>
+        </Style>
+        <description>{description}</description>
+        <Point>
+          <coordinates>{lon},{lat}</coordinates>
+        </Point>
+      </Placemark>
+"""
+
+
 ############################################################
 EXAMPLE = """example:
   cd $PROJECT_NAME/mintpy/geo
   save_kmz_timeseries.py geo_timeseries_ERA5_ramp_demErr.h5
   save_kmz_timeseries.py geo_timeseries_ERA5_ramp_demErr.h5 -v -5 5 --wrap
   save_kmz_timeseries.py timeseries_ERA5_demErr.h5 --vel velocity.h5 --tcoh temporalCoherence.h5 --mask maskTempCoh.h5
+  save_kmz_timeseries.py geo_timeseries_ERA5_ramp_demErr.h5 --num-worker 4
 """
 
 def create_parser():
@@ -68,6 +98,9 @@ def create_parser():
                       help='choose points with velocity >= cutoff * MAD. Default: 3.')
     defo.add_argument('--min-percentage','--min-perc', dest='min_percentage', type=float, default=0.2,
                       help='choose boxes with >= min percentage of pixels are deforming. Default: 0.2.')
+
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of processes to create the KML region files in parallel (default: %(default)s).')
     return parser
 
 
@@ -84,22 +117,9 @@ def cmd_line_parse(iargs=None):
     for fname in [inps.vel_file, inps.tcoh_file, inps.mask_file]:
         if not os.path.isfile(fname):
             raise FileNotFoundError('auxliary file {} not found.'.format(fname))
-    return inps
-
 
-def get_all_file_paths(directory):
-    # initializing empty file paths list
-    file_paths = []
-
-    # crawling through directory and subdirectories
-    for root, directories, files in os.walk(directory):
-        for filename in files:
-            # join the two strings in order to form the full filepath.
-            filepath = os.path.join(root, filename)
-            file_paths.append(filepath)
-
-    # returning all file paths
-    return file_paths
+    inps.numWorker = max(1, min(inps.numWorker, os.cpu_count() or 1))
+    return inps
 
 
 def get_aux_filename(inps):
@@ -219,7 +239,7 @@ def get_boxes4deforming_area(vel_file, mask_file, step=2, num_pixel=30**2, min_p
 
 def create_reference_point_element(inps, lats, lons, ts_obj):
     """Create reference point element"""
-    colormap = mpl.cm.get_cmap(inps.colormap)  # set colormap
+    colormap = plt.get_cmap(inps.colormap)  # set colormap
     norm = mpl.colors.Normalize(vmin=inps.vlim[0], vmax=inps.vlim[1])
 
     ref_yx = (int(ts_obj.metadata['REF_Y']), int(ts_obj.metadata['REF_X']))
@@ -258,6 +278,24 @@ def get_hex_color(v, colormap, norm):
     return c_hex
 
 
+def get_hex_colors(v, colormap, norm):
+    """Get color names in hex format for an array of numbers, the vectorized version of get_hex_color().
+    Parameters: v        : 1D np.ndarray, numbers of interest
+                colormap : matplotlib.colors.Colormap instance
+                norm     : matplotlib.colors.Normalize instance
+    Returns:    c_hex    : 1D np.ndarray of str, color names in hex format
+    """
+    rgba = colormap(norm(np.asarray(v, dtype=np.float64).reshape(-1)))
+    abgr = np.round(rgba[:, ::-1] * 255).astype(np.uint8)
+    c_hex = np.frombuffer(abgr.tobytes().hex().encode('ascii'), dtype='S8').astype(str)
+    return c_hex
+
+
+def str_concat(*parts):
+    """Concatenate strings and/or np.ndarray of strings element-wise."""
+    return reduce(np.char.add, parts)
+
+
 def get_description_string(coords, yx, v, vstd, disp, tcoh=None, font_size=4):
     """Description information of each data point."""
     des_str = "<font size={}>".format(font_size)
@@ -277,8 +315,30 @@ def get_description_string(coords, yx, v, vstd, disp, tcoh=None, font_size=4):
     return des_str
 
 
-def generate_js_datastring(dates, dygraph_file, num_date, ts):
-    """String of the Java Script for interactive plot of diplacement time-series"""
+def get_description_strings(lats, lons, rows, cols, v, vstd, disp, tcoh=None, font_size=4):
+    """Description information of data points, the vectorized version of get_description_string()."""
+    parts = ["<font size={}>".format(font_size),
+             "Latitude: ", np.char.mod('%.6f', lats), "˚ <br /> \n",
+             "Longitude: ", np.char.mod('%.6f', lons), "˚ <br /> \n",
+             "Row: ", np.char.mod('%.0f', rows), " <br /> \n",
+             "Column: ", np.char.mod('%.0f', cols), " <br /> \n",
+             " <br /> \n",
+             "Mean LOS velocity [cm/year]: ", np.char.mod('%.2f', v),
+             " +/- ", np.char.mod('%.2f', vstd), " <br /> \n",
+             "Cumulative displacement [cm]: ", np.char.mod('%.2f', disp), " <br /> \n"]
+    if tcoh is not None:
+        parts += ["Temporal coherence: ", np.char.mod('%.2f', tcoh), " <br /> \n"]
+    parts += ["</font>",
+              " <br />  <br /> ",
+              "*Double click to reset plot <br /> <br />\n",
+              "\n\n"]
+    des_strs = str_concat(*parts)
+    return des_strs
+
+
+def get_js_datastring_parts(dygraph_file):
+    """Head and tail of the Java Script for interactive plot of diplacement time-series,
+    with the date/displacement data in between."""
     dygraph_file = '../../../{}'.format(os.path.basename(dygraph_file))
     js_data_string = "<script type='text/javascript' src='{}'></script>".format(dygraph_file)
     js_data_string += """
@@ -294,14 +354,7 @@ def generate_js_datastring(dates, dygraph_file, num_date, ts):
             "Date, displacement\\n" +
     """
 
-    # append the date/displacement data
-    for k in range(num_date):
-        date = dates[k]
-        dis = ts[k]
-        date_displacement_string = "\"{}, {}\\n\" + \n".format(date, dis)
-        js_data_string += date_displacement_string
-
-    js_data_string += """
+    js_data_string_tail = """
     
     "",
        {
@@ -349,137 +402,152 @@ def generate_js_datastring(dates, dygraph_file, num_date, ts):
        </script>
     
     """
-    return js_data_string
+    return js_data_string, js_data_string_tail
 
 
-def create_kml_region_document(inps, box_list, ts_obj, step):
-    """Create list of KML.Document() objects 
-    for one level of details defined by box_list and step
-    """
-    dot_file = '../../{}'.format(os.path.basename(inps.dot_file))
-
-    ## 1. read data file into timeseries object
-    region_docs = []
-    num_box = len(box_list)
-    for i in range(num_box):
-        box = box_list[i]
+def generate_js_datastring(dates, dygraph_file, num_date, ts):
+    """String of the Java Script for interactive plot of diplacement time-series"""
+    js_data_string, js_data_string_tail = get_js_datastring_parts(dygraph_file)
 
-        if box is None:
-            box = (0, 0, ts_obj.width, ts_obj.length)
+    # append the date/displacement data
+    for k in range(num_date):
+        date = dates[k]
+        dis = ts[k]
+        date_displacement_string = "\"{}, {}\\n\" + \n".format(date, dis)
+        js_data_string += date_displacement_string
 
-        length = box[3] - box[1]
-        width = box[2] - box[0]
+    js_data_string += js_data_string_tail
+    return js_data_string
 
-        # 1.1 Parse Date
-        dates = np.array(ts_obj.times)  # 1D np.array of dates in datetime.datetime object in size of [num_date,]
-        dates = list(map(lambda d: d.strftime("%Y-%m-%d"), dates))
-        num_date = len(dates)
 
-        # 1.2 Parse Spatial coordinates
-        lats, lons = ut.get_lat_lon(ts_obj.metadata, box=box)
-        rows, cols = np.mgrid[box[1]:box[3] - 1:length * 1j, box[0]:box[2] - 1:width * 1j]
+def get_kml_region_text(inps, box, step):
+    """Create the KML text of one region document for one level of details defined by box and step.
+    The colors, descriptions and data strings of all the masked pixels in the box are formatted at once,
+    and the KML text is composed directly, in the same layout as the pretty printed pyKML document.
+    Parameters: inps     : namespace, with ts/vel/tcoh/mask_file, metadata, date_list,
+                           dot/dygraph_file, colormap, vlim and wrap
+                box      : tuple of 4 int, (x0, y0, x1, y1) of the region
+                step     : int, number of pixels per selection
+    Returns:    kml_text : bytes, KML text of the region document
+    """
+    if box is None:
+        box = (0, 0, int(inps.metadata['WIDTH']), int(inps.metadata['LENGTH']))
+    dot_file = '../../{}'.format(os.path.basename(inps.dot_file))
 
-        # 1.3 Read Velocity / time-series / temporal coherence data
-        vel = readfile.read(inps.vel_file, datasetName='velocity', box=box)[0] * 100.
-        vel_std = readfile.read(inps.vel_file, datasetName='velocityStd', box=box)[0] * 100.
-        ts_data = readfile.read(inps.ts_file, box=box)[0] * 100.
-        ts_data -= np.tile(ts_data[0, :, :], (ts_data.shape[0], 1, 1))  # enforce displacement starts from zero
-        temp_coh = readfile.read(inps.tcoh_file, box=box)[0]
-        mask = readfile.read(inps.mask_file, box=box)[0]
+    ## 1. read data of the selected pixels, which are not masked out
+    mask = readfile.read(inps.mask_file, box=box, print_msg=False)[0][::step, ::step]
+    yy, xx = np.nonzero(mask)
+    if yy.size == 0:
+        return (KML_REGION_HEAD + KML_REGION_TAIL).encode('ascii')
+    yy *= step
+    xx *= step
+    rows = yy + box[1]
+    cols = xx + box[0]
+
+    lats, lons = ut.get_lat_lon(inps.metadata, box=box)
+    lats = lats[yy, xx]
+    lons = lons[yy, xx]
+
+    vel = readfile.read(inps.vel_file, datasetName='velocity', box=box, print_msg=False)[0][yy, xx] * 100.
+    vel_std = readfile.read(inps.vel_file, datasetName='velocityStd', box=box, print_msg=False)[0][yy, xx] * 100.
+    ts_data = readfile.read(inps.ts_file, box=box, print_msg=False)[0][:, yy, xx] * 100.
+    ts_data = ts_data - ts_data[0, :]  # enforce displacement starts from zero
+    temp_coh = readfile.read(inps.tcoh_file, box=box, print_msg=False)[0][yy, xx]
+
+    vel_c = np.array(vel, dtype=np.float32)
+    if inps.wrap:
+        vel_c = inps.vlim[0] + np.mod(vel_c - inps.vlim[0], inps.vlim[1] - inps.vlim[0])
 
-        vel_c = np.array(vel, dtype=np.float32)
-        if inps.wrap:
-            vel_c = inps.vlim[0] + np.mod(vel_c - inps.vlim[0], inps.vlim[1] - inps.vlim[0])
+    ## 2. colors, descriptions and data strings of all pixels
+    colormap = plt.get_cmap(inps.colormap)
+    norm = mpl.colors.Normalize(vmin=inps.vlim[0], vmax=inps.vlim[1])
+    colors = get_hex_colors(vel_c, colormap, norm)
+
+    des_strs = get_description_strings(lats, lons, rows, cols, vel, vel_std, ts_data[-1], tcoh=temp_coh)
+    for c, c_esc in [('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;')]:
+        des_strs = np.char.replace(des_strs, c, c_esc)
+
+    # date/displacement lines in size of (num_date, num_pixel)
+    js_head, js_tail = [escape(i) for i in get_js_datastring_parts(inps.dygraph_file)]
+    date_strs = np.array(['"{}, '.format(i) for i in inps.date_list]).reshape(-1, 1)
+    js_lines = str_concat(date_strs, ts_data.astype(str), '\\n" + \n')
+
+    ## 3. KML text
+    kml_text = [KML_REGION_HEAD]
+    for color, des_str, js_line, lat, lon in zip(colors.tolist(),
+                                                 des_strs.tolist(),
+                                                 js_lines.T.tolist(),
+                                                 lats.astype(str).tolist(),
+                                                 lons.astype(str).tolist()):
+        kml_text.append(PLACEMARK_TEMPLATE.format(color=color,
+                                                  dot_file=dot_file,
+                                                  description=des_str + js_head + ''.join(js_line) + js_tail,
+                                                  lon=lon,
+                                                  lat=lat))
+    kml_text.append(KML_REGION_TAIL)
+
+    # non-ASCII characters as character references, as pyKML / lxml
+    kml_text = ''.join(kml_text).encode('ascii', 'xmlcharrefreplace')
+    return kml_text
+
+
+def get_kml_region_text_worker(inps, data):
+    return get_kml_region_text(inps, *data)
+
+
+def get_region_kml_file(net_link_file, num):
+    """Get the path of the region KML file within the KMZ file"""
+    return os.path.join(os.path.splitext(net_link_file)[0], "region_{}.kml".format(num))
+
+
+def write_kml_region_files(fz, inps, net_link_files, box_lists, steps, num_worker=1):
+    """Write the region KML files of all levels of details into the KMZ file.
+    The region documents are created by a local pool of num_worker processes,
+    while the main process is the only writer of the KMZ file.
+    Parameters: fz             : zipfile.ZipFile object in write mode
+                inps           : namespace, as required by get_kml_region_text()
+                net_link_files : list of str, network link file of each level of details
+                box_lists      : list of list of box, boxes of each level of details
+                steps          : list of int, step of each level of details
+                num_worker     : int, number of processes to use, run serially if 1
+    Returns:    num_region     : int, number of region files written
+    """
+    # list of (region file, box, step) for all levels of details
+    region_list = []
+    for net_link_file, box_list, step in zip(net_link_files, box_lists, steps):
+        for num, box in enumerate(box_list):
+            region_list.append((get_region_kml_file(net_link_file, num), box, step))
+    num_region = len(region_list)
+    print('-'*30)
+    print('create and write {} region KML files'.format(num_region))
 
+    def write_func(i, kml_text):
+        fz.writestr(region_list[i][0], kml_text)
 
-        ## 2. Create KML Document
-        kml_document = KML.Document()
+    # keep the data files open for the reading in many boxes, if run serially
+    with readfile.keep_file_open():
+        parallel.run_pipeline(get_kml_region_text_worker, [i[1:] for i in region_list], write_func,
+                              num_worker=num_worker,
+                              worker_inps=inps,
+                              suffix_list=[i[0] for i in region_list])
+    return num_region
 
-        # 2.1 Set and normalize colormap to defined vlim
-        colormap = mpl.cm.get_cmap(inps.colormap)
-        norm = mpl.colors.Normalize(vmin=inps.vlim[0], vmax=inps.vlim[1])
 
-        # 2.2 Set number of pixels to use
-        num_pixel = int(length / step) * int(width / step)
-        msg = "create KML doc for box {}/{}: {}".format(i+1, num_box, box)
-        msg += ", step: {} pixels, {} pixels in total ...".format(step, num_pixel)
-        print(msg)
+def write_network_link_file(fz, ts_obj, box_list, lod, net_link_file):
+    """Write the network link KML file for the region KML files of one level of details into the KMZ file"""
 
-        # 2.3 Create data folder for all points
-        data_folder = KML.Folder(KML.name("Data"))
-        for i in range(0, length, step):
-            for j in range(0, width, step):
-                if mask[i, j]:  # add point if it's not marked as masked out
-                    lat = lats[i, j]
-                    lon = lons[i, j]
-                    row = rows[i, j]
-                    col = cols[i, j]
-                    ts = ts_data[:, i, j]
-                    v = vel[i, j]
-                    vc = vel_c[i, j]
-                    vstd = vel_std[i, j]
-                    tcoh = temp_coh[i, j]
-
-                    # 2.3.1 Create KML icon style element
-                    style = KML.Style(
-                        KML.IconStyle(
-                            KML.color(get_hex_color(vc, colormap, norm)),
-                            KML.scale(0.5),
-                            KML.Icon(KML.href("{}".format(dot_file)))
-                        )
-                    )
-
-                    # 2.3.2 Create KML point element
-                    point = KML.Point(KML.coordinates("{},{}".format(lon, lat)))
-
-                    js_data_string = generate_js_datastring(dates, inps.dygraph_file, num_date, ts)
-
-                    # 2.3.3 Create KML description element
-                    stats_info = get_description_string((lat, lon), (row, col), v, vstd, ts[-1], tcoh=tcoh)
-                    description = KML.description(stats_info, js_data_string)
-
-                    # 2.3.4 Crate KML Placemark element to hold style, description, and point elements
-                    placemark = KML.Placemark(style, description, point)
-
-                    # 2.3.5 Append each placemark element to the KML document object
-                    data_folder.append(placemark)
-
-        # 2.4 Append data folder to KML document
-        kml_document.append(data_folder)
-
-        # 2.5 Append KML document to list of regionalized documents
-        region_docs.append(kml_document)
-
-    return region_docs
-
-
-def write_network_link_file(region_docs, ts_obj, box_list, lod, net_link_file):
-    """Write 1) the list of KML.Document() into data KML file and 2) the master kml file for the list"""
-
-    ## 1. Create directory to store regioalized KML data files
-    links_dir = os.path.splitext(net_link_file)[0]
-    if not os.path.isdir(links_dir):
-        os.makedirs(links_dir)
-    print("create KML region links directory: {}".format(os.path.basename(links_dir)))
-
-    ## 2. Create master KML element and KML Document element
+    ## 1. Create master KML element and KML Document element
     kml = KML.kml()
     kml_document = KML.Document()
 
-    ## 5. Generate a new network link element for each region
-    for num, (region_doc, box) in enumerate(zip(region_docs, box_list)):
-        region_kml_file = os.path.join(links_dir, "region_{}.kml".format(num))
+    ## 2. Generate a new network link element for each region
+    for num, box in enumerate(box_list):
+        region_kml_file = get_region_kml_file(net_link_file, num)
 
-        ## 5.1 Write the first region_document to a file and move it to the proper subdircetory
-        kml_1 = KML.kml()
-        kml_1.append(region_doc)
-        with open(region_kml_file, 'w') as f:
-            f.write(etree.tostring(kml_1, pretty_print=True).decode('utf-8'))
-
-        ## 5.2 Flatten lats and lons data
+        ## 2.1 Flatten lats and lons data
         lats, lons = flatten_lat_lon(box, ts_obj)
 
-        ## 5.3 Define new NetworkLink element
+        ## 2.2 Define new NetworkLink element
         network_link = KML.NetworkLink(
             KML.name('Region {}'.format(num)),
             KML.visibility(1),
@@ -496,21 +564,19 @@ def write_network_link_file(region_docs, ts_obj, box_list, lod, net_link_file):
                 )
             ),
             KML.Link(
-                KML.href(os.path.relpath(region_kml_file, start=os.path.dirname(links_dir))),
+                KML.href(os.path.relpath(region_kml_file, start=os.path.dirname(net_link_file))),
                 KML.viewRefreshMode('onRegion')
             )
         )
 
-        ## 5.4 Append new NetworkLink to KML document
+        ## 2.3 Append new NetworkLink to KML document
         kml_document.append(network_link)
     kml.append(kml_document)
 
-    ## 6. Write the full KML document to the output file and move it to the proper directory
-    with open(net_link_file, 'w') as f:
-        f.write(etree.tostring(kml, pretty_print=True).decode('utf-8'))
+    ## 3. Write the full KML document into the KMZ file
+    fz.writestr(net_link_file, etree.tostring(kml, pretty_print=True))
     return net_link_file
 
-
 def create_network_link_element(net_link_file, ts_obj):
     """Create an KML.NetworkLink element for one level of details"""
     net_link_name = os.path.splitext(os.path.basename(net_link_file))[0]
@@ -540,10 +606,8 @@ def create_network_link_element(net_link_file, ts_obj):
     return network_link
 
 
-def generate_network_link(inps, ts_obj, step, lod):
-    """Generate the KML.NetworkLink element for one level of details, defined by step and lod"""
-    net_link_file = os.path.join(inps.kml_data_dir, "{0}by{0}.kml".format(step))
-
+def get_box_list(inps, ts_obj, step):
+    """Get the list of boxes for one level of details, defined by step"""
     if step < 5:
         box_list = get_boxes4deforming_area(inps.vel_file, inps.mask_file,
                                             step=inps.steps[-1],
@@ -551,12 +615,22 @@ def generate_network_link(inps, ts_obj, step, lod):
                                             cutoff=inps.cutoff)
     else:
         box_list = split_into_sub_boxes((ts_obj.length, ts_obj.width), step=step)
+    return box_list
 
-    region_docs = create_kml_region_document(inps, box_list, ts_obj, step)
 
-    write_network_link_file(region_docs, ts_obj, box_list, lod, net_link_file)
+def get_network_link_file(step):
+    """Get the path of the network link file for one level of details within the KMZ file"""
+    return os.path.join('kml_data', "{0}by{0}.kml".format(step))
 
-    net_link = create_network_link_element(os.path.relpath(net_link_file, start=inps.work_dir), ts_obj)
+
+def generate_network_link(fz, ts_obj, box_list, step, lod):
+    """Generate the KML.NetworkLink element for one level of details, defined by step and lod,
+    and write its network link file into the KMZ file."""
+    net_link_file = get_network_link_file(step)
+
+    write_network_link_file(fz, ts_obj, box_list, lod, net_link_file)
+
+    net_link = create_network_link_element(net_link_file, ts_obj)
 
     return net_link
 
@@ -568,7 +642,6 @@ def main(iargs=None):
     inps.star_file = os.path.join(inps.work_dir, "star.png")
     inps.dot_file = os.path.join(inps.work_dir, "shaded_dot.png")
     inps.dygraph_file = os.path.join(inps.work_dir, "dygraph-combined.js")
-    inps.kml_data_dir = os.path.join(inps.work_dir, 'kml_data')
 
     ## Define file names
     if inps.outfile:
@@ -583,6 +656,7 @@ def main(iargs=None):
     ts_obj.open()
     length, width = ts_obj.length, ts_obj.width
     inps.metadata = ts_obj.metadata
+    inps.date_list = [i.strftime("%Y-%m-%d") for i in ts_obj.times]
     lats, lons = ut.get_lat_lon(ts_obj.metadata)
     print('input data shape in row/col: {}/{}'.format(length, width))
 
@@ -610,51 +684,41 @@ def main(iargs=None):
     ref_folder.append(ref_point)
     kml_master_doc.append(ref_folder)
 
-    # 3 Create data folder to contain actual data elements
-    net_link1 = generate_network_link(inps, ts_obj, step=inps.steps[0], lod=(0, inps.lods[0]))
-    net_link2 = generate_network_link(inps, ts_obj, step=inps.steps[1], lod=(inps.lods[0], inps.lods[1]))
-    net_link3 = generate_network_link(inps, ts_obj, step=inps.steps[2], lod=(inps.lods[1], inps.lods[2]))
+    ## Generate KMZ file, with all KML files written into it directly
+    with ZipFile(kmz_file, 'w') as fz:
 
-    # 3.3 Append network links to data folder
-    data_folder = KML.Folder(KML.name("Data"))
-    data_folder.append(net_link1)
-    data_folder.append(net_link2)
-    data_folder.append(net_link3)
-    kml_master_doc.append(data_folder)
+        # 3 Create data folder to contain actual data elements
+        lod_list = [(0, inps.lods[0]), (inps.lods[0], inps.lods[1]), (inps.lods[1], inps.lods[2])]
+        box_lists = [get_box_list(inps, ts_obj, step) for step in inps.steps]
+        write_kml_region_files(fz, inps,
+                               net_link_files=[get_network_link_file(step) for step in inps.steps],
+                               box_lists=box_lists,
+                               steps=inps.steps,
+                               num_worker=inps.numWorker)
 
+        # 3.1 Append network links to data folder
+        data_folder = KML.Folder(KML.name("Data"))
+        for box_list, step, lod in zip(box_lists, inps.steps, lod_list):
+            data_folder.append(generate_network_link(fz, ts_obj, box_list, step, lod))
+        kml_master_doc.append(data_folder)
+
+
+        ##---------------------------- Write master KML file ------------------------------##
+        print('-'*30)
+        print('writing {} into the KMZ file'.format(os.path.basename(kml_master_file)))
+        kml_master = KML.kml()
+        kml_master.append(kml_master_doc)
+        fz.writestr(os.path.basename(kml_master_file), etree.tostring(kml_master, pretty_print=True))
+
+        ## Copy auxiliary files
+        fz.write(inps.cbar_file, arcname=os.path.basename(inps.cbar_file))
+        os.remove(inps.cbar_file)
+        res_dir = os.path.join(os.path.dirname(__file__), "../docs/resources")
+        for fname in [inps.star_file, inps.dot_file, inps.dygraph_file]:
+            src_file = os.path.join(res_dir, os.path.basename(fname))
+            fz.write(src_file, arcname=os.path.basename(fname))
+            print("copy {} into the KMZ file".format(src_file))
 
-    ##---------------------------- Write master KML file ------------------------------##
-    print('-'*30)
-    print('writing ' + kml_master_file)
-    kml_master = KML.kml()
-    kml_master.append(kml_master_doc)
-    with open(kml_master_file, 'w') as f:
-        f.write(etree.tostring(kml_master, pretty_print=True).decode('utf-8'))
-
-    ## Copy auxiliary files
-    res_dir = os.path.join(os.path.dirname(__file__), "../docs/resources")
-    for fname in [inps.star_file, inps.dot_file, inps.dygraph_file]:
-        src_file = os.path.join(res_dir, os.path.basename(fname))
-        shutil.copy2(src_file, inps.work_dir)
-        print("copy {} to the local directory".format(src_file))
-
-    ## Generate KMZ file
-    # 1) go to the directory of kmz file
-    run_dir = os.path.abspath(os.getcwd())
-    os.chdir(inps.work_dir)
-    # 2) zip all data files
-    with ZipFile(kmz_file, 'w') as fz:
-        kml_data_files = get_all_file_paths(inps.kml_data_dir)
-        for fname in [kml_master_file, 
-                      inps.cbar_file,
-                      inps.dygraph_file,
-                      inps.dot_file,
-                      inps.star_file] + kml_data_files:
-            fz.write(os.path.relpath(fname))
-            os.remove(fname)
-        shutil.rmtree(inps.kml_data_dir)
-    # 3) go back to the running directory
-    os.chdir(run_dir)
     print('merged all files to {}'.format(kmz_file))
     print('Done.')
     print('Open {} in Google Earth and play!'.format(kmz_file))
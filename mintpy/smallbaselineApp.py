@@ -10,7 +10,9 @@
 
 import os
 import re
+import json
 import time
+import hashlib
 import datetime
 import shutil
 import argparse
@@ -44,6 +46,19 @@ STEP_LIST = [
     'hdfeos5',
 ]
 
+# steps supported by the step cache (mintpy.compute.stepCache)
+STEP_CACHE_LIST = [
+    'correct_unwrap_error',
+    'stack_interferograms',
+    'invert_network',
+    'correct_LOD',
+    'correct_troposphere',
+    'deramp',
+    'correct_topography',
+    'velocity',
+    'geocode',
+]
+
 STEP_HELP = """Command line options for steps processing with names are chosen from the following list:
 
 {}
@@ -66,6 +81,10 @@ EXAMPLE = """example:
   # Run with --start/stop/dostep options
   smallbaselineApp.py GalapagosSenDT128.template --dostep velocity  #run at step 'velocity' only
   smallbaselineApp.py GalapagosSenDT128.template --end load_data    #end after step 'load_data'
+
+  # Append new acquisitions to an existing processing, with the following options in the template:
+  #   mintpy.load.appendMode = yes, mintpy.networkInversion.appendMode = yes
+  smallbaselineApp.py GalapagosSenDT128.template
 """
 
 REFERENCE = """reference:
@@ -759,6 +778,7 @@ class TimeSeriesAnalysis:
                     else:
                         if tropo_model in ['ERA5']:
                             from mintpy import tropo_pyaps3
+                            scp_args += ' --num-worker {}'.format(self.template['mintpy.troposphericDelay.numWorker'])
                             print('tropo_pyaps3.py', scp_args)
                             tropo_pyaps3.main(scp_args.split())
                         else:
@@ -1001,11 +1021,209 @@ class TimeSeriesAnalysis:
         return
 
 
+    def get_step_cache_files(self, step_name):
+        """Get input / output files of the step for the step cache.
+        Parameters: step_name : str, step name
+        Returns:    in_files  : list of (str, list of str), input file and the datasets read by the step to hash,
+                                all if None
+                    out_files : list of (str, list of str), output file and its datasets to check existence
+                    None, None for steps not supported by the step cache, e.g. the ones modifying their
+                    input files in place, or turned off.
+        """
+        in_files, out_files = None, None
+        if step_name not in STEP_CACHE_LIST:
+            return in_files, out_files
+
+        stack_file, geom_file, lookup_file = ut.check_loaded_dataset(self.workDir, print_msg=False)[1:4]
+        # 1D datasets of the network, e.g. dropIfgram modified by modify_network
+        stack_ds_names = ['date', 'bperp', 'dropIfgram']
+        if step_name in ['correct_LOD', 'correct_troposphere', 'deramp', 'correct_topography',
+                         'velocity', 'geocode']:
+            fnames = self.get_timeseries_filename(self.template)[step_name]
+
+        if step_name == 'correct_unwrap_error':
+            method = self.template['mintpy.unwrapError.method']
+            if method:
+                ds_names = stack_ds_names + ['unwrapPhase', 'coherence', 'connectComponent']
+                out_ds_names = {'bridging'               : ['unwrapPhase_bridging'],
+                                'phase_closure'          : ['unwrapPhase_phaseClosure'],
+                                'bridging+phase_closure' : ['unwrapPhase_bridging',
+                                                            'unwrapPhase_bridging_phaseClosure']}[method]
+                in_files = [(stack_file, ds_names), ('maskConnComp.h5', None)]
+                out_files = [(stack_file, out_ds_names)]
+
+        elif step_name == 'stack_interferograms':
+            in_files = [(stack_file, stack_ds_names + ['unwrapPhase'])]
+            out_files = [('avgPhaseVelocity.h5', None)]
+
+        elif step_name == 'invert_network':
+            # unwrapPhase with the most corrections, and the ones for weighting / masking
+            ds_names = readfile.get_dataset_list(stack_file) if stack_file else []
+            unw_ds_names = [i for i in ['unwrapPhase_bridging_phaseClosure',
+                                        'unwrapPhase_bridging',
+                                        'unwrapPhase_phaseClosure'] if i in ds_names]
+            ds_names = stack_ds_names + (unw_ds_names + ['unwrapPhase'])[:1]
+            if self.template['mintpy.networkInversion.weightFunc'] not in [False, 'no']:
+                ds_names.append('coherence')
+            mask_ds_name = self.template['mintpy.networkInversion.maskDataset']
+            if mask_ds_name not in [False, 'no'] and mask_ds_name not in ds_names:
+                ds_names.append(mask_ds_name)
+            in_files = [(stack_file, ds_names), (geom_file, None)]
+            out_files = [(i, None) for i in ['timeseries.h5', 'temporalCoherence.h5',
+                                             'numInvIfgram.h5', 'maskTempCoh.h5']]
+
+        elif step_name in ['correct_LOD', 'correct_troposphere', 'deramp', 'correct_topography']:
+            if fnames['input'] != fnames['output']:
+                in_files = [(fnames['input'], None), (geom_file, None)]
+                out_files = [(fnames['output'], None)]
+                if step_name == 'correct_troposphere':
+                    if self.template['mintpy.troposphericDelay.method'] == 'height_correlation':
+                        in_files.append(('maskTempCoh.h5', None))
+                    else:
+                        tropo_model = self.template['mintpy.troposphericDelay.weatherModel']
+                        out_files.append(('./inputs/{}.h5'.format(tropo_model), None))
+                elif step_name == 'correct_topography':
+                    out_files.append(('demErr.h5', None))
+
+        elif step_name == 'velocity':
+            in_files = [(fnames['input'], None)]
+            out_files = [('velocity.h5', None)]
+
+        elif step_name == 'geocode':
+            atr = readfile.read_attribute(fnames['input'])
+            if self.template['mintpy.geocode'] and 'Y_FIRST' not in atr.keys():
+                in_files = [(i, None) for i in [lookup_file, geom_file, 'temporalCoherence.h5',
+                                                fnames['input'], 'velocity.h5']]
+                out_files = [(os.path.join('geo', 'geo_{}'.format(os.path.basename(i[0]))), None)
+                             for i in in_files[1:]]
+                out_files.append((os.path.join('geo', 'geo_maskTempCoh.h5'), None))
+
+        # option values pointing to files, e.g. mask / exclude_date.txt, are also input files
+        if in_files is not None:
+            for key in self.get_step_cache_options(step_name).keys():
+                value = self.template[key]
+                if isinstance(value, str) and os.path.isfile(value):
+                    in_files.append((value, None))
+        return in_files, out_files
+
+
+    def get_step_cache_options(self, step_name):
+        """Get the template options used by the step, for the step cache."""
+        prefix_list = {'correct_unwrap_error' : ['mintpy.unwrapError.'],
+                       'invert_network'       : ['mintpy.networkInversion.'],
+                       'correct_troposphere'  : ['mintpy.troposphericDelay.'],
+                       'deramp'               : ['mintpy.deramp'],
+                       'correct_topography'   : ['mintpy.topographicResidual'],
+                       'velocity'             : ['mintpy.velocity.'],
+                       'geocode'              : ['mintpy.geocode', 'mintpy.networkInversion.minTempCoh'],
+                      }.get(step_name, [])
+        options = dict()
+        for key, value in self.template.items():
+            if any(key.startswith(prefix) for prefix in prefix_list):
+                options[key] = str(value)
+        return options
+
+
+    def get_step_cache_key(self, step_name, after_step=False):
+        """Get the key of the step for the step cache, as the hash of the content of its input files,
+        template options and MintPy version.
+        Parameters: step_name  : str, step name
+                    after_step : bool, re-use the hash of the input data calculated before the step,
+                                 as the step does not write its input datasets, while it may write
+                                 the attributes or other datasets of the same file, e.g. ifgramStack.h5
+        Returns:    key        : str, key of the step, None if the step is not supported by the step cache
+        """
+        in_files = self.get_step_cache_files(step_name)[0]
+        if in_files is None:
+            return None
+
+        in_files = [i for i in in_files if i[0] and os.path.isfile(i[0])]
+        print('calculate the step cache key from the content of {} input files ...'.format(len(in_files)))
+        h = hashlib.md5()
+        h.update('{}{}'.format(step_name, mintpy.version.release_version).encode('utf-8'))
+        h.update(str(sorted(self.get_step_cache_options(step_name).items())).encode('utf-8'))
+        for fname, ds_names in sorted(in_files, key=lambda x: x[0]):
+            fname = os.path.relpath(fname, self.workDir)
+            h.update(fname.encode('utf-8'))
+            h.update(ut.get_file_hash(fname,
+                                      datasetNames=ds_names,
+                                      hash_cache=self.stepCache['files'],
+                                      keep_data_hash=after_step).encode('utf-8'))
+        key = h.hexdigest()
+        self.write_step_cache()
+        return key
+
+
+    def run_or_skip_step(self, step_name):
+        """Check the step cache, to skip the step if:
+        1) all its output files / datasets exist, and
+        2) its key, the hash of the content of input files, template options and MintPy version,
+           is the same as the one recorded after its last run.
+        Returns:    flag : str, run or skip
+                    key  : str, key of the step, None if the step is not supported by the step cache
+        """
+        out_files = self.get_step_cache_files(step_name)[1]
+        key = self.get_step_cache_key(step_name)
+        if key is None:
+            return 'run', None
+
+        # check output files / datasets
+        flag = 'run'
+        if key != self.stepCache['steps'].get(step_name, {}).get('key', None):
+            print('step cache: key of step {} is NOT the same as its last run.'.format(step_name))
+        elif not all(os.path.isfile(fname) for fname, ds_names in out_files):
+            print('step cache: NOT all output files found: {}.'.format([i[0] for i in out_files]))
+        elif not all(all(i in readfile.get_dataset_list(fname) for i in ds_names)
+                     for fname, ds_names in out_files if ds_names):
+            print('step cache: NOT all output datasets found: {}.'.format([i for i in out_files if i[1]]))
+        else:
+            flag = 'skip'
+            print('step cache: same key {} as its last run at {}, and all output files exist.'.format(
+                key, self.stepCache['steps'][step_name]['time']))
+        print('run or skip: {}.'.format(flag))
+        return flag, key
+
+
+    def read_step_cache(self):
+        """Read the step cache from the sidecar manifest file in the work directory."""
+        self.stepCacheFile = os.path.join(self.workDir, 'smallbaselineApp_cache.json')
+        self.stepCache = {'steps': {}, 'files': {}}
+        if os.path.isfile(self.stepCacheFile):
+            try:
+                with open(self.stepCacheFile, 'r') as f:
+                    self.stepCache.update(json.load(f))
+            except ValueError:
+                print('WARNING: can not read step cache file: {}, ignore it.'.format(self.stepCacheFile))
+        return self.stepCache
+
+
+    def write_step_cache(self, step_name=None, key=None):
+        """Write the step cache into the sidecar manifest file, with the key of the step if given."""
+        if step_name and key:
+            self.stepCache['steps'][step_name] = {'key': key,
+                                                  'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                                                  'version': mintpy.version.release_version}
+        with open(self.stepCacheFile, 'w') as f:
+            json.dump(self.stepCache, f, indent=2, sort_keys=True)
+        return self.stepCacheFile
+
+
     def run(self, steps=STEP_LIST, plot=True):
+        # step cache
+        if self.template['mintpy.compute.stepCache']:
+            self.read_step_cache()
+
         # run the chosen steps
         for sname in steps:
             print('\n\n******************** step - {} ********************'.format(sname))
 
+            # skip the step with the same key in step cache
+            key = None
+            if self.template['mintpy.compute.stepCache']:
+                flag, key = self.run_or_skip_step(sname)
+                if flag == 'skip':
+                    continue
+
             if sname == 'load_data':
                 self.run_load_data(sname)
 
@@ -1054,6 +1272,11 @@ class TimeSeriesAnalysis:
             elif sname == 'hdfeos5':
                 self.run_save2hdfeos5(sname)
 
+            # record the key of the step in step cache, re-calculated after the step without re-reading
+            # the input data, as some steps modify their input files, e.g. the attributes of ifgramStack.h5
+            if key:
+                self.write_step_cache(sname, self.get_step_cache_key(sname, after_step=True))
+
         # plot result (show aux visualization message for multiple steps processing)
         print_aux = len(steps) > 1
         self.plot_result(print_aux=print_aux, plot=plot)
@@ -15,9 +15,10 @@ try:
 except ImportError:
     raise ImportError('Could not import skimage!')
 
+import h5py
 import numpy as np
 from scipy import ndimage
-from mintpy.utils import readfile, writefile
+from mintpy.utils import readfile, writefile, utils as ut
 
 
 ################################################################################################
@@ -27,6 +28,7 @@ EXAMPLE = """example:
   spatial_filter.py  velocity.h5    lowpass_avg        5
   spatial_filter.py  velocity.h5    highpass_gaussian  3
   spatial_filter.py  velocity.h5    sobel
+  spatial_filter.py  timeseries.h5  lowpass_gaussian   3  --memory 2GB
 """
 
 
@@ -48,6 +50,8 @@ def create_parser():
                              'Sigma       for low/high pass gaussian filter, default: 3.0\n' +
                              'Kernel Size for low/high pass average filter, default: 5')
     parser.add_argument('-o', '--outfile', help='Output file name.')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use for 3D dataset, e.g. 8GB, 512MB, or number in GB (default: %(default)s).')
     return parser
 
 
@@ -101,7 +105,7 @@ def filter_data(data, filter_type, filter_par=None):
 
 
 ############################################################
-def filter_file(fname, filter_type, filter_par=None, fname_out=None):
+def filter_file(fname, filter_type, filter_par=None, fname_out=None, max_memory=4):
     """Filter 2D matrix with selected filter
     Inputs:
         fname       : string, name/path of file to be filtered
@@ -109,6 +113,7 @@ def filter_file(fname, filter_type, filter_par=None, fname_out=None):
         filter_par  : string, optional, parameter for low/high pass filter
                       for low/highpass_avg, it's kernel size in int
                       for low/highpass_gaussain, it's sigma in float
+        max_memory  : str / float, max memory to use for 3D dataset, e.g. 8GB or number in GB
     Output:
         fname_out   : string, optional, output file name/path
     """
@@ -132,25 +137,53 @@ def filter_file(fname, filter_type, filter_par=None, fname_out=None):
         fname_out = '{}_{}{}'.format(os.path.splitext(fname)[0], filter_type,
                                      os.path.splitext(fname)[1])
 
-    # filtering file
+    # filtering 2D datasets
+    # 3D datasets from HDF5 file are filtered block by block while writing
     dsNames = readfile.get_dataset_list(fname)
     maxDigit = max([len(i) for i in dsNames])
     dsDict = dict()
+    ds3dDict = dict()
     for dsName in dsNames:
-        msg = 'filtering {d:<{w}} from {f} '.format(
-            d=dsName, w=maxDigit, f=os.path.basename(fname))
+        if os.path.splitext(fname)[1] in ['.h5', '.he5']:
+            with h5py.File(fname, 'r') as f:
+                ds = f[dsName]
+                if ds.ndim == 3:
+                    ds3dDict[dsName] = [ds.dtype, ds.shape, ds.chunks]
+                    continue
+
+        print('filtering {d:<{w}} from {f} '.format(d=dsName, w=maxDigit, f=os.path.basename(fname)))
         data = readfile.read(fname, datasetName=dsName, print_msg=False)[0]
-        if len(data.shape) == 3:
-            num_loop = data.shape[0]
-            for i in range(num_loop):
+        dsDict[dsName] = filter_data(data, filter_type, filter_par)
+
+    if not ds3dDict:
+        writefile.write(dsDict, out_file=fname_out, metadata=atr, ref_file=fname)
+        return fname_out
+
+    # layout output file
+    ds_name_dict = {key: [data.dtype, data.shape, data] for key, data in dsDict.items()}
+    ds_name_dict.update({key: value[:2] for key, value in ds3dDict.items()})
+    writefile.layout_hdf5(fname_out, ds_name_dict, metadata=atr, ref_file=fname)
+
+    # filtering 3D datasets block by block
+    for dsName, (dtype, shape, chunks) in ds3dDict.items():
+        msg = 'filtering {d:<{w}} from {f} '.format(d=dsName, w=maxDigit, f=os.path.basename(fname))
+        num_pixel = shape[1] * shape[2]
+        slice_list = ut.split_slice2blocks(shape[0],
+                                           array_list=[(dtype, num_pixel), (np.float64, 2*num_pixel)],
+                                           max_memory=max_memory,
+                                           chunk_depth=chunks[0] if chunks else 1)
+        for z0, z1 in slice_list:
+            with h5py.File(fname, 'r') as f:
+                data = f[dsName][z0:z1, :, :]
+            for i in range(z1 - z0):
                 data[i, :, :] = filter_data(data[i, :, :], filter_type, filter_par)
-                sys.stdout.write('\r{} {}/{} ...'.format(msg, i+1, num_loop))
+                sys.stdout.write('\r{} {}/{} ...'.format(msg, z0+i+1, shape[0]))
                 sys.stdout.flush()
-            print('')
-        else:
-            data = filter_data(data, filter_type, filter_par)
-        dsDict[dsName] = data
-    writefile.write(dsDict, out_file=fname_out, metadata=atr, ref_file=fname)
+            writefile.write_hdf5_block(fname_out, data, datasetName=dsName,
+                                       block=[z0, z1, 0, shape[1], 0, shape[2]],
+                                       print_msg=False)
+        print('')
+    print('finished writing to {}'.format(fname_out))
     return fname_out
 
 
@@ -158,7 +191,9 @@ def filter_file(fname, filter_type, filter_par=None, fname_out=None):
 def main(iargs=None):
     inps = cmd_line_parse(iargs)
 
-    inps.outfile = filter_file(inps.file, inps.filter_type, inps.filter_par)
+    inps.outfile = filter_file(inps.file, inps.filter_type, inps.filter_par,
+                               fname_out=inps.outfile,
+                               max_memory=inps.maxMemory)
     print('Done.')
     return inps.outfile
 
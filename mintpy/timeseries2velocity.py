@@ -30,6 +30,7 @@ EXAMPLE = """example:
   timeseries2velocity.py  timeseries.h5  --start-date 20080201
   timeseries2velocity.py  timeseries.h5  --start-date 20080201  --end-date 20100508
   timeseries2velocity.py  timeseries.h5  --exclude-date exclude_date.txt
+  timeseries2velocity.py  timeseries.h5  --ignore-nan --memory 2GB
 
   timeseries2velocity.py  LS-PARAMS.h5
   timeseries2velocity.py  NSBAS-PARAMS.h5
@@ -69,6 +70,11 @@ def create_parser():
                         help='template file with the following items:'+TEMPLATE)
     parser.add_argument('-o', '--output', dest='outfile',
                         help='output file name')
+    parser.add_argument('--ignore-nan', dest='ignoreNaN', action='store_true',
+                        help='estimate velocity from the valid dates only for pixels with NaN value,\n' +
+                             'instead of setting them to NaN in the output.')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use per block, e.g. 8GB, 512MB, or number in GB (default: %(default)s).')
     parser.add_argument('--update', dest='update_mode', action='store_true',
                         help='Enable update mode, and skip estimation if:\n'+
                              '1) output velocity file already exists, readable '+
@@ -106,6 +112,10 @@ def read_template2inps(template_file, inps=None):
                 inpsDict[key] = ptime.yyyymmdd(value)
             elif key in ['excludeDate']:
                 inpsDict[key] = ptime.yyyymmdd(value.replace(',', ' ').split())
+
+    key = 'mintpy.compute.maxMemory'
+    if template.get(key, None):
+        inpsDict['maxMemory'] = template[key]
     return inps
 
 
@@ -223,27 +233,93 @@ def read_date_info(inps):
     return inps
 
 
-def estimate_linear_velocity(inps):
-    # read time-series data
-    print('reading data from file {} ...'.format(inps.timeseries_file))
-    ts_data, atr = readfile.read(inps.timeseries_file)
-    ts_data = ts_data[inps.dropDate, :, :].reshape(inps.numDate, -1)
-    if atr['UNIT'] == 'mm':
-        ts_data *= 1./1000.
+def estimate_velocity(date_list, ts_data, ignore_nan=False):
+    """Estimate the linear velocity and its STD with least squares.
+    Parameters: date_list  : list of str in YYYYMMDD format
+                ts_data    : 2D np.array in size of (num_date, num_pixel), displacement time-series
+                ignore_nan : bool, estimate from the valid dates only for pixels with NaN value,
+                             grouped by their pattern of NaN dates; otherwise they are set to NaN.
+    Returns:    vel        : 1D np.array in size of (num_pixel,), velocity
+                vel_std    : 1D np.array in size of (num_pixel,), velocity STD
+    """
+    A = timeseries.get_design_matrix4average_velocity(date_list)
+    num_pixel = ts_data.shape[1]
+    vel = np.zeros(num_pixel, dtype=dataType) * np.nan
+    vel_std = np.zeros(num_pixel, dtype=dataType) * np.nan
+
+    # group pixels by their pattern of valid dates, packed into bits to save memory
+    if ignore_nan and num_pixel > 0:
+        flag_nan = np.packbits(np.isnan(ts_data), axis=0).T
+        patterns, pattern_idx = np.unique(flag_nan, axis=0, return_inverse=True)
+        del flag_nan
+        pattern_idx = pattern_idx.flatten()
+        nan_patterns = np.unpackbits(patterns, axis=1)[:, :ts_data.shape[0]].astype(np.bool_).T
+        pixel_order = np.argsort(pattern_idx, kind='mergesort')
+        pixel_groups = np.split(pixel_order, np.cumsum(np.bincount(pattern_idx))[:-1])
+    else:
+        nan_patterns = np.zeros((ts_data.shape[0], 1), dtype=np.bool_)
+
+    for i in range(nan_patterns.shape[1]):
+        flag = ~nan_patterns[:, i]
+        num_date = np.sum(flag)
+        if num_date < 2:
+            continue
+
+        if nan_patterns.shape[1] == 1:
+            idx = slice(None)
+            ts = ts_data
+        else:
+            idx = pixel_groups[i]
+            ts = ts_data[:, idx]
+        if num_date < ts_data.shape[0]:
+            ts = ts[flag, :]
+        Ai = A[flag, :]
+
+        # The following is equivalent
+        # X = scipy.linalg.lstsq(A, ts_data, cond=1e-15)[0]
+        # It is not used because it can not handle NaN value in ts_data
+        X = np.dot(np.linalg.pinv(Ai), ts)
+        vel[idx] = X[0, :]
+
+        # velocity STD (Eq. (10), Fattahi and Amelung, 2015)
+        # not available with 2 dates only, as there is no degree of freedom left
+        if num_date <= 2:
+            continue
+        ts_diff = ts - np.dot(Ai, X)
+        t_diff = Ai[:, 0] - np.mean(Ai[:, 0])
+        vel_std[idx] = np.sqrt(np.sum(ts_diff ** 2, axis=0) / np.sum(t_diff ** 2)  / (num_date - 2))
+    return vel, vel_std
+
+
+def split2boxes(inps):
+    """Split into blocks in rows to reduce memory usage"""
+    atr = readfile.read_attribute(inps.timeseries_file)
     length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    num_date_all = inps.dropDate.size
+
+    # memory usage per pixel: input time-series, float64 copies in the inversion
+    array_list = [(np.float32, num_date_all),
+                  (np.float64, inps.numDate),
+                  (np.float64, inps.numDate)]
+    # NaN mask and its packed copies to group pixels by their pattern of valid dates
+    if inps.ignoreNaN:
+        array_list += [(np.bool_, inps.numDate),
+                       (np.uint8, int(np.ceil(inps.numDate / 8)) * 3)]
+    chunk_shape = None
+    if inps.key == 'timeseries':
+        chunk_shape = ut.get_chunk_shape(inps.timeseries_file, 'timeseries')
+
+    box_list = ut.split_box2blocks((length, width),
+                                   array_list=array_list,
+                                   max_memory=inps.maxMemory,
+                                   chunk_shape=chunk_shape)
+    return box_list
 
-    # The following is equivalent
-    # X = scipy.linalg.lstsq(A, ts_data, cond=1e-15)[0]
-    # It is not used because it can not handle NaN value in ts_data
-    A = timeseries.get_design_matrix4average_velocity(inps.dateList)
-    X = np.dot(np.linalg.pinv(A), ts_data)
-    vel = np.array(X[0, :].reshape(length, width), dtype=dataType)
 
-    # velocity STD (Eq. (10), Fattahi and Amelung, 2015)
-    ts_diff = ts_data - np.dot(A, X)
-    t_diff = A[:, 0] - np.mean(A[:, 0])
-    vel_std = np.sqrt(np.sum(ts_diff ** 2, axis=0) / np.sum(t_diff ** 2)  / (inps.numDate - 2))
-    vel_std = np.array(vel_std.reshape(length, width), dtype=dataType)
+def estimate_linear_velocity(inps):
+    atr = readfile.read_attribute(inps.timeseries_file)
+    length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    ts_unit = atr.get('UNIT', 'm')
 
     # prepare attributes
     atr['FILE_TYPE'] = 'velocity'
@@ -256,11 +332,41 @@ def estimate_linear_velocity(inps):
     for key in configKeys:
         atr[key_prefix+key] = str(vars(inps)[key])
 
-    # write to HDF5 file
-    dsDict = dict()
-    dsDict['velocity'] = vel
-    dsDict['velocityStd'] = vel_std
-    writefile.write(dsDict, out_file=inps.outfile, metadata=atr)
+    # initiate HDF5 file
+    ds_name_dict = {'velocity'    : [dataType, (length, width)],
+                    'velocityStd' : [dataType, (length, width)]}
+    writefile.layout_hdf5(inps.outfile, ds_name_dict, metadata=atr)
+
+    # estimate block by block
+    box_list = split2boxes(inps)
+    num_box = len(box_list)
+    for i, box in enumerate(box_list):
+        box_wid = box[2] - box[0]
+        box_len = box[3] - box[1]
+        if num_box > 1:
+            print('\n------- processing patch {} out of {} --------------'.format(i+1, num_box))
+            print('box: {}'.format(box))
+
+        # read time-series data
+        print('reading data from file {} ...'.format(inps.timeseries_file))
+        ts_data = readfile.read(inps.timeseries_file, box=box)[0]
+        ts_data = ts_data.reshape(-1, box_len, box_wid)[inps.dropDate, :, :].reshape(inps.numDate, -1)
+        if ts_unit == 'mm':
+            ts_data *= 1./1000.
+
+        vel, vel_std = estimate_velocity(inps.dateList, ts_data, ignore_nan=inps.ignoreNaN)
+        del ts_data
+
+        # write to HDF5 file
+        block = [box[1], box[3], box[0], box[2]]
+        writefile.write_hdf5_block(inps.outfile,
+                                   data=vel.reshape(box_len, box_wid),
+                                   datasetName='velocity',
+                                   block=block)
+        writefile.write_hdf5_block(inps.outfile,
+                                   data=vel_std.reshape(box_len, box_wid),
+                                   datasetName='velocityStd',
+                                   block=block)
     return inps.outfile
 
 
@@ -158,18 +158,17 @@ def estimate_phase_elevation_ratio(dem, ts_data, inps):
     dem = dem[mask_nan]
     ts_data = ts_data[:, mask_nan]
 
-    # calculate correlation coefficient
+    # calculate correlation coefficient of all dates at once
     print('----------------------------------------------------------')
     print('calculate correlation of DEM with each acquisition')
-    topo_trop_corr = np.zeros(num_date, np.float32)
+    dem_anom = dem - np.mean(dem)
+    ts_anom = ts_data - np.mean(ts_data, axis=1, keepdims=True, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        topo_trop_corr = np.dot(ts_anom, dem_anom) / (np.linalg.norm(ts_anom, axis=1) * np.linalg.norm(dem_anom))
+    topo_trop_corr[np.count_nonzero(ts_data, axis=1) == 0] = 0.
+    topo_trop_corr = np.array(topo_trop_corr, dtype=np.float32)
     for i in range(num_date):
-        phase = ts_data[i, :]
-        cc = 0.
-        if np.count_nonzero(phase) > 0:
-            comp_data = np.vstack((dem, phase))
-            cc = np.corrcoef(comp_data)[0, 1]
-            topo_trop_corr[i] = cc
-        print('{}: {:>5.2f}'.format(inps.date_list[i], cc))
+        print('{}: {:>5.2f}'.format(inps.date_list[i], topo_trop_corr[i]))
     topo_trop_corr = np.abs(topo_trop_corr)
     print('average correlation magnitude: {:>5.2f}'.format(np.nanmean(topo_trop_corr)))
 
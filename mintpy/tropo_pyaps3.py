@@ -10,9 +10,10 @@ import os
 import re
 import subprocess
 import argparse
+import h5py
 import numpy as np
 from mintpy.objects import timeseries, geometry
-from mintpy.utils import readfile, ptime, utils as ut
+from mintpy.utils import readfile, writefile, ptime, parallel, utils as ut
 
 try:
     import pyaps3 as pa
@@ -33,6 +34,7 @@ verbose = False
 EXAMPLE = """example:
   # download reanalysys dataset, calculate tropospheric delays and correct time-series file.
   tropo_pyaps3.py -f timeseries.h5 -g inputs/geometryRadar.h5
+  tropo_pyaps3.py -f timeseries.h5 -g inputs/geometryRadar.h5 --num-worker 4 --mem 2
 
   # download reanalysys dataset, calculate tropospheric delays
   tropo_pyaps3.py -d date_list.txt     --hour 12 -m ERA5  -g inputs/geometryRadar.h5
@@ -71,6 +73,7 @@ mintpy.troposphericDelay.method = auto  #[pyaps / height_correlation / no], auto
 ## multiple copies if you work with different dataset that cover the same date/time.
 mintpy.troposphericDelay.weatherModel = auto  #[ERA5 / ECMWF / MERRA / NARR], auto for ERA5, for pyaps method
 mintpy.troposphericDelay.weatherDir   = auto  #[path2directory], auto for WEATHER_DIR or "./"
+mintpy.troposphericDelay.numWorker    = auto  #[int > 0], auto for 1, number of processes to calculate delays
 """
 
 DATA_INFO = """
@@ -119,6 +122,10 @@ def create_parser():
                         nargs=2, help='reference pixel in y/x')
     parser.add_argument('--delay', dest='delay_type', default='comb', choices={'comb', 'dry', 'wet'},
                         help='Delay type to calculate, comb contains both wet and dry delays')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of processes to calculate delays of different dates in parallel (default: %(default)s).')
+    parser.add_argument('--mem', '--memory', dest='maxMemory', default=4,
+                        help='max memory to use per block, e.g. 8GB, 512MB, or number in GB (default: %(default)s).')
 
     # For delay correction
     parser.add_argument('-f', '--file', dest='timeseries_file',
@@ -150,6 +157,7 @@ def cmd_line_parse(iargs=None):
 
     ## default values
     print('weather model: '+inps.tropo_model)
+    inps.numWorker = max(1, min(inps.numWorker, os.cpu_count() or 1))
 
     # weather_dir
     inps.weather_dir = os.path.expanduser(inps.weather_dir)
@@ -519,36 +527,110 @@ def get_delay_timeseries(inps, atr):
     length, width = int(atr['LENGTH']), int(atr['WIDTH'])
     num_date = len(inps.grib_file_list)
     date_list = [str(re.findall('\d{8}', i)[0]) for i in inps.grib_file_list]
-    tropo_data = np.zeros((num_date, length, width), np.float32)
-
-    print('calcualting delay for each date using PyAPS (Jolivet et al., 2011; 2014) ...')
-    print('number of grib files used: {}'.format(num_date))
-    prog_bar = ptime.progressBar(maxValue=num_date)
-    for i in range(num_date):
-        grib_file = inps.grib_file_list[i]
-        tropo_data[i] = get_delay(grib_file, inps)
-        prog_bar.update(i+1, suffix=os.path.basename(grib_file))
-    prog_bar.close()
 
     # Convert relative phase delay on reference date
     inps.ref_date = atr.get('REF_DATE', date_list[0])
-    print('convert to relative phase delay with reference date: '+inps.ref_date)
     inps.ref_idx = date_list.index(inps.ref_date)
-    tropo_data -= np.tile(tropo_data[inps.ref_idx, :, :], (num_date, 1, 1))
     atr['REF_DATE'] = inps.ref_date
-
-    # Write tropospheric delay to HDF5
     if inps.ref_yx:
         atr['REF_Y'] = inps.ref_yx[0]
         atr['REF_X'] = inps.ref_yx[1]
-    ts_obj = timeseries(inps.tropo_file)
-    ts_obj.write2hdf5(data=tropo_data,
-                      dates=date_list,
-                      metadata=atr,
-                      refFile=inps.timeseries_file)
+
+    # layout the tropospheric delay HDF5 file
+    layout_tropo_file(inps.tropo_file, date_list, atr, shape=(length, width), ref_file=inps.timeseries_file)
+
+    print('calcualting delay for each date using PyAPS (Jolivet et al., 2011; 2014) ...')
+    print('number of grib files used: {}'.format(num_date))
+    write_delay_timeseries(inps.tropo_file, inps.grib_file_list, inps, num_worker=inps.numWorker)
+
+    print('convert to relative phase delay with reference date: '+inps.ref_date)
+    subtract_reference_date(inps.tropo_file, inps.ref_idx, max_memory=inps.maxMemory)
+    print('finished writing to {}'.format(inps.tropo_file))
     return
 
 
+def layout_tropo_file(tropo_file, date_list, metadata, shape, ref_file=None):
+    """Create the empty time-series HDF5 file of tropospheric delay, to be filled date by date.
+    Parameters: tropo_file : str, path of the output tropospheric delay file, e.g. ERA5.h5
+                date_list  : list of str in YYYYMMDD format
+                metadata   : dict, metadata to be saved in tropo_file
+                shape      : tuple of 2 int, (length, width)
+                ref_file   : str, timeseries file for the compression type and bperp
+    Returns:    tropo_file : str
+    """
+    num_date = len(date_list)
+    meta = dict(metadata)
+    meta['FILE_TYPE'] = 'timeseries'
+
+    ds_name_dict = {
+        'timeseries' : [np.float32, (num_date, shape[0], shape[1])],
+        'date'       : [np.dtype('S8'), (num_date,), np.array(date_list, dtype=np.string_)],
+    }
+
+    # bperp of the dates with delay from the timeseries file
+    if ref_file:
+        ts_obj = timeseries(ref_file)
+        ts_obj.open(print_msg=False)
+        if ts_obj.pbase is not None:
+            bperp = np.array([ts_obj.pbase[ts_obj.dateList.index(i)] for i in date_list], dtype=np.float32)
+            ds_name_dict['bperp'] = [np.float32, (num_date,), bperp]
+
+    writefile.layout_hdf5(tropo_file, ds_name_dict, metadata=meta, ref_file=ref_file)
+    return tropo_file
+
+
+def get_delay_worker(delay_inps, grib_file):
+    return get_delay(grib_file, delay_inps)
+
+
+def write_delay_timeseries(tropo_file, grib_file_list, inps, num_worker=1):
+    """Calculate the delay of each date and write it into the existing tropo_file.
+    The delays are calculated by a local pool of num_worker processes,
+    while the main process is the only writer of tropo_file.
+    Parameters: tropo_file     : str, tropospheric delay file created by layout_tropo_file()
+                grib_file_list : list of str, grib files in the same order as the dates in tropo_file
+                inps           : namespace, with tropo_model, delay_type, dem, inc, lat, lon and ref_yx
+                num_worker     : int, number of processes to use, run serially if 1
+    Returns:    tropo_file     : str
+    """
+    # pass the geometry once to each worker process
+    delay_inps = argparse.Namespace(**{key: vars(inps)[key] for key in ['tropo_model', 'delay_type',
+                                                                         'dem', 'inc', 'lat', 'lon',
+                                                                         'ref_yx']})
+    with h5py.File(tropo_file, 'a') as f:
+        ds = f['timeseries']
+
+        def write_func(i, delay):
+            ds[i] = delay
+
+        parallel.run_pipeline(get_delay_worker, grib_file_list, write_func,
+                              num_worker=num_worker,
+                              worker_inps=delay_inps,
+                              suffix_list=[os.path.basename(i) for i in grib_file_list])
+    return tropo_file
+
+
+def subtract_reference_date(tropo_file, ref_idx, max_memory=4):
+    """Convert the delay time-series into relative delay on the reference date in place, block by block.
+    Parameters: tropo_file : str, tropospheric delay file
+                ref_idx    : int, index of the reference date
+                max_memory : float, max memory in GB to use per block
+    Returns:    tropo_file : str
+    """
+    with h5py.File(tropo_file, 'a') as f:
+        ds = f['timeseries']
+        num_date, length, width = ds.shape
+        row_list = ut.split_slice2blocks(length,
+                                         array_list=[(np.float32, num_date * width)],
+                                         max_memory=max_memory,
+                                         print_msg=False)
+        for y0, y1 in row_list:
+            data = ds[:, y0:y1, :]
+            data -= data[ref_idx]
+            ds[:, y0:y1, :] = data
+    return tropo_file
+
+
 def correct_timeseries(timeseries_file, tropo_file, out_file):
     print('\n------------------------------------------------------------------------------')
     print('correcting delay for input time-series by calling diff.py')
@@ -8,7 +8,11 @@
 
 import os
 import sys
+import queue
 import argparse
+import threading
+from collections import OrderedDict
+import h5py
 import numpy as np
 import scipy.stats as stats
 import matplotlib.pyplot as plt
@@ -303,91 +307,371 @@ def read_exclude_date(input_ex_date, dateListAll):
     return ex_date_list, ex_dates, ex_flag
 
 
+def prepare_overview4display(inps):
+    """Prepare the overviews of all time-series files for the displacement map,
+    in the coarsest level with at least one data pixel per figure pixel.
+    Parameters: inps : Namespace of input arguments
+    Returns:    inps : Namespace of input arguments, with ovr_obj_list and ovr_level
+    """
+    num_file = len(inps.timeseries_file)
+    inps.ovr_obj_list, inps.ovr_level = [None] * num_file, 1
+    if not inps.multilook:
+        return inps
+
+    # size of the displacement map axes in pixels
+    fig_size = inps.figsize_img if inps.figsize_img else plt.rcParams['figure.figsize']
+    dpi = inps.fig_dpi if inps.save_fig else plt.rcParams['figure.dpi']
+    out_shape = (int(fig_size[1] * 0.65 * dpi), int(fig_size[0] * 0.75 * dpi))
+
+    # common level of all files
+    level_list = []
+    for i, fname in enumerate(inps.timeseries_file):
+        inps.ovr_obj_list[i], level = view.prepare_overview(fname, inps.pix_box,
+                                                            ovr_mode=inps.overview,
+                                                            out_shape=out_shape,
+                                                            print_msg=False)
+        level_list.append(level)
+    level = min(level_list)
+    if level > 1 and all(obj.is_valid(level) for obj in inps.ovr_obj_list):
+        inps.ovr_level = level
+        vprint('use overviews in level {} for the displacement map'.format(level))
+    return inps
+
+
+class timeseriesPixelReader:
+    """Read the point time-series from a time-series file in blocks of pixels, through a LRU cache
+    of the recently read blocks and a background thread to prefetch the neighbouring blocks,
+    thus the memory usage is bounded by max_memory, independent of the size of the file.
+
+    Example:
+        reader = timeseriesPixelReader('timeseries.h5', date_list)
+        ts = reader.read(300, 400)
+        reader.close()
+    """
+
+    def __init__(self, fname, date_list, max_memory=0.2, print_msg=True):
+        self.file = fname
+        self.date_list = date_list
+        self.max_cache_size = max_memory * 1024**3
+        self.cache = OrderedDict()
+        self.cache_size = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.f = None
+        self.thread = None
+
+        atr = readfile.read_attribute(fname)
+        self.length, self.width = int(atr['LENGTH']), int(atr['WIDTH'])
+        k = atr['FILE_TYPE']
+        if k == 'timeseries':
+            ds_name, date_name = 'timeseries', 'date'
+        elif k == 'HDFEOS':
+            ds_name = 'HDFEOS/GRIDS/timeseries/observation/displacement'
+            date_name = 'HDFEOS/GRIDS/timeseries/observation/date'
+        else:
+            # no block access, read the pixel with readfile
+            return
+
+        self.f = h5py.File(fname, 'r')
+        self.ds = self.f[ds_name]
+        date_list_all = [i.decode('utf8') for i in self.f[date_name][:]]
+        self.date_index = np.array([date_list_all.index(i) for i in date_list])
+        if np.array_equal(self.date_index, np.arange(len(date_list_all))):
+            self.date_index = None
+
+        # block in the size of the chunks of the dataset, within [8, 64] pixels per side,
+        # smaller for long time-series, so that the cache holds the 3x3 neighbouring blocks
+        chunks = self.ds.chunks if self.ds.chunks else (1, 32, 32)
+        block_shape = [int(np.clip(i, 8, 64)) for i in chunks[-2:]]
+        block_size = len(date_list) * 4 * 16
+        while max(block_shape) > 8 and block_size * np.prod(block_shape) > self.max_cache_size:
+            block_shape = [max(8, i // 2) for i in block_shape]
+        self.block_shape = tuple(block_shape)
+        if print_msg:
+            print('read point time-series from {} in blocks of {} pixels'.format(fname, self.block_shape))
+
+        self.thread = threading.Thread(target=self.prefetch, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def get_block(self, key):
+        """Get one block of pixels in (num_date, block_length, block_width) from the cache or the file"""
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        y0, x0 = key[0] * self.block_shape[0], key[1] * self.block_shape[1]
+        y1, x1 = min(y0 + self.block_shape[0], self.length), min(x0 + self.block_shape[1], self.width)
+        data = self.ds[:, y0:y1, x0:x1]
+        if self.date_index is not None:
+            data = data[self.date_index]
+        data = np.array(data, dtype=np.float32)
+
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = data
+                self.cache_size += data.nbytes
+            self.cache.move_to_end(key)
+            while self.cache_size > self.max_cache_size and len(self.cache) > 1:
+                self.cache_size -= self.cache.popitem(last=False)[1].nbytes
+        return data
+
+    def prefetch(self):
+        """Read the queued blocks into the cache in the background"""
+        while True:
+            key = self.queue.get()
+            if key is None:
+                break
+            try:
+                self.get_block(key)
+            except Exception:
+                pass
+            with self.lock:
+                self.pending.discard(key)
+
+    def read(self, y, x):
+        """Read the time-series of pixel (y, x)
+        Returns: ts : 1D np.ndarray in float32 in size of (num_date,)
+        """
+        if self.f is None:
+            box = (x, y, x+1, y+1)
+            data = readfile.read(self.file, datasetName=self.date_list, box=box, print_msg=False)[0]
+            return np.array(data, dtype=np.float32).reshape(-1)
+
+        by, bx = y // self.block_shape[0], x // self.block_shape[1]
+        ts = np.array(self.get_block((by, bx))[:, y % self.block_shape[0], x % self.block_shape[1]])
+
+        # prefetch the neighbouring blocks
+        num_row = int(np.ceil(self.length / self.block_shape[0]))
+        num_col = int(np.ceil(self.width / self.block_shape[1]))
+        with self.lock:
+            for key in [(by+i, bx+j) for i in [-1, 0, 1] for j in [-1, 0, 1]]:
+                if (0 <= key[0] < num_row and 0 <= key[1] < num_col
+                        and key not in self.cache and key not in self.pending):
+                    self.pending.add(key)
+                    self.queue.put(key)
+        return ts
+
+
+def read_point_timeseries(yx, inps):
+    """Read the displacement time-series of one pixel from all time-series files in full resolution
+    Parameters: yx   : list of 2 int, pixel in y/x
+                inps : Namespace of input arguments, with pts_reader_list, ref_ts_list and unit_fac_list
+    Returns:    ts_list : list of 1D np.array in size of (num_date,)
+    """
+    ts_list = []
+    for i, reader in enumerate(inps.pts_reader_list):
+        d_tsi = reader.read(yx[0], yx[1])
+        if inps.ref_ts_list[i] is not None:
+            d_tsi -= inps.ref_ts_list[i]
+        d_tsi -= d_tsi[inps.ref_idx]
+        ts_list.append(d_tsi * inps.unit_fac_list[i])
+    return ts_list
+
+
+def read_timeseries_block(idx_list, inps, file_idx=0):
+    """Read the displacement maps of multiple dates, referenced in space, in the data unit,
+    from the overviews if available.
+    Parameters: idx_list : list of int, index of the dates in inps.date_list
+                inps     : Namespace of input arguments
+                file_idx : int, index of the time-series file
+    Returns:    data     : 3D np.ndarray in float32 in size of (num_date, length, width),
+                           in the size of box divided by inps.ovr_level
+    """
+    kwargs = dict(datasetName=[inps.date_list[i] for i in idx_list], box=inps.pix_box, print_msg=False)
+    if inps.ovr_level > 1:
+        data = inps.ovr_obj_list[file_idx].read(inps.ovr_level, **kwargs)[0]
+    else:
+        data = readfile.read(inps.timeseries_file[file_idx], **kwargs)[0]
+    data = np.array(data, dtype=np.float32).reshape(len(idx_list), data.shape[-2], data.shape[-1])
+    if inps.ref_ts_list[file_idx] is not None:
+        data -= inps.ref_ts_list[file_idx][idx_list].reshape(-1, 1, 1)
+    return data
+
+
+def read_timeseries_slice(idx, inps, file_idx=0):
+    """Read the displacement map of one date, referenced in space and time, in display unit,
+    from the overviews if available, through a LRU cache of the recently read maps.
+    Parameters: idx      : int, index of the date in inps.date_list
+                inps     : Namespace of input arguments
+                file_idx : int, index of the time-series file
+    Returns:    data     : 2D np.ndarray in float32, in the size of box divided by inps.ovr_level
+    """
+    key = (file_idx, idx)
+    if key in inps.slice_cache.keys():
+        inps.slice_cache.move_to_end(key)
+        return np.array(inps.slice_cache[key])
+
+    # reference date in time
+    ref_key = (file_idx, 'ref')
+    if ref_key not in inps.slice_cache.keys():
+        inps.slice_cache[ref_key] = read_timeseries_block([inps.ref_idx], inps, file_idx)[0]
+    data = read_timeseries_block([idx], inps, file_idx)[0] - inps.slice_cache[ref_key]
+    data *= inps.unit_fac_list[file_idx]
+
+    inps.slice_cache[key] = data
+    while len(inps.slice_cache) > 16:
+        inps.slice_cache.popitem(last=False)
+    return np.array(data)
+
+
+def read_timeseries_stats(inps, file_idx=0, calc_ylim=True, max_memory=1):
+    """Go through the displacement maps of all dates, referenced in space and time, in display unit,
+    in blocks of dates to limit the memory usage, from the overviews if available,
+    to get the mask, data range and display ranges in one pass.
+    Parameters: inps       : Namespace of input arguments
+                file_idx   : int, index of the time-series file
+                calc_ylim  : bool, calculate the display range of the point time-series as well
+                max_memory : float, max memory in GB to use per block
+    Returns:    ts_stack   : 2D np.ndarray in float32, sum of all dates, for the mask
+                dlim       : list of 2 float, data range of all dates
+                vlim       : list of 2 float, range of the non-excluded dates multilooked by 10,
+                             for the displacement map
+                ylim       : list of 2 float, range of the non-excluded dates multilooked by 4,
+                             referenced to the first date if --zero-first, for the point time-series,
+                             None if calc_ylim is False
+    """
+    ref_data = read_timeseries_block([inps.ref_idx], inps, file_idx)[0]
+    vlks = max(1, 10 // inps.ovr_level)
+    ylks = max(1, 4 // inps.ovr_level)
+
+    # offset from the reference date of the map to the one of the point time-series
+    y_off = None
+    if calc_ylim and inps.zero_first and inps.zero_idx != inps.ref_idx:
+        y_off = read_timeseries_block([inps.zero_idx], inps, file_idx)[0]
+        y_off -= ref_data
+        y_off *= -inps.unit_fac_list[file_idx]
+
+    ts_stack = np.zeros(ref_data.shape, np.float32)
+    dlim_list, vlim_list, ylim_list = [], [], []
+    slice_list = ut.split_slice2blocks(inps.num_date,
+                                       array_list=[(np.float32, ref_data.size * 2)],
+                                       max_memory=max_memory,
+                                       print_msg=False)
+    for i0, i1 in slice_list:
+        data = read_timeseries_block(list(range(i0, i1)), inps, file_idx)
+        data -= ref_data
+        data *= inps.unit_fac_list[file_idx]
+        ts_stack += np.sum(data, axis=0)
+        if np.any(~np.isnan(data)):
+            dlim_list += [np.nanmin(data), np.nanmax(data)]
+
+        flag = inps.ex_flag[i0:i1] != 0
+        if not np.any(flag):
+            continue
+        data = data[flag]
+        data_mli = multilook_data(data, vlks, vlks)
+        if np.any(~np.isnan(data_mli)):
+            vlim_list += [np.nanmin(data_mli), np.nanmax(data_mli)]
+
+        if calc_ylim:
+            if y_off is not None:
+                data += y_off
+                data_mli = multilook_data(data, ylks, ylks)
+            elif ylks != vlks:
+                data_mli = multilook_data(data, ylks, ylks)
+            if np.any(~np.isnan(data_mli)):
+                ylim_list += [np.nanmin(data_mli), np.nanmax(data_mli)]
+
+    dlim = [min(dlim_list), max(dlim_list)] if dlim_list else [np.nan, np.nan]
+    vlim = [min(vlim_list), max(vlim_list)] if vlim_list else [np.nan, np.nan]
+    ylim = None
+    if calc_ylim:
+        ylim = [min(ylim_list), max(ylim_list)] if ylim_list else [np.nan, np.nan]
+    return ts_stack, dlim, vlim, ylim
+
+
 def read_timeseries_data(inps):
-    """Read data of time-series files
+    """Prepare the lazy reading of time-series files, while only the displacement map
+    of the display date is kept in memory:
+    1) displacement map of one date at a time via read_timeseries_slice(), from the overviews if available
+    2) point time-series in full resolution via read_point_timeseries()
+    3) mask, data range and display ranges from all dates via read_timeseries_stats()
     Parameters: inps : Namespace of input arguments
-    Returns:    ts_data : list of 3D np.array in size of (num_date, length, width)
-                mask : 2D np.array in size of (length, width)
+    Returns:    mask : 2D np.array in size of (length, width), divided by inps.ovr_level
                 inps : Namespace of input arguments
     """
-    # read list of 3D time-series
-    ts_data = []
+    inps = prepare_overview4display(inps)
+    lks = inps.ovr_level
+    inps.slice_cache = OrderedDict()
+
+    # point time-series reader, unit scale and reference pixel of each file
+    inps.pts_reader_list = []
+    inps.unit_fac_list = []
+    inps.ref_ts_list = []
     for fname in inps.timeseries_file:
-        vprint('reading timeseries from file {} ...'.format(fname))
-        data, atr = readfile.read(fname, datasetName=inps.date_list, box=inps.pix_box)
-        try:
-            ref_phase = data[:, inps.ref_yx[0]-inps.pix_box[1], inps.ref_yx[1]-inps.pix_box[0]]
-            data -= np.tile(ref_phase.reshape(-1, 1, 1), (1, data.shape[-2], data.shape[-1]))
+        reader = timeseriesPixelReader(fname, inps.date_list, print_msg=inps.print_msg)
+        inps.pts_reader_list.append(reader)
+
+        atr = readfile.read_attribute(fname)
+        inps.unit_fac_list.append(pp.scale_data2disp_unit(metadata=atr, disp_unit=inps.disp_unit)[2])
+
+        ref_ts = None
+        ref_y, ref_x = inps.ref_yx
+        if 0 <= ref_y < reader.length and 0 <= ref_x < reader.width:
+            ref_ts = reader.read(ref_y, ref_x)
             vprint('reference to pixel: {}'.format(inps.ref_yx))
-        except:
-            pass
-        vprint('reference to date: {}'.format(inps.date_list[inps.ref_idx]))
-        data -= np.tile(data[inps.ref_idx, :, :], (inps.num_date, 1, 1))
-
-        # Display Unit
-        (data,
-         inps.disp_unit,
-         inps.unit_fac) = pp.scale_data2disp_unit(data,
-                                                  metadata=atr,
-                                                  disp_unit=inps.disp_unit)
-        ts_data.append(data)
+        inps.ref_ts_list.append(ref_ts)
+    vprint('reference to date: {}'.format(inps.date_list[inps.ref_idx]))
+
+    # default ylim based on all dates of the last file, in the same pass for one file
+    num_file = len(inps.timeseries_file)
+    calc_ylim = not inps.ylim and num_file == 1
+
+    vprint('reading displacement of all dates from file {} ...'.format(inps.timeseries_file[0]))
+    ts_stack, inps.dlim, vlim, ylim = read_timeseries_stats(inps, file_idx=0, calc_ylim=calc_ylim)
 
     # Mask file: input mask file + non-zero ts pixels - ref_point
-    mask = np.ones(ts_data[0].shape[-2:], np.bool_)
+    mask = np.ones(ts_stack.shape, np.bool_)
     msk = pp.read_mask(inps.timeseries_file[0],
                        mask_file=inps.mask_file,
                        datasetName='displacement',
                        box=inps.pix_box,
                        print_msg=inps.print_msg)[0]
+    if lks > 1 and msk is not None:
+        msk = multilook_data(np.array(msk, dtype=np.float32), lks, lks)
     mask[msk == 0.] = False
     del msk
 
-    ts_stack = np.sum(ts_data[0], axis=0)
     mask[ts_stack == 0.] = False
     mask[np.isnan(ts_stack)] = False
     del ts_stack
 
     #do not mask the reference point
     try:
-        mask[inps.ref_yx[0]-inps.pix_box[1],
-             inps.ref_yx[1]-inps.pix_box[0]] = True
+        mask[(inps.ref_yx[0]-inps.pix_box[1]) // lks,
+             (inps.ref_yx[1]-inps.pix_box[0]) // lks] = True
     except:
         pass
 
-    #vprint('masking data')
-    #ts_mask = np.tile(mask, (inps.num_date, 1, 1))
-    #for i in range(len(ts_data)):
-    #    ts_data[i][ts_mask == 0] = np.nan
-    #    try:
-    #        ts_data[i][:, inps.ref_yx[0], inps.ref_yx[1]] = 0.   # keep value on reference pixel
-    #    except:
-    #        pass
-    #del ts_mask
-
     # default vlim
-    inps.dlim = [np.nanmin(ts_data[0]), np.nanmax(ts_data[0])]
-    ts_data_mli = multilook_data(np.squeeze(ts_data[0]), 10, 10)
     if not inps.vlim:
-        inps.vlim = [np.nanmin(ts_data_mli[inps.ex_flag != 0]),
-                     np.nanmax(ts_data_mli[inps.ex_flag != 0])]
+        inps.vlim = vlim
     vprint('data    range: {} {}'.format(inps.dlim, inps.disp_unit))
     vprint('display range: {} {}'.format(inps.vlim, inps.disp_unit))
 
     # default ylim
-    num_file = len(inps.timeseries_file)
     if not inps.ylim:
-        ts_data_mli = multilook_data(np.squeeze(ts_data[-1]), 4, 4)
-        if inps.zero_first:
-            ts_data_mli -= np.tile(ts_data_mli[inps.zero_idx, :, :], (inps.num_date, 1, 1))
-        ymin, ymax = (np.nanmin(ts_data_mli[inps.ex_flag != 0]),
-                      np.nanmax(ts_data_mli[inps.ex_flag != 0]))
+        if num_file > 1:
+            vprint('reading displacement of all dates from file {} ...'.format(inps.timeseries_file[-1]))
+            ylim = read_timeseries_stats(inps, file_idx=num_file-1)[3]
+        ymin, ymax = ylim
         ybuffer = (ymax - ymin) * 0.05
         inps.ylim = [ymin - ybuffer, ymax + ybuffer]
         if inps.offset:
             inps.ylim[1] += inps.offset * (num_file - 1)
-    del ts_data_mli
 
-    return ts_data, mask, inps
+    return mask, inps
 
 
 def plot_ts_errorbar(ax, dis_ts, inps, ppar):
@@ -572,15 +856,15 @@ class timeseriesViewer():
 
 
     def plot(self):
-        # read 3D time-series
-        self.ts_data, self.mask = read_timeseries_data(self)[0:2]
+        # prepare lazy reading of time-series
+        self.mask = read_timeseries_data(self)[0]
 
         # Figure 1 - Cumulative Displacement Map
         self.fig_img = plt.figure(self.figname_img, figsize=self.figsize_img)
 
         # Figure 1 - Axes 1 - Displacement Map
         self.ax_img = self.fig_img.add_axes([0.125, 0.25, 0.75, 0.65])
-        img_data = np.array(self.ts_data[0][self.idx, :, :])  ####################
+        img_data = read_timeseries_slice(self.idx, self)
         img_data[self.mask == 0] = np.nan
         self.plot_init_image(img_data)
 
@@ -601,6 +885,7 @@ class timeseriesViewer():
         # Final linking of the canvas to the plots.
         self.fig_img.canvas.mpl_connect('button_press_event', self.update_plot_timeseries)
         self.fig_img.canvas.mpl_connect('key_press_event', self.on_key_event)
+        self.fig_img.canvas.mpl_connect('close_event', self.close)
         if self.disp_fig:
             vprint('showing ...')
             msg = '\n------------------------------------------------------------------------'
@@ -610,6 +895,15 @@ class timeseriesViewer():
             msg += '\n------------------------------------------------------------------------'
             vprint(msg)
             plt.show()
+        else:
+            self.close()
+        return
+
+
+    def close(self, event=None):
+        """Close the point time-series readers, e.g. when the displacement map figure is closed"""
+        for reader in getattr(self, 'pts_reader_list', []):
+            reader.close()
         return
 
 
@@ -673,7 +967,7 @@ class timeseriesViewer():
         self.ax_img.set_title('N = {n}, Time = {t}'.format(n=idx, t=disp_date),
                               fontsize=self.font_size)
         # read data
-        data_img = np.array(self.ts_data[0][idx, :, :])
+        data_img = read_timeseries_slice(idx, self)
         data_img[self.mask == 0] = np.nan
         if self.wrap:
             if self.disp_unit_img == 'radian':
@@ -693,18 +987,20 @@ class timeseriesViewer():
         self.ax_pts.cla()
 
         # plot scatter in different size for different files
-        num_file = len(self.ts_data)
+        num_file = len(self.timeseries_file)
         if   num_file <= 2: ms_step = 4
         elif num_file == 3: ms_step = 3
         elif num_file == 4: ms_step = 2
         elif num_file >= 5: ms_step = 1
     
         d_ts = []
-        y = yx[0] - self.pix_box[1]
-        x = yx[1] - self.pix_box[0]
+        y = (yx[0] - self.pix_box[1]) // self.ovr_level
+        x = (yx[1] - self.pix_box[0]) // self.ovr_level
+        # read point time-series in full resolution
+        pts_data = read_point_timeseries(yx, self)
         for i in range(num_file-1, -1, -1):
             # get displacement data
-            d_tsi = self.ts_data[i][:, y, x]
+            d_tsi = pts_data[i]
             if self.zero_first:
                 d_tsi -= d_tsi[self.zero_idx]
             d_ts.append(d_tsi)
@@ -737,7 +1033,7 @@ class timeseriesViewer():
             self.ax_pts.yaxis.set_label_position("right")
 
         # legend
-        if len(self.ts_data) > 1:
+        if num_file > 1:
             self.ax_pts.legend()
 
         self.fig_pts.canvas.draw()
@@ -786,7 +1082,7 @@ class timeseriesViewer():
                                       fontsize=self.font_size)
 
                 # read data
-                data_img = np.array(self.ts_data[0][idx, :, :])
+                data_img = read_timeseries_slice(idx, self)
                 data_img[self.mask == 0] = np.nan
                 if self.wrap:
                     if self.disp_unit_img == 'radian':
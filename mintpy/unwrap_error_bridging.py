@@ -13,7 +13,7 @@ import h5py
 import numpy as np
 from mintpy.objects import ifgramStack
 from mintpy.objects.conncomp import connectComponent
-from mintpy.utils import (ptime,
+from mintpy.utils import (parallel,
                           readfile,
                           writefile,
                           utils as ut)
@@ -30,6 +30,7 @@ configKeys = ['ramp',
 EXAMPLE = """Example:
   unwrap_error_bridging.py  ./inputs/ifgramStack.h5  -t GalapagosSenDT128.template --update
   unwrap_error_bridging.py  ./inputs/ifgramStack.h5  --water-mask waterMask.h5
+  unwrap_error_bridging.py  ./inputs/ifgramStack.h5  --water-mask waterMask.h5 --num-worker 16
   unwrap_error_bridging.py  20180502_20180619.unw    --water-mask waterMask.h5
 """
 
@@ -51,6 +52,7 @@ mintpy.unwrapError.method          = auto  #[bridging / phase_closure / no], aut
 mintpy.unwrapError.ramp            = auto  #[linear / quadratic], auto for linear
 mintpy.unwrapError.waterMaskFile   = auto  #[waterMask.h5 / no], auto for no
 mintpy.unwrapError.bridgePtsRadius = auto  #[1-inf], auto for 150, radius in pixel of circular area around bridge ends
+mintpy.unwrapError.numWorker       = auto  #[int > 0], auto for 1, number of processes to correct interferograms
 """
 
 def create_parser():
@@ -65,6 +67,8 @@ def create_parser():
     parser.add_argument('--ramp', dest='ramp', choices=['linear', 'quadratic'],
                           help='type of phase ramp to be removed before correction.')
     parser.add_argument('--water-mask','--wm', dest='waterMaskFile', type=str, help='path of water mask file.')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of processes to correct interferograms in parallel (default: %(default)s).')
 
     parser.add_argument('-t', '--template', dest='template_file', type=str,
                           help='template file with bonding point info, e.g.\n' +
@@ -99,6 +103,7 @@ def cmd_line_parse(iargs=None):
     if inps.waterMaskFile and not os.path.isfile(inps.waterMaskFile):
         inps.waterMaskFile = None
 
+    inps.numWorker = max(1, min(inps.numWorker, os.cpu_count() or 1))
     return inps
 
 
@@ -119,7 +124,7 @@ def read_template2inps(template_file, inps=None):
         elif value:
             if key in ['waterMaskFile', 'ramp']:
                 inpsDict[key] = value
-            elif key in ['bridgePtsRadius']:
+            elif key in ['bridgePtsRadius', 'numWorker']:
                 inpsDict[key] = int(value)
     return inps
 
@@ -173,9 +178,26 @@ def run_or_skip(inps):
 
 
 ##########################################################################################
+def bridge_unwrap_error(data):
+    """Correct the unwrapping error of one interferogram with bridging.
+    Parameters: data : tuple of (unw, cc, metadata, radius, ramp_type)
+                    unw       : 2D np.ndarray, unwrapped phase
+                    cc        : 2D np.ndarray, connected components, with water body masked out
+                    metadata  : dict, attributes of the interferogram
+                    radius    : int, radius of the end point of bridge
+                    ramp_type : str, name of phase ramp to be removed during the phase jump estimation
+    Returns:    unw_cor : 2D np.ndarray, corrected unwrapped phase
+    """
+    unw, cc, metadata, radius, ramp_type = data
+    cc_obj = connectComponent(conncomp=cc, metadata=metadata)
+    cc_obj.label()
+    cc_obj.find_mst_bridge()
+    return cc_obj.unwrap_conn_comp(unw, radius=radius, ramp_type=ramp_type)
+
+
 def run_unwrap_error_bridge(ifgram_file, water_mask_file, ramp_type=None, radius=50, 
                             ccName='connectComponent', dsNameIn='unwrapPhase',
-                            dsNameOut='unwrapPhase_bridging'):
+                            dsNameOut='unwrapPhase_bridging', num_worker=1):
     """Run unwrapping error correction with bridging
     Parameters: ifgram_file     : str, path of ifgram stack file
                 water_mask_file : str, path of water mask file
@@ -183,6 +205,7 @@ def run_unwrap_error_bridge(ifgram_file, water_mask_file, ramp_type=None, radius
                 ccName          : str, dataset name of connected components
                 dsNameIn        : str, dataset name of unwrap phase to be corrected
                 dsNameOut       : str, dataset name of unwrap phase to be saved after correction
+                num_worker      : int, number of processes to correct interferograms in parallel
     Returns:    ifgram_file     : str, path of ifgram stack file
     """
     print('-'*50)
@@ -225,32 +248,30 @@ def run_unwrap_error_bridge(ifgram_file, water_mask_file, ramp_type=None, radius
                                   compression=None)
             print('create /{d} of np.float32 in size of {s}'.format(d=dsNameOut, s=shape_out))
 
-        # correct unwrap error ifgram by ifgram
-        prog_bar = ptime.progressBar(maxValue=num_ifgram)
-        for i in range(num_ifgram):
-            # read unwrapPhase
-            date12 = date12_list[i]
-            unw = np.squeeze(f[dsNameIn][i, :, :])
-
-            # skip dropped interferograms
-            if date12 not in date12_list_kept:
-                ds[i, :, :] = unw
-            else:
+        def read_data():
+            for i in range(num_ifgram):
+                # read unwrapPhase
+                unw = np.squeeze(f[dsNameIn][i, :, :])
+
+                # skip dropped interferograms
+                if date12_list[i] not in date12_list_kept:
+                    yield parallel.TaskResult(unw)
+                    continue
+
                 # read connectComponent
                 cc = np.squeeze(f[ccName][i, :, :])
                 if water_mask is not None:
                     cc[water_mask == 0] = 0
+                yield (unw, cc, atr, radius, ramp_type)
 
-                # bridging
-                cc_obj = connectComponent(conncomp=cc, metadata=atr)
-                cc_obj.label()
-                cc_obj.find_mst_bridge()
-                unw_cor = cc_obj.unwrap_conn_comp(unw, radius=radius, ramp_type=ramp_type)
+        def write_func(i, unw_cor):
+            ds[i, :, :] = unw_cor
 
-                # write to hdf5 file
-                ds[i, :, :] = unw_cor
-            prog_bar.update(i+1, suffix=date12)
-        prog_bar.close()
+        # correct unwrap error ifgram by ifgram
+        parallel.run_pipeline(bridge_unwrap_error, read_data(), write_func,
+                              num_task=num_ifgram,
+                              num_worker=num_worker,
+                              suffix_list=date12_list)
         ds.attrs['MODIFICATION_TIME'] = str(time.time())
         f.close()
         print('close {} file.'.format(ifgram_file))
@@ -299,7 +320,8 @@ def main(iargs=None):
                             ramp_type=inps.ramp,
                             radius=inps.bridgePtsRadius,
                             dsNameIn=inps.datasetNameIn,
-                            dsNameOut=inps.datasetNameOut)
+                            dsNameOut=inps.datasetNameOut,
+                            num_worker=inps.numWorker)
 
     # config parameter
     if os.path.splitext(inps.ifgram_file)[1] in ['.h5', '.he5']:
@@ -24,7 +24,7 @@ except ImportError:
 
 from mintpy.objects import ifgramStack
 from mintpy.objects.conncomp import connectComponent
-from mintpy.utils import ptime, readfile, utils as ut, plot as pp
+from mintpy.utils import ptime, parallel, readfile, utils as ut, plot as pp
 from mintpy.utils.solvers import l1regls
 from mintpy import ifgram_inversion as ifginv
 
@@ -35,11 +35,13 @@ key_prefix = 'mintpy.unwrapError.'
 EXAMPLE = """Example:
   unwrap_error_phase_closure.py  ./inputs/ifgramStack.h5  maskConnComp.h5  -t smallbaselineApp.cfg  --update
   unwrap_error_phase_closure.py  ./inputs/ifgramStack.h5  maskConnComp.h5  --water-mask waterMask.h5 --update
+  unwrap_error_phase_closure.py  ./inputs/ifgramStack.h5  maskConnComp.h5  --num-worker 8
 """
 
 TEMPLATE = """
 ## Unwrapping Error Correction based on Phase Closure (Yunjun et al., 2019)
 mintpy.unwrapError.waterMaskFile   = auto  #[waterMask.h5 / no], auto for no
+mintpy.unwrapError.numWorker       = auto  #[int > 0], auto for 1, number of processes to use
 """
 
 REFERENCE = """Reference:
@@ -72,6 +74,11 @@ def create_parser():
                         help='name of dataset to be written after correction, default: {}_phaseClosure')
 
     parser.add_argument('--water-mask','--wm', dest='waterMaskFile', type=str, help='path of water mask file.')
+    parser.add_argument('--num-sample', dest='numSample', type=int, default=100,
+                        help='number of pixels sampled for each common region (default: %(default)s).')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of processes to solve the integer ambiguity of the sampled pixels\n'
+                             'and to correct interferograms in parallel (default: %(default)s).')
     parser.add_argument('-t', '--template', dest='template_file',
                         help='template file with options for setting.')
     parser.add_argument('--update', dest='update_mode', action='store_true',
@@ -98,6 +105,8 @@ def cmd_line_parse(iargs=None):
     if not inps.datasetNameOut:
         inps.datasetNameOut = '{}_phaseClosure'.format(inps.datasetNameIn)
 
+    inps.numWorker = max(1, min(inps.numWorker, os.cpu_count() or 1))
+
     # discard water mask file is not found
     if inps.waterMaskFile and not os.path.isfile(inps.waterMaskFile):
         inps.waterMaskFile = None
@@ -120,6 +129,8 @@ def read_template2inps(template_file, inps=None):
         if value:
             if key in ['waterMaskFile']:
                 inpsDict[key] = value
+            elif key in ['numWorker']:
+                inpsDict[key] = int(value)
     return inps
 
 
@@ -149,32 +160,39 @@ def run_or_skip(inps):
 
 
 ##########################################################################################
-def get_number_of_nonzero_closure_phase(ifgram_file, dsName='unwrapPhase', step=100):
+def get_number_of_nonzero_closure_phase(ifgram_file, dsName='unwrapPhase', max_memory=4):
     # read ifgramStack file
     stack_obj = ifgramStack(ifgram_file)
     stack_obj.open()
     length, width = stack_obj.length, stack_obj.width
     date12_list = stack_obj.get_date12_list(dropIfgram=True)
     num_ifgram = len(date12_list)
-    C = stack_obj.get_design_matrix4triplet(date12_list)
+    C = stack_obj.get_design_matrix4triplet(date12_list, sparse=True)
     ref_phase = stack_obj.get_reference_phase(unwDatasetName=dsName, dropIfgram=True).reshape(num_ifgram, -1)
 
+    # split into blocks: unw + closure_pha + cint
+    num_triplet = C.shape[0]
+    box_list = ut.split_box2blocks((length, width),
+                                   array_list=[(np.float32, num_ifgram),
+                                               (np.float64, num_triplet),
+                                               (np.float64, num_triplet)],
+                                   max_memory=max_memory,
+                                   chunk_shape=ut.get_chunk_shape(ifgram_file, dsName))
+
     # calculate number of nonzero closure phase
     closure_int = np.zeros((length, width), np.int16)
-    num_loop = int(np.ceil(length / step))
-    prog_bar = ptime.progressBar(maxValue=num_loop)
-    for i in range(num_loop):
-        r0 = i * step
-        r1 = min((r0+step), stack_obj.length)
-        box = (0, r0, stack_obj.width, r1)
+    num_box = len(box_list)
+    prog_bar = ptime.progressBar(maxValue=num_box)
+    for i in range(num_box):
+        box = box_list[i]
         unw = ifginv.read_unwrap_phase(stack_obj, box=box,
                                        ref_phase=ref_phase,
                                        unwDatasetName=dsName,
                                        dropIfgram=True,
                                        print_msg=False).reshape(num_ifgram, -1)
-        closure_pha = np.dot(C, unw)
+        closure_pha = C.dot(unw)
         cint = np.round((closure_pha - ut.wrap(closure_pha)) / (2.*np.pi))
-        closure_int[r0:r1, :] = np.sum(cint != 0, axis=0).reshape(-1, width)
+        closure_int[box[1]:box[3], box[0]:box[2]] = np.sum(cint != 0, axis=0).reshape(box[3]-box[1], -1)
         prog_bar.update(i+1, every=1)
     prog_bar.close()
     return closure_int
@@ -223,14 +241,102 @@ def write_hdf5_file_patch(ifgram_file, data, box=None, dsName='unwrapPhase_phase
     return ifgram_file
 
 
+def read_unwrap_phase4pixels(stack_obj, yx, ref_phase, dsName='unwrapPhase'):
+    """Read the unwrapped phase of the kept interferograms for a list of pixels.
+    Pixels are grouped into bands of rows aligned with the HDF5 chunks, and each band is read once
+    with the list of its unique columns, so that each chunk is decompressed at most once.
+    Parameters: stack_obj : ifgramStack object
+                yx        : 2D np.ndarray of int in size of (num_pixel, 2) for the row/col numbers
+                ref_phase : 1D / 2D np.ndarray in size of (num_ifgram, 1)
+                dsName    : str, dataset name of the unwrapped phase
+    Returns:    pha_data  : 2D np.ndarray of float32 in size of (num_ifgram, num_pixel)
+    """
+    flag = stack_obj.dropIfgram
+    num_ifgram = np.sum(flag)
+    num_pixel = yx.shape[0]
+    pha_data = np.zeros((num_ifgram, num_pixel), np.float32)
+
+    with h5py.File(stack_obj.file, 'r') as f:
+        ds = f[dsName]
+        band_size = ds.chunks[1] if ds.chunks else 1
+        band_idx = yx[:, 0] // band_size
+        for band in np.unique(band_idx):
+            pix_idx = np.where(band_idx == band)[0]
+            ys, xs = yx[pix_idx, 0], yx[pix_idx, 1]
+            y0, y1 = ys.min(), ys.max() + 1
+            x_list = np.unique(xs)
+            data = ds[:, y0:y1, x_list][flag]
+            pha_data[:, pix_idx] = data[:, ys - y0, np.searchsorted(x_list, xs)]
+    pha_data[np.isnan(pha_data)] = 0.
+
+    # reference unwrapPhase
+    ref_phase = np.array(ref_phase, np.float32).reshape(num_ifgram, 1)
+    pha_data -= np.where(pha_data != 0., ref_phase, 0.).astype(np.float32)
+    return pha_data
+
+
+def solve_int_ambiguity_patch(data):
+    """Solve the integer ambiguity for a patch of closure integers with L1-norm regularized least squares.
+    Parameters: data : tuple of (C, closure_int)
+                    C           : 2D scipy.sparse.csr_matrix in size of (num_triplet, num_ifgram)
+                    closure_int : 2D np.ndarray in size of (num_triplet, num_pixel)
+    Returns:    U    : 2D np.ndarray in size of (num_ifgram, num_pixel)
+    """
+    C, closure_int = data
+    U = np.zeros((C.shape[1], closure_int.shape[1]))
+    C = matrix(C.toarray().astype(float))
+    for j in range(closure_int.shape[1]):
+        cint = matrix(closure_int[:, j:j+1].astype(float))
+        U[:, j] = np.round(l1regls(-C, cint, alpha=1e-2, show_progress=0)).flatten()
+    return U
+
+
+def solve_int_ambiguity(C, closure_int, num_worker=1):
+    """Solve the integer ambiguity of interferograms from the integer ambiguity of triplets for all pixels.
+    Pixels with identical closure integers share the same solution, thus are solved only once;
+    and the unique problems are solved in a local process pool if num_worker > 1.
+    Parameters: C           : 2D scipy.sparse.csr_matrix in size of (num_triplet, num_ifgram)
+                closure_int : 2D np.ndarray in size of (num_triplet, num_pixel)
+                num_worker  : int, number of processes to use
+    Returns:    U           : 2D np.ndarray in size of (num_ifgram, num_pixel)
+    """
+    num_ifgram = C.shape[1]
+    num_pixel = closure_int.shape[1]
+    if num_pixel == 0:
+        return np.zeros((num_ifgram, 0))
+
+    cint_uniq, idx_inv = np.unique(closure_int.astype(np.int32), axis=1, return_inverse=True)
+    idx_inv = idx_inv.flatten()
+    num_uniq = cint_uniq.shape[1]
+    print('number of unique closure integer vectors: {} out of {} pixels'.format(num_uniq, num_pixel))
+
+    # zero closure integers --> zero integer ambiguity
+    U_uniq = np.zeros((num_ifgram, num_uniq))
+    idx_solve = np.where(np.any(cint_uniq != 0, axis=0))[0]
+    num_solve = idx_solve.size
+
+    # split into patches, a few per worker to balance the load
+    num_worker = max(1, min(num_worker, num_solve))
+    num_patch = min(num_solve, num_worker * 4) if num_worker > 1 else num_solve
+    idx_patches = [i for i in np.array_split(idx_solve, max(num_patch, 1)) if i.size > 0]
+    data_list = [(C, cint_uniq[:, i]) for i in idx_patches]
+
+    def write_func(i, Ui):
+        U_uniq[:, idx_patches[i]] = Ui
+
+    parallel.run_pipeline(solve_int_ambiguity_patch, data_list, write_func, num_worker=num_worker)
+    return U_uniq[:, idx_inv]
+
+
 def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=None, num_sample=100,
-                                    dsNameIn='unwrapPhase'):
+                                    dsNameIn='unwrapPhase', num_worker=1):
     """Solve the phase unwrapping integer ambiguity for the common regions among all interferograms
     Parameters: ifgram_file     : str, path of interferogram stack file
                 cc_mask_file    : str, path of common connected components file
                 water_mask_file : str, path of water mask file
                 num_sample      : int, number of pixel sampled for each region
                 dsNameIn        : str, dataset name of the unwrap phase to be corrected
+                num_worker      : int, number of processes to solve the integer ambiguity
     Returns:    common_regions  : list of skimage.measure._regionprops._RegionProperties object
                     modified by adding two more variables:
                     sample_coords : 2D np.ndarray in size of (num_sample, 2) in int64 format
@@ -243,7 +349,7 @@ def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=N
     stack_obj.open()
     date12_list = stack_obj.get_date12_list(dropIfgram=True)
     num_ifgram = len(date12_list)
-    C = matrix(ifgramStack.get_design_matrix4triplet(date12_list).astype(float))
+    C = ifgramStack.get_design_matrix4triplet(date12_list, sparse=True)
     ref_phase = stack_obj.get_reference_phase(unwDatasetName=dsNameIn, dropIfgram=True).reshape(num_ifgram, -1)
 
     # prepare common label
@@ -258,42 +364,41 @@ def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=N
     common_regions = measure.regionprops(label_img)
     print('number of common regions:', num_label)
 
-    # add sample_coords / int_ambiguity
+    # add sample_coords
     print('number of samples per region:', num_sample)
+    ref_label = label_img[stack_obj.refY, stack_obj.refX]
+    yx_list = []
+    for common_reg in common_regions:
+        idx = sorted(np.random.choice(common_reg.area, num_sample, replace=False))
+        common_reg.sample_coords = common_reg.coords[idx, :].astype(int)
+        if common_reg.label == ref_label:
+            print('skip calculation for the reference region')
+        else:
+            yx_list.append(common_reg.sample_coords)
+
+    # read unwrap phase of all sample pixels at once
+    yx = np.vstack(yx_list) if yx_list else np.zeros((0, 2), int)
+    print('reading {} of {} sample pixels * {} interferograms ...'.format(dsNameIn, yx.shape[0], num_ifgram))
+    unw = read_unwrap_phase4pixels(stack_obj, yx, ref_phase=ref_phase, dsName=dsNameIn)
+
+    # calculate closure_int
+    closure_pha = C.dot(unw)
+    closure_int = np.round((closure_pha - ut.wrap(closure_pha)) / (2.*np.pi))
+
+    # solve for U
     print('solving the phase-unwrapping integer ambiguity for {}'.format(dsNameIn))
     print('\tbased on the closure phase of interferograms triplets (Yunjun et al., 2019)')
     print('\tusing the L1-norm regularzed least squares approximation (LASSO) ...')
-    for i in range(num_label):
-        common_reg = common_regions[i]
-        # sample_coords
-        idx = sorted(np.random.choice(common_reg.area, num_sample, replace=False))
-        common_reg.sample_coords = common_reg.coords[idx, :].astype(int)
+    U_all = solve_int_ambiguity(C, closure_int, num_worker=num_worker)
 
-        # solve for int_ambiguity
-        U = np.zeros((num_ifgram, num_sample))
-        if common_reg.label == label_img[stack_obj.refY, stack_obj.refX]:
-            print('{}/{} skip calculation for the reference region'.format(i+1, num_label))
+    # add int_ambiguity
+    i0 = 0
+    for common_reg in common_regions:
+        if common_reg.label == ref_label:
+            U = np.zeros((num_ifgram, num_sample))
         else:
-            prog_bar = ptime.progressBar(maxValue=num_sample, prefix='{}/{}'.format(i+1, num_label))
-            for j in range(num_sample):
-                # read unwrap phase
-                y, x = common_reg.sample_coords[j, :]
-                unw = ifginv.read_unwrap_phase(stack_obj,
-                                               box=(x, y, x+1, y+1),
-                                               ref_phase=ref_phase,
-                                               unwDatasetName=dsNameIn,
-                                               dropIfgram=True,
-                                               print_msg=False).reshape(num_ifgram, -1)
-
-                # calculate closure_int
-                closure_pha = np.dot(C, unw)
-                closure_int = matrix(np.round((closure_pha - ut.wrap(closure_pha)) / (2.*np.pi)))
-
-                # solve for U
-                U[:,j] = np.round(l1regls(-C, closure_int, alpha=1e-2, show_progress=0)).flatten()
-                prog_bar.update(j+1, every=5)
-            prog_bar.close()
-        # add int_ambiguity
+            U = U_all[:, i0:i0+num_sample]
+            i0 += num_sample
         common_reg.int_ambiguity = np.median(U, axis=1)
         common_reg.date12_list = date12_list
 
@@ -315,8 +420,35 @@ def get_common_region_int_ambiguity(ifgram_file, cc_mask_file, water_mask_file=N
     return common_regions
 
 
+def correct_unwrap_error_phase_closure(data):
+    """Correct the unwrapping error of one interferogram with the integer ambiguity of the common regions.
+    Parameters: data : tuple of (unw_cor, cc, metadata, region_list)
+                    unw_cor     : 2D np.ndarray, unwrapped phase referenced to the reference pixel
+                    cc          : 2D np.ndarray, connected components, with water body masked out
+                    metadata    : dict, attributes of the interferogram
+                    region_list : list of tuple (y, x, U), with y/x for the sample pixels and
+                                  U for the integer ambiguity of each common region
+    Returns:    unw_cor : 2D np.ndarray, corrected unwrapped phase
+    """
+    unw_cor, cc, metadata, region_list = data
+    cc_obj = connectComponent(conncomp=cc, metadata=metadata)
+    cc_obj.label()
+    local_regions = measure.regionprops(cc_obj.labelImg)
+
+    # matching regions and correct unwrap error
+    for local_reg in local_regions:
+        local_mask = cc_obj.labelImg == local_reg.label
+        U = 0
+        for y, x, Ui in region_list:
+            if all(local_mask[y, x]):
+                U = Ui
+                break
+        unw_cor[local_mask] += 2. * np.pi * U
+    return unw_cor
+
+
 def run_unwrap_error_phase_closure(ifgram_file, common_regions, water_mask_file=None, ccName='connectComponent',
-                                   dsNameIn='unwrapPhase', dsNameOut='unwrapPhase_phaseClosure'):
+                                   dsNameIn='unwrapPhase', dsNameOut='unwrapPhase_phaseClosure', num_worker=1):
     print('-'*50)
     print('correct unwrapping error in {} with phase closure ...'.format(ifgram_file))
     stack_obj = ifgramStack(ifgram_file)
@@ -350,42 +482,36 @@ def run_unwrap_error_phase_closure(ifgram_file, common_regions, water_mask_file=
                               compression=None)
         print('create /{d} of np.float32 in size of {s}'.format(d=dsNameOut, s=shape_out))
 
-    # correct unwrap error ifgram by ifgram
-    prog_bar = ptime.progressBar(maxValue=num_ifgram)
-    for i in range(num_ifgram):
-        date12 = date12_list[i]
+    def read_data():
+        for i in range(num_ifgram):
+            # read unwrap phase to be updated
+            unw_cor = np.squeeze(f[dsNameIn][i, :, :]).astype(np.float32)
+            unw_cor -= unw_cor[ref_y, ref_x]
 
-        # read unwrap phase to be updated
-        unw_cor = np.squeeze(f[dsNameIn][i, :, :]).astype(np.float32)
-        unw_cor -= unw_cor[ref_y, ref_x]
+            # update kept interferograms only
+            if not stack_obj.dropIfgram[i]:
+                yield parallel.TaskResult(unw_cor)
+                continue
 
-        # update kept interferograms only
-        if stack_obj.dropIfgram[i]:
             # get local region info from connectComponent
             cc = np.squeeze(f[ccName][i, :, :])
             if water_mask is not None:
                 cc[water_mask == 0] = 0
-            cc_obj = connectComponent(conncomp=cc, metadata=stack_obj.metadata)
-            cc_obj.label()
-            local_regions = measure.regionprops(cc_obj.labelImg)
-
-            # matching regions and correct unwrap error
-            idx_common = common_regions[0].date12_list.index(date12)
-            for local_reg in local_regions:
-                local_mask = cc_obj.labelImg == local_reg.label
-                U = 0
-                for common_reg in common_regions:
-                    y = common_reg.sample_coords[:,0]
-                    x = common_reg.sample_coords[:,1]
-                    if all(local_mask[y, x]):
-                        U = common_reg.int_ambiguity[idx_common]
-                        break
-                unw_cor[local_mask] += 2. * np.pi * U
-
-        # write to hdf5 file
+
+            # sample pixels and integer ambiguity of common regions for this interferogram
+            idx_common = common_regions[0].date12_list.index(date12_list[i])
+            region_list = [(reg.sample_coords[:,0], reg.sample_coords[:,1], reg.int_ambiguity[idx_common])
+                           for reg in common_regions]
+            yield (unw_cor, cc, stack_obj.metadata, region_list)
+
+    def write_func(i, unw_cor):
         ds[i, :, :] = unw_cor
-        prog_bar.update(i+1, suffix=date12)
-    prog_bar.close()
+
+    # correct unwrap error ifgram by ifgram
+    parallel.run_pipeline(correct_unwrap_error_phase_closure, read_data(), write_func,
+                          num_task=num_ifgram,
+                          num_worker=num_worker,
+                          suffix_list=date12_list)
     ds.attrs['MODIFICATION_TIME'] = str(time.time())
     f.close()
     print('close {} file.'.format(ifgram_file))
@@ -404,13 +530,15 @@ def main(iargs=None):
     common_regions = get_common_region_int_ambiguity(ifgram_file=inps.ifgram_file,
                                                      cc_mask_file=inps.cc_mask_file,
                                                      water_mask_file=inps.waterMaskFile,
-                                                     num_sample=100,
-                                                     dsNameIn=inps.datasetNameIn)
+                                                     num_sample=inps.numSample,
+                                                     dsNameIn=inps.datasetNameIn,
+                                                     num_worker=inps.numWorker)
 
     run_unwrap_error_phase_closure(inps.ifgram_file, common_regions,
                                    water_mask_file=inps.waterMaskFile,
                                    dsNameIn=inps.datasetNameIn,
-                                   dsNameOut=inps.datasetNameOut)
+                                   dsNameOut=inps.datasetNameOut,
+                                   num_worker=inps.numWorker)
 
     m, s = divmod(time.time()-start_time, 60)
     print('\ntime used: {:02.0f} mins {:02.1f} secs\nDone.'.format(m, s))
@@ -0,0 +1,176 @@
+############################################################
+# Program is part of MintPy                                #
+# Copyright (c) 2013, Zhang Yunjun, Heresh Fattahi         #
+############################################################
+# Recommend import:
+#   from mintpy.utils import parallel
+
+
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from mintpy.utils import ptime
+
+
+class TaskResult:
+    """Result of a task known while reading its input, e.g. a dropped interferogram.
+    It is passed to the writer as it is, without being sent to the worker processes.
+    """
+    def __init__(self, value):
+        self.value = value
+
+
+# function and its fixed input of the worker processes, set by _init_worker()
+_worker_func = None
+_worker_inps = None
+
+
+def _init_worker(func, worker_inps):
+    """Pass the function and its fixed input once to each worker process of the local pool."""
+    global _worker_func, _worker_inps
+    _worker_func = func
+    _worker_inps = worker_inps
+
+
+def _run_task(data):
+    if _worker_inps is None:
+        return _worker_func(data)
+    return _worker_func(_worker_inps, data)
+
+
+def run_pipeline(func, data_iter, write_func=None, num_task=None, num_worker=1, worker_inps=None,
+                 max_queue_size=None, suffix_list=None, print_msg=True):
+    """Run independent tasks in a pipeline:
+    one reader thread preparing the input of the next tasks from data_iter,
+    a local pool of num_worker processes running the tasks, and
+    one writer thread passing the results to write_func as they are finished,
+    so that the main process is the only writer of the output file.
+
+    The pool uses the spawn start method and is started before the reader and writer threads,
+    so that no thread, lock or open file handle of the main process is inherited by the workers.
+
+    Parameters: func           : function, picklable, to run one task as out = func(data),
+                                 or as out = func(worker_inps, data) if worker_inps is not None
+                data_iter      : iterable of the input data of each task, read lazily in order.
+                                 An item of TaskResult is passed to write_func directly.
+                write_func     : function, to write the result of the i-th task as write_func(i, out)
+                num_task       : int, number of tasks, for the progress bar if data_iter has no len()
+                num_worker     : int, number of processes to use, run serially if 1
+                worker_inps    : object, picklable, fixed input of func, passed once per worker process
+                max_queue_size : int, max number of tasks in flight and results waiting to be written,
+                                 to limit the memory usage, default: 2 * num_worker
+                suffix_list    : list of str, suffix of the progress bar for each task
+                print_msg      : bool, print the progress bar
+    Examples:   def write_func(i, out):
+                    ds[i, :, :] = out
+                parallel.run_pipeline(correct_ifgram, data_iter, write_func, num_worker=4)
+    """
+    if num_task is None and hasattr(data_iter, '__len__'):
+        num_task = len(data_iter)
+    prog_bar = ptime.progressBar(maxValue=num_task) if print_msg and num_task else None
+
+    def write(i, num_done, out):
+        if write_func is not None:
+            write_func(i, out)
+        if prog_bar is not None:
+            prog_bar.update(num_done, suffix=suffix_list[i] if suffix_list else str(i))
+
+    # serial loop
+    if num_worker <= 1:
+        for i, data in enumerate(data_iter):
+            if isinstance(data, TaskResult):
+                out = data.value
+            elif worker_inps is None:
+                out = func(data)
+            else:
+                out = func(worker_inps, data)
+            write(i, i+1, out)
+        if prog_bar is not None:
+            prog_bar.close()
+        return
+
+    # parallel pipeline with bounded queues to limit the memory usage
+    if print_msg:
+        print('run {} tasks with a local pool of {} processes'.format(num_task or 'all', num_worker))
+    max_queue_size = max_queue_size or num_worker * 2
+    in_queue = queue.Queue(maxsize=max_queue_size)
+    out_queue = queue.Queue(maxsize=max_queue_size)
+    errors = []
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for i, data in enumerate(data_iter):
+                if stop.is_set():
+                    break
+                in_queue.put((i, data))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            in_queue.put(None)
+
+    def writer():
+        num_done = 0
+        while True:
+            item = out_queue.get()
+            if item is None:
+                break
+            if stop.is_set() and errors:
+                continue
+            try:
+                num_done += 1
+                write(item[0], num_done, item[1])
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+    executor = ProcessPoolExecutor(max_workers=num_worker,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(func, worker_inps))
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+    try:
+        with executor:
+            futures = {}
+            reading = True
+            while reading or futures:
+                # submit new tasks as long as the pool has room
+                while reading and len(futures) < max_queue_size and not stop.is_set():
+                    item = in_queue.get()
+                    if item is None:
+                        reading = False
+                        break
+                    i, data = item
+                    if isinstance(data, TaskResult):
+                        out_queue.put((i, data.value))
+                    else:
+                        futures[executor.submit(_run_task, data)] = i
+                if stop.is_set():
+                    for future in futures:
+                        future.cancel()
+                    break
+
+                # pass the finished ones to the writer
+                if futures:
+                    done = wait(futures, return_when=FIRST_COMPLETED)[0]
+                    for future in done:
+                        out_queue.put((futures.pop(future), future.result()))
+    finally:
+        stop.set()
+        # drain the input queue to release a blocked reader
+        while reader_thread.is_alive():
+            try:
+                in_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        out_queue.put(None)
+        writer_thread.join()
+    if prog_bar is not None:
+        prog_bar.close()
+    if errors:
+        raise errors[0]
+    return
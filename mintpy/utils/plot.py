@@ -108,6 +108,12 @@ def add_data_disp_argument(parser):
                       help='do not multilook, for high quality display. \n'
                            'If multilook and multilook_num=1, multilook_num will be estimated automatically.\n'
                            'Useful when displaying big datasets.')
+    data.add_argument('--ovr', '--overview', dest='overview', default='no', choices={'no', 'yes', 'build'},
+                      help='use the multi-resolution overviews of HDF5 file for display (default: %(default)s).\n'
+                           'no    - always read data in full resolution\n'
+                           'yes   - use the overviews if exist and up to date\n'
+                           'build - build / update the overviews as hidden files next to the data file, then use them\n'
+                           'With overviews, the color limits and the reference date are also from the overviews.')
     data.add_argument('--alpha', dest='transparency', type=float,
                       help='Data transparency. \n'
                            '0.0 - fully transparent, 1.0 - no transparency.')
@@ -1265,6 +1271,9 @@ def plot_gps(ax, SNWE, inps, metadata=dict(), print_msg=True):
             geom_obj = metadata
             print('use incidenceAngle/azimuthAngle calculated from metadata')
 
+        # read the reference site once for all sites
+        ref_obj = GPS(inps.ref_gps_site) if inps.ref_gps_site else None
+
         gps_data_list = []
         for i in range(num_site):
             if print_msg:
@@ -1276,13 +1285,13 @@ def plot_gps(ax, SNWE, inps, metadata=dict(), print_msg=True):
                 gps_data = obj.get_gps_los_velocity(geom_obj,
                                                     start_date=inps.gps_start_date,
                                                     end_date=inps.gps_end_date,
-                                                    ref_site=inps.ref_gps_site,
+                                                    ref_site=ref_obj,
                                                     gps_comp=inps.gps_component) * unit_fac
             elif k == 'timeseries':
                 dis = obj.read_gps_los_displacement(geom_obj,
                                                     start_date=inps.gps_start_date,
                                                     end_date=inps.gps_end_date,
-                                                    ref_site=inps.ref_gps_site,
+                                                    ref_site=ref_obj,
                                                     gps_comp=inps.gps_component)[1] * unit_fac
                 gps_data = dis[-1] - dis[0]
 
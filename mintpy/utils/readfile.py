@@ -9,8 +9,12 @@
 
 import os
 import re
+import time
 import warnings
+import threading
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from contextlib import contextmanager
 
 import h5py
 import json
@@ -164,6 +168,112 @@ ENVI_BYTE_ORDER = {
 
 
 
+######################################## Cache ##########################################
+## Process-wide cache of the parsed metadata and slice list, and optionally the opened file handle
+## (see keep_file_open()), of HDF5 files, thus repeated reads of the same file, e.g. in small boxes,
+## do the array I/O only. Each entry is validated against the modification time and size of the file,
+## evicted in least recently used order, and invalidated by the writers in mintpy.utils.writefile.
+MAX_CACHE_FILE_NUM = 64     # max number of files in the cache
+MIN_CACHE_FILE_AGE = 2.     # min time in seconds since the last modification of a file to cache it,
+                            # as a file modified twice within the timestamp resolution looks unchanged
+_cache = OrderedDict()      # absolute path --> dict of stamp / atr / slice_list / handle
+_cache_lock = threading.RLock()
+_keep_file_open = 0
+
+
+def _get_cache_entry(fname):
+    """Get the valid cache entry of the input HDF5 file, create a new one if not exist.
+    Parameters: fname : str, path of the HDF5 file
+    Returns:    entry : dict, or None if the file does not exist or is just modified
+    """
+    fname = os.path.abspath(fname)
+    try:
+        fstat = os.stat(fname)
+    except OSError:
+        return None
+    stamp = (fstat.st_mtime_ns, fstat.st_size)
+
+    with _cache_lock:
+        entry = _cache.get(fname, None)
+        if entry is not None:
+            if entry['stamp'] == stamp:
+                _cache.move_to_end(fname)
+                return entry
+            _drop_cache_entry(fname)
+
+        if time.time() - fstat.st_mtime < MIN_CACHE_FILE_AGE:
+            return None
+
+        entry = {'stamp'      : stamp,
+                 'atr'        : {},
+                 'slice_list' : None,
+                 'handle'     : None}
+        _cache[fname] = entry
+        while len(_cache) > MAX_CACHE_FILE_NUM:
+            _drop_cache_entry(next(iter(_cache)))
+    return entry
+
+
+def _drop_cache_entry(fname):
+    entry = _cache.pop(fname, None)
+    if entry is not None and entry['handle'] is not None:
+        entry['handle'].close()
+
+
+def clear_cache(fname=None):
+    """Invalidate the cached metadata and close the cached file handle, before writing to the file.
+    Parameters: fname : str, path of the file, clear the cache of all files if None
+    """
+    with _cache_lock:
+        if fname is None:
+            for key in list(_cache.keys()):
+                _drop_cache_entry(key)
+        else:
+            _drop_cache_entry(os.path.abspath(fname))
+    return
+
+
+@contextmanager
+def keep_file_open():
+    """Keep the HDF5 files read by read() open within the context, and close them at its exit.
+    HDF5 does not allow to open a file for writing while it is open for reading in the same process,
+    thus call clear_cache(fname) before writing to a file within the context, except for the writers
+    in mintpy.utils.writefile, which clear the cache themselves.
+    Example:
+        with readfile.keep_file_open():
+            for box in box_list:
+                data = readfile.read('timeseries.h5', box=box)[0]
+    """
+    global _keep_file_open
+    with _cache_lock:
+        _keep_file_open += 1
+    try:
+        yield
+    finally:
+        with _cache_lock:
+            _keep_file_open -= 1
+            if _keep_file_open == 0:
+                for entry in _cache.values():
+                    if entry['handle'] is not None:
+                        entry['handle'].close()
+                        entry['handle'] = None
+
+
+@contextmanager
+def _open_hdf5_file(fname):
+    """Open HDF5 file in read mode, use the cached file handle within keep_file_open()."""
+    entry = _get_cache_entry(fname) if _keep_file_open else None
+    if entry is None:
+        with h5py.File(fname, 'r') as f:
+            yield f
+    else:
+        with _cache_lock:
+            if entry['handle'] is None:
+                entry['handle'] = h5py.File(fname, 'r')
+            f = entry['handle']
+        yield f
+
+
 #########################################################################
 def read(fname, box=None, datasetName=None, print_msg=True):
     """Read one dataset and its attributes from input file.
@@ -248,7 +358,7 @@ def read_hdf5_file(fname, datasetName=None, box=None):
     inputDateList = [i.replace(dsFamily,'').replace('-','') for i in datasetName]
 
     # read hdf5
-    with h5py.File(fname, 'r') as f:
+    with _open_hdf5_file(fname) as f:
         # get dataset object
         dsNames = [i for i in [datasetName[0], dsFamily] if i in f.keys()]
         dsNamesOld = [i for i in slice_list if '/{}'.format(datasetName[0]) in i] # support for old mintpy files
@@ -449,6 +559,12 @@ def get_slice_list(fname):
     """Get list of 2D slice existed in file (for display)"""
     fbase, fext = os.path.splitext(os.path.basename(fname))
     fext = fext.lower()
+
+    # cached slice list
+    entry = _get_cache_entry(fname) if fext in ['.h5', '.he5'] else None
+    if entry is not None and entry['slice_list'] is not None:
+        return list(entry['slice_list'])
+
     atr = read_attribute(fname)
     k = atr['FILE_TYPE']
 
@@ -512,6 +628,9 @@ def get_slice_list(fname):
             slice_list = ['incidenceAngle', 'azimuthAngle']
         else:
             slice_list = ['band{}'.format(i) for i in range(1,num_band+1)]
+
+    if entry is not None:
+        entry['slice_list'] = list(slice_list)
     return slice_list
 
 
@@ -577,6 +696,12 @@ def read_attribute(fname, datasetName=None, standardize=True, metafile_ext=None)
         msg += 'current directory: '+os.getcwd()
         raise Exception(msg)
 
+    # cached metadata, copied as it is often modified by the caller
+    entry = _get_cache_entry(fname) if fext in ['.h5', '.he5'] else None
+    entry_key = (datasetName, standardize)
+    if entry is not None and entry_key in entry['atr'].keys():
+        return dict(entry['atr'][entry_key])
+
     # HDF5 files
     if fext in ['.h5', '.he5']:
         f = h5py.File(fname, 'r')
@@ -755,6 +880,9 @@ def read_attribute(fname, datasetName=None, standardize=True, metafile_ext=None)
 
     if standardize:
         atr = standardize_metadata(atr)
+
+    if entry is not None:
+        entry['atr'][entry_key] = dict(atr)
     return atr
 
 
@@ -1042,7 +1170,7 @@ def attribute_gamma2roipac(par_dict_in):
 #########################################################################
 def read_binary(fname, shape, box=None, data_type='float32', byte_order='l',
                 num_band=1, band_interleave='BIL', band=1, cpx_band='phase'):
-    """Read binary file using np.fromfile
+    """Read binary file using np.memmap, with only the box of the band of interest read from disk
     Parameters: fname : str, path/name of data file to read
                 shape : tuple of 2 int in (length, width)
                 box   : tuple of 4 int in (x0, y0, x1, y1)
@@ -1085,35 +1213,25 @@ def read_binary(fname, shape, box=None, data_type='float32', byte_order='l',
             digit = int(int(digit) / 8)
         data_type = '>{}{}'.format(letter, digit)
 
-    # read data
-    #data = np.fromfile(fname,
-    #                   dtype=data_type,
-    #                   count=box[3]*width).reshape(-1, width)
-    #data = data[box[1]:box[3],
-    #            box[0]:box[2]]
+    # memory map the file in the shape of its band interleaving scheme, and
+    # read only the rows/columns within box of the band of interest.
+    # copy-on-write mode to allow in-place modification of the output, without touching the file.
     band_interleave = band_interleave.upper()
     if band_interleave == 'BIL':
-        data = np.fromfile(fname,
-                           dtype=data_type,
-                           count=box[3]*width*num_band).reshape(-1, width*num_band)
-        data = data[box[1]:box[3],
-                    width*(band-1)+box[0]:width*(band-1)+box[2]]
+        data = np.memmap(fname, dtype=data_type, mode='c', shape=(length, num_band, width))
+        data = data[box[1]:box[3], band-1, box[0]:box[2]]
 
     elif band_interleave == 'BIP':
-        data = np.fromfile(fname,
-                           dtype=data_type,
-                           count=box[3]*width*num_band).reshape(-1, width*num_band)
-        data = data[box[1]:box[3],
-                    np.arange(box[0], box[2])*num_band+band-1]
+        data = np.memmap(fname, dtype=data_type, mode='c', shape=(length, width, num_band))
+        data = data[box[1]:box[3], box[0]:box[2], band-1]
 
     elif band_interleave == 'BSQ':
-        data = np.fromfile(fname,
-                           dtype=data_type,
-                           count=(box[3]+length*(band-1))*width).reshape(-1, width)
-        data = data[length*(band-1)+box[1]:length*(band-1)+box[3],
-                    box[0]:box[2]]
+        data = np.memmap(fname, dtype=data_type, mode='c', shape=(num_band, length, width))
+        data = data[band-1, box[1]:box[3], box[0]:box[2]]
     else:
         raise ValueError('unrecognized band interleaving:', band_interleave)
+    # return as np.ndarray view of the mapped file
+    data = np.asarray(data)
 
     # adjust output band for complex data
     if data_type.replace('>', '').startswith('c'):
@@ -11,6 +11,7 @@
 import os
 import time
 import glob
+import hashlib
 import h5py
 import numpy as np
 from mintpy.objects import deramp, ifgramStack, timeseries, geometryDatasetNames
@@ -501,6 +502,7 @@ def add_attribute(File, atr_new=dict(), print_msg=False):
         return File
 
     # Update attributes
+    readfile.clear_cache(File)
     f = h5py.File(File, 'r+')
     for key, value in iter(atr_new.items()):
         # delete the item is new value is None
@@ -561,6 +563,141 @@ def check_file_size(fname_list, mode_width=None, mode_length=None):
 
 
 
+#################################### Block Processing #####################################
+def get_memory_size(memory):
+    """Convert memory size into number of bytes.
+    Parameters: memory   : str / float, memory size with unit, e.g. 8GB, 512MB, 1.5G
+                           or number without unit in GB, e.g. 4, 0.5
+    Returns:    num_byte : int, number of bytes
+    Example:    num_byte = get_memory_size('8GB')
+                num_byte = get_memory_size(4)
+    """
+    units = {'K': 1024**1,
+             'M': 1024**2,
+             'G': 1024**3,
+             'T': 1024**4}
+    mem_str = str(memory).strip().upper().rstrip('B')
+    if mem_str and mem_str[-1] in units.keys():
+        num_byte = float(mem_str[:-1]) * units[mem_str[-1]]
+    else:
+        num_byte = float(mem_str) * units['G']
+    if num_byte <= 0:
+        raise ValueError('input memory size {} is NOT positive!'.format(memory))
+    return int(num_byte)
+
+
+def get_chunk_shape(fname, datasetName=None):
+    """Get the chunk shape of a dataset in HDF5 file.
+    Parameters: fname       : str, path of HDF5 file
+                datasetName : str, dataset name, use the 1st 2D/3D dataset if not specified
+    Returns:    chunk_shape : tuple of int, or None for contiguous dataset / non-HDF5 file
+    """
+    if os.path.splitext(fname)[1] not in ['.h5', '.he5']:
+        return None
+
+    with h5py.File(fname, 'r') as f:
+        if not datasetName:
+            datasetName = [i for i in f.keys()
+                           if isinstance(f[i], h5py.Dataset) and f[i].ndim >= 2][0]
+        chunk_shape = f[datasetName.split('-')[0]].chunks
+    return chunk_shape
+
+
+def _get_num_byte_per_pixel(array_list):
+    """Get number of bytes per pixel for a list of (dtype, depth) arrays."""
+    return sum(np.dtype(dtype).itemsize * max(int(depth), 1) for dtype, depth in array_list)
+
+
+def split_box2blocks(shape, array_list, max_memory=4, chunk_shape=None, box=None, print_msg=True):
+    """Split the 2D image into blocks/boxes that fit into the memory budget of one processing step.
+
+    The number of bytes per pixel is summed up over all the arrays allocated per block, including
+    the input and output datasets and the temporary matrices, given as a list of (dtype, depth).
+    The image is split in rows first, then in columns if one row of chunks does not fit.
+    The block size is rounded to multiple of the chunk size, to avoid reading the same
+    HDF5 chunk more than once.
+
+    Parameters: shape       : tuple of 2 int, (length, width) of the whole image
+                array_list  : list of (dtype, depth) tuple, for every array allocated per block, e.g.
+                              [(np.float32, num_ifgram), (np.float64, num_ifgram), (np.float32, num_date)]
+                max_memory  : str / float, memory budget, e.g. 8GB, or number in GB
+                chunk_shape : tuple of int, HDF5 chunk shape of the main input/output dataset
+                box         : tuple of 4 int in (x0, y0, x1, y1), area of interest, the whole image by default
+                print_msg   : bool
+    Returns:    box_list    : list of tuple of 4 int in (x0, y0, x1, y1)
+    Example:    box_list = split_box2blocks((length, width),
+                                            array_list=[(np.float32, num_ifgram), (np.float32, num_date)],
+                                            max_memory='8GB',
+                                            chunk_shape=ut.get_chunk_shape('inputs/ifgramStack.h5'))
+    """
+    length, width = shape[-2:]
+    if box is None:
+        box = (0, 0, width, length)
+    num_byte_per_pixel = _get_num_byte_per_pixel(array_list)
+    max_num_pixel = max(1, int(get_memory_size(max_memory) / num_byte_per_pixel))
+    chunk_y, chunk_x = (chunk_shape[-2:] if chunk_shape else (1, 1))
+    box_len = box[3] - box[1]
+    box_wid = box[2] - box[0]
+
+    # number of rows / columns per block
+    num_row = int(max_num_pixel / box_wid)
+    if num_row >= chunk_y:
+        # split in rows only
+        num_row = min(box_len, int(num_row / chunk_y) * chunk_y)
+        num_col = box_wid
+    else:
+        # split in rows and columns
+        num_row = min(box_len, chunk_y)
+        num_col = int(max_num_pixel / num_row)
+        if num_col >= chunk_x:
+            num_col = int(num_col / chunk_x) * chunk_x
+        num_col = max(1, min(box_wid, num_col))
+
+    # blocks aligned to the chunk boundaries of the whole image
+    def split_range(start, end, step):
+        first = start + step
+        if chunk_shape and step < end - start:
+            first = (start // step + 1) * step
+        return [start] + list(range(first, end, step)) + [end]
+
+    ys = split_range(box[1], box[3], num_row)
+    xs = split_range(box[0], box[2], num_col)
+    box_list = [(xs[j], ys[i], xs[j+1], ys[i+1])
+                for i in range(len(ys)-1)
+                for j in range(len(xs)-1)]
+
+    if print_msg:
+        print('maximum memory size: {:.2f} GB with {} bytes per pixel'.format(
+            get_memory_size(max_memory) / 1024**3, num_byte_per_pixel))
+        if len(box_list) > 1:
+            print('split {} lines and {} columns into {} blocks for processing'.format(
+                box_len, box_wid, len(box_list)))
+            print('    with each block up to {} lines and {} columns'.format(num_row, num_col))
+    return box_list
+
+
+def split_slice2blocks(num_slice, array_list, max_memory=4, chunk_depth=1, print_msg=True):
+    """Split the slices of a 3D dataset into blocks that fit into the memory budget,
+    for steps operating on whole 2D slices, e.g. spatial filtering.
+    Parameters: num_slice   : int, number of 2D slices
+                array_list  : list of (dtype, num_pixel) tuple, for every array allocated per slice
+                max_memory  : str / float, memory budget, e.g. 8GB, or number in GB
+                chunk_depth : int, chunk size in the slice dimension of the HDF5 dataset
+    Returns:    slice_list  : list of tuple of 2 int in (z0, z1)
+    """
+    num_byte_per_slice = _get_num_byte_per_pixel(array_list)
+    step = max(1, int(get_memory_size(max_memory) / num_byte_per_slice))
+    if chunk_depth and step >= chunk_depth:
+        step = int(step / chunk_depth) * chunk_depth
+    step = min(step, num_slice)
+    slice_list = [(i, min(i+step, num_slice)) for i in range(0, num_slice, step)]
+
+    if print_msg and len(slice_list) > 1:
+        print('split {} slices into {} blocks with each block up to {} slices'.format(
+            num_slice, len(slice_list), step))
+    return slice_list
+
+
 #################################### Interaction ##########################################
 def is_file_exist(file_list, abspath=True):
     """Check if any file in the file list 1) exists and 2) readable
@@ -635,6 +772,92 @@ def run_or_skip(out_file, in_file=None, check_readable=True, print_msg=True):
     return 'skip'
 
 
+def get_file_hash(fname, datasetNames=None, hash_cache=None, keep_data_hash=False, max_memory=0.0625):
+    """Get the hash of the file content, independent of its path and modification time.
+    For HDF5 file, it hashes the root level attributes, and for each dataset: its name, shape, data type,
+    attributes (except MODIFICATION_TIME) and data, read block by block.
+    For the other files, it hashes the file content.
+
+    Parameters: fname          : str, path of the file
+                datasetNames   : list of str, datasets of the HDF5 file to hash, all datasets if None
+                hash_cache     : dict, hash of the datasets / files from previous calls, updated in place.
+                                 The hash is re-used if the stamp of the file is the same, i.e. its size,
+                                 modification time and the digest of its first and last blocks.
+                keep_data_hash : bool, re-use the cached hash of the data of HDF5 datasets even if the file
+                                 is modified, e.g. for the datasets not written by the last step,
+                                 while their attributes, shape and data type are still hashed.
+                max_memory     : float, max memory in GB to read data per block
+    Returns:    hash_str       : str, hexadecimal digest of the hash
+    Example:    hash_str = ut.get_file_hash('timeseries.h5')
+                hash_str = ut.get_file_hash('inputs/ifgramStack.h5', datasetNames=['date', 'unwrapPhase'])
+    """
+    def get_data_hash(dset):
+        h = hashlib.md5()
+        if dset.ndim == 0 or dset.size == 0:
+            h.update(np.asarray(dset[()]).tobytes())
+        else:
+            step = int(max_memory * 1024**3 / max(1, dset.dtype.itemsize * int(np.prod(dset.shape[1:]))))
+            step = max(1, step)
+            for i in range(0, dset.shape[0], step):
+                h.update(np.ascontiguousarray(dset[i:i+step]).tobytes())
+        return h.hexdigest()
+
+    def get_attr_str(attrs):
+        attrs = dict(attrs)
+        attrs.pop('MODIFICATION_TIME', None)
+        return str(sorted([(k, str(v)) for k, v in attrs.items()]))
+
+    def get_file_stamp(fname, block_size=1024**2):
+        # any write into the file, e.g. via h5py, changes its modification time and/or content,
+        # while the dataset attributes as MODIFICATION_TIME are not always updated.
+        fstat = os.stat(fname)
+        hf = hashlib.md5()
+        with open(fname, 'rb') as f:
+            hf.update(f.read(block_size))
+            f.seek(max(0, fstat.st_size - block_size))
+            hf.update(f.read(block_size))
+        return '{}_{}_{}'.format(fstat.st_size, fstat.st_mtime_ns, hf.hexdigest())
+
+    if hash_cache is None:
+        hash_cache = {}
+    file_stamp = get_file_stamp(fname)
+
+    h = hashlib.md5()
+    if os.path.splitext(fname)[1] in ['.h5', '.he5']:
+        with h5py.File(fname, 'r') as f:
+            h.update(get_attr_str(f.attrs).encode('utf-8'))
+
+            if datasetNames is None:
+                datasetNames = []
+                f.visititems(lambda name, obj: datasetNames.append(name) if isinstance(obj, h5py.Dataset) else None)
+
+            for dsName in datasetNames:
+                h.update(dsName.encode('utf-8'))
+                if dsName not in f:
+                    continue
+                dset = f[dsName]
+                h.update('{}{}{}'.format(dset.shape, dset.dtype, get_attr_str(dset.attrs)).encode('utf-8'))
+
+                # data hash, re-use the cached one if the file is not modified
+                key = '{}:{}'.format(os.path.normpath(fname), dsName)
+                if keep_data_hash and key in hash_cache.keys():
+                    hash_cache[key]['stamp'] = file_stamp
+                elif hash_cache.get(key, {}).get('stamp', None) != file_stamp:
+                    hash_cache[key] = {'stamp': file_stamp, 'hash': get_data_hash(dset)}
+                h.update(hash_cache[key]['hash'].encode('utf-8'))
+
+    else:
+        key = os.path.normpath(fname)
+        if hash_cache.get(key, {}).get('stamp', None) != file_stamp:
+            hf = hashlib.md5()
+            with open(fname, 'rb') as f:
+                for block in iter(lambda: f.read(int(max_memory * 1024**3)), b''):
+                    hf.update(block)
+            hash_cache[key] = {'stamp': file_stamp, 'hash': hf.hexdigest()}
+        h.update(hash_cache[key]['hash'].encode('utf-8'))
+    return h.hexdigest()
+
+
 def check_template_auto_value(templateDict, auto_file='../defaults/smallbaselineApp_auto.cfg'):
     """Replace auto value based on the input auto config file."""
     # Read default template value and turn yes/no to True/False
@@ -10,11 +10,11 @@
 import os
 import h5py
 import numpy as np
-from mintpy.objects import timeseries
+from mintpy.objects import timeseries, chunk_shape4layout
 from mintpy.utils import readfile
 
 
-def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None):
+def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None, chunk_layout=None):
     """ Write one file.
     Parameters: datasetDict : dict of dataset, with key = datasetName and value = 2D/3D array, e.g.:
                     {'height'        : np.ones((   200,300), dtype=np.int16),
@@ -25,6 +25,7 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
                 metadata : dict of attributes
                 ref_file : str, reference file to get auxliary info
                 compression : str, compression while writing to HDF5 file, None, "lzf", "gzip"
+                chunk_layout : str, chunk layout while writing to HDF5 file, auto/image/pixel or (z,y,x)
     Returns:    out_file : str
     Examples:   dsDict = dict()
                 dsDict['velocity'] = np.ones((200,300), dtype=np.float32)
@@ -49,6 +50,7 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
     if ext in ['.h5', '.he5']:
         if compression is None and ref_file:
             compression = readfile.get_hdf5_compression(ref_file)
+        readfile.clear_cache(out_file)
 
         k = meta['FILE_TYPE']
         if k == 'timeseries':
@@ -58,7 +60,8 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
             obj.write2hdf5(datasetDict[k],
                            metadata=meta,
                            refFile=ref_file,
-                           compression=compression)
+                           compression=compression,
+                           chunk_layout=chunk_layout)
 
         else:
             if os.path.isfile(out_file):
@@ -79,7 +82,9 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
                                                           c=compression))
                     ds = f.create_dataset(dsName,
                                           data=data,
-                                          chunks=True,
+                                          chunks=chunk_shape4layout(data.shape,
+                                                                    layout=chunk_layout,
+                                                                    dtype=data.dtype),
                                           compression=compression)
 
                 # 2. Write extra/auxliary datasets from ref_file
@@ -162,6 +167,136 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
     return out_file
 
 
+def layout_hdf5(fname, ds_name_dict=None, metadata=None, ref_file=None, compression=None,
+                chunk_layout=None, print_msg=True):
+    """Create HDF5 file with defined metadata and (empty) dataset structure,
+    to be filled up block by block with write_hdf5_block() afterwards.
+
+    Parameters: fname        : str, HDF5 file path
+                ds_name_dict : dict, dataset structure definition, e.g.:
+                               {dname : [dtype, dshape],
+                                dname : [dtype, dshape, data],
+                                ...}
+                               with data (optional) written right away, i.e. for small datasets.
+                               Use the structure of all datasets of ref_file if not specified.
+                metadata     : dict, metadata
+                ref_file     : str, reference HDF5 file for metadata and the auxliary datasets,
+                               i.e. the 1D date/bperp datasets, to copy from.
+                compression  : str, HDF5 compression type
+                chunk_layout : str, HDF5 chunk layout of 2D/3D datasets, auto/image/pixel or (z,y,x)
+                print_msg    : bool
+    Returns:    fname        : str
+    Example:    ds_name_dict = {'timeseries' : [np.float32, (num_date, length, width)],
+                                'date'       : [np.dtype('S8'), (num_date,), date_list_utf8]}
+                layout_hdf5('timeseries_demErr.h5', ds_name_dict, metadata=atr)
+                layout_hdf5('timeseries_demErr.h5', ref_file='timeseries.h5')
+    """
+    # metadata
+    if metadata:
+        meta = {key: value for key, value in metadata.items()}
+    elif ref_file:
+        meta = readfile.read_attribute(ref_file)
+    else:
+        raise ValueError('No metadata or reference file input.')
+
+    # dataset structure from the reference file
+    ref_h5 = ref_file and os.path.splitext(ref_file)[1] in ['.h5', '.he5']
+    if ds_name_dict is None:
+        if not ref_h5:
+            raise ValueError('No dataset structure or HDF5 reference file input.')
+        with h5py.File(ref_file, 'r') as fr:
+            ds_name_dict = {key: [fr[key].dtype, fr[key].shape] for key in fr.keys()
+                            if isinstance(fr[key], h5py.Dataset)}
+    if compression is None and ref_h5:
+        compression = readfile.get_hdf5_compression(ref_file)
+
+    readfile.clear_cache(fname)
+    if os.path.isfile(fname):
+        if print_msg:
+            print('delete exsited file: {}'.format(fname))
+        os.remove(fname)
+
+    if print_msg:
+        print('-'*50)
+        print('create HDF5 file: {} with w mode'.format(fname))
+    with h5py.File(fname, 'w') as f:
+        # 1. datasets defined in ds_name_dict
+        maxDigit = max([len(i) for i in ds_name_dict.keys()])
+        for key, value in ds_name_dict.items():
+            dtype, shape = value[0], value[1]
+            data = value[2] if len(value) > 2 else None
+            if print_msg:
+                print(('create dataset /{d:<{w}} of {t:<25} in size of {s:<20} '
+                       'with compression={c}').format(d=key, w=maxDigit, t=str(np.dtype(dtype)),
+                                                      s=str(shape), c=compression))
+            f.create_dataset(key,
+                             shape=shape,
+                             dtype=dtype,
+                             data=data,
+                             chunks=chunk_shape4layout(shape, layout=chunk_layout, dtype=dtype),
+                             compression=compression)
+
+        # 2. auxliary datasets from ref_file
+        if ref_h5:
+            atr_ref = readfile.read_attribute(ref_file)
+            shape_ref = (int(atr_ref['LENGTH']), int(atr_ref['WIDTH']))
+            with h5py.File(ref_file, 'r') as fr:
+                for key in [i for i in fr.keys()
+                            if (i not in ds_name_dict.keys()
+                                and isinstance(fr[i], h5py.Dataset)
+                                and fr[i].shape[-2:] != shape_ref)]:
+                    if print_msg:
+                        print('create dataset /{d:<{w}} of {t:<25} in size of {s:<20} from {f}'.format(
+                            d=key, w=maxDigit, t=str(fr[key].dtype), s=str(fr[key].shape),
+                            f=os.path.basename(ref_file)))
+                    f.create_dataset(key, data=fr[key][:], chunks=True, compression=compression)
+
+        # 3. metadata
+        for key, value in meta.items():
+            f.attrs[key] = str(value)
+
+    if print_msg:
+        print('close  HDF5 file: {}'.format(fname))
+    return fname
+
+
+def write_hdf5_block(fname, data, datasetName, block=None, mode='a', print_msg=True):
+    """Write data to an existing HDF5 dataset in disk block by block.
+    Parameters: fname       : str, HDF5 file path
+                data        : np.ndarray 1/2/3D matrix
+                datasetName : str, dataset name
+                block       : list of 2/4/6 int, for
+                              [zStart, zEnd,
+                               yStart, yEnd,
+                               xStart, xEnd]
+                              write the whole dataset if not specified
+                mode        : str, open mode
+                print_msg   : bool
+    Returns:    fname       : str
+    """
+    readfile.clear_cache(fname)
+    with h5py.File(fname, mode) as f:
+        if block is None:
+            block = []
+            for num in f[datasetName].shape:
+                block += [0, num]
+
+        if print_msg:
+            print('writing dataset /{:<25} block: {}'.format(datasetName, block))
+        if len(block) == 6:
+            f[datasetName][block[0]:block[1],
+                           block[2]:block[3],
+                           block[4]:block[5]] = data
+
+        elif len(block) == 4:
+            f[datasetName][block[0]:block[1],
+                           block[2]:block[3]] = data
+
+        elif len(block) == 2:
+            f[datasetName][block[0]:block[1]] = data
+    return fname
+
+
 def remove_hdf5_dataset(fname, datasetNames, print_msg=True):
     """Remove an existing dataset from an HDF5 file.
     Parameters: fname : str, HDF5 file name/path
@@ -176,6 +311,7 @@ def remove_hdf5_dataset(fname, datasetNames, print_msg=True):
     if print_msg:
         print('delete {} from file {}'.format(datasetNames, fname))
     # 1. rename the file to a temporary file
+    readfile.clear_cache(fname)
     temp_file = os.path.join(os.path.dirname(fname), 'tmp_{}'.format(os.path.basename(fname)))
     cmd = 'mv {} {}'.format(fname, temp_file)
     print(cmd)
@@ -11,6 +11,7 @@
 import os
 import sys
 import argparse
+import functools
 import datetime as dt
 import numpy as np
 import matplotlib.pyplot as plt
@@ -29,6 +30,7 @@ from mintpy.objects import (
     timeseries,
 )
 from mintpy.objects.gps import GPS
+from mintpy.objects.overview import overview
 from mintpy.utils import ptime, readfile, utils as ut, plot as pp
 from mintpy.multilook import multilook_data
 from mintpy import subset, version
@@ -216,6 +218,31 @@ def check_multilook_input(pixel_box, row_num, col_num):
     return multilook, multilook_num
 
 
+def prepare_overview(fname, box, ovr_mode='no', out_shape=None, multilook_num=None, print_msg=True):
+    """Prepare the overview pyramid of the input file for display
+    Parameters: fname         : str, path of the data file
+                box           : tuple of 4 int, (x0, y0, x1, y1) of the area to display
+                ovr_mode      : str, no / yes / build
+                out_shape     : tuple of 2 int, min (length, width) in pixels to display
+                multilook_num : int, number of looks for display
+    Returns:    ovr_obj       : overview object or None
+                ovr_level     : int, level of the overview to read, 1 for the full resolution
+    """
+    if ovr_mode == 'no' or os.path.splitext(fname)[1] not in ['.h5', '.he5']:
+        return None, 1
+
+    ovr_obj = overview(fname)
+    if not ovr_obj.level_list:
+        return None, 1
+    if ovr_mode == 'build':
+        ovr_obj.build(print_msg=print_msg)
+
+    ovr_level = ovr_obj.select_level(box, out_shape=out_shape, multilook_num=multilook_num)
+    if ovr_level > 1 and print_msg:
+        print('use overview in level {} for display: {}'.format(ovr_level, ovr_obj.get_level_file(ovr_level)))
+    return ovr_obj, ovr_level
+
+
 ##################################################################################################
 def update_inps_with_display_setting_file(inps, disp_set_file):
     """Update inps using values from display setting file"""
@@ -420,6 +447,9 @@ def plot_slice(ax, data, metadata, inps=None):
 
     #----------------------- Plot in Geo-coordinate --------------------------------------------#
     num_row, num_col = data.shape
+    # number of looks of data relative to the box in full resolution, e.g. read from overviews
+    lks_y = max(1, (inps.pix_box[3] - inps.pix_box[1]) // num_row)
+    lks_x = max(1, (inps.pix_box[2] - inps.pix_box[0]) // num_col)
     if inps.geo_box and inps.fig_coord == 'geo':
         coord_unit = metadata.get('Y_UNIT', 'degrees').lower()
 
@@ -448,7 +478,7 @@ def plot_slice(ax, data, metadata, inps=None):
                 y, x = coord.geo2radar(ref_site_lalo[0], ref_site_lalo[1])[0:2]
                 y -= inps.pix_box[1]
                 x -= inps.pix_box[0]
-                data -= data[y, x]
+                data -= data[y // lks_y, x // lks_x]
                 vprint(('referencing InSAR data to the pixel nearest to '
                         'GPS station: {} at {}').format(inps.ref_gps_site, ref_site_lalo))
 
@@ -506,8 +536,8 @@ def plot_slice(ax, data, metadata, inps=None):
                 msg = 'lon={:.4f}, lat={:.4f}'.format(x, y)
                 col = coord.lalo2yx(x, coord_type='lon') - inps.pix_box[0]
                 row = coord.lalo2yx(y, coord_type='lat') - inps.pix_box[1]
-                if 0 <= col < num_col and 0 <= row < num_row:
-                    v = data[row, col]
+                if 0 <= col < num_col * lks_x and 0 <= row < num_row * lks_y:
+                    v = data[row // lks_y, col // lks_x]
                     if np.isnan(v) or np.ma.is_masked(v):
                         msg += ', v=[]'
                     else:
@@ -557,8 +587,8 @@ def plot_slice(ax, data, metadata, inps=None):
                 msg = 'x={:.1f}, y={:.1f}'.format(x, y)
                 col = int(np.rint((x - inps.geo_box[0]) / float(metadata['X_STEP'])))
                 row = int(np.rint((y - inps.geo_box[1]) / float(metadata['Y_STEP'])))
-                if 0 <= col < num_col and 0 <= row < num_row:
-                    v = data[row, col]
+                if 0 <= col < num_col * lks_x and 0 <= row < num_row * lks_y:
+                    v = data[row // lks_y, col // lks_x]
                     msg += ', v={:.3f}'.format(v)
                     if inps.dem_file:
                         h = dem[row, col]
@@ -615,8 +645,8 @@ def plot_slice(ax, data, metadata, inps=None):
             msg = 'x={:.1f}, y={:.1f}'.format(x, y)
             col = int(np.rint(x - inps.pix_box[0]))
             row = int(np.rint(y - inps.pix_box[1]))
-            if 0 <= col < num_col and 0 <= row < num_row:
-                v = data[row, col]
+            if 0 <= col < num_col * lks_x and 0 <= row < num_row * lks_y:
+                v = data[row // lks_y, col // lks_x]
                 msg += ', v={:.3f}'.format(v)
                 if inps.dem_file:
                     h = dem[row, col]
@@ -885,16 +915,23 @@ def update_figure_setting(inps):
 
 def read_data4figure(i_start, i_end, inps, metadata):
     """Read multiple datasets for one figure into 3D matrix based on i_start/end"""
+    # read from the overview in the level of the multilook number if available
+    lks = inps.ovr_level
+    if lks > 1:
+        read_func = functools.partial(inps.ovr_obj.read, lks)
+    else:
+        read_func = functools.partial(readfile.read, inps.file)
+
     data = np.zeros((i_end - i_start,
-                     inps.pix_box[3] - inps.pix_box[1],
-                     inps.pix_box[2] - inps.pix_box[0]))
+                     (inps.pix_box[3] - inps.pix_box[1]) // lks,
+                     (inps.pix_box[2] - inps.pix_box[0]) // lks))
 
     # fast reading for single dataset type
     if (len(inps.dsetFamilyList) == 1
             and inps.key in ['timeseries', 'giantTimeseries', 'ifgramStack', 'HDFEOS', 'geometry']):
         vprint('reading data as a 3D matrix ...')
         dset_list = [inps.dset[i] for i in range(i_start, i_end)]
-        data[:] = readfile.read(inps.file, datasetName=dset_list, box=inps.pix_box)[0]
+        data[:] = read_func(datasetName=dset_list, box=inps.pix_box)[0]
 
         if inps.key == 'ifgramStack':
             # reference pixel info in unwrapPhase
@@ -910,22 +947,21 @@ def read_data4figure(i_start, i_end, inps, metadata):
     else:
         vprint('reading data as a list of 2D matrices ...')
         prog_bar = ptime.progressBar(maxValue=i_end-i_start, print_msg=inps.print_msg)
-        for i in range(i_start, i_end):
-            d = readfile.read(inps.file,
-                              datasetName=inps.dset[i],
+        with readfile.keep_file_open():
+            for i in range(i_start, i_end):
+                d = read_func(datasetName=inps.dset[i],
                               box=inps.pix_box,
                               print_msg=False)[0]
-            data[i - i_start, :, :] = d
-            prog_bar.update(i - i_start + 1, suffix=inps.dset[i].split('/')[-1])
+                data[i - i_start, :, :] = d
+                prog_bar.update(i - i_start + 1, suffix=inps.dset[i].split('/')[-1])
         prog_bar.close()
 
     # ref_date for timeseries
     if inps.ref_date:
         vprint('consider input reference date: '+inps.ref_date)
-        ref_data = readfile.read(inps.file,
-                                 datasetName=inps.ref_date,
-                                 box=inps.pix_box,
-                                 print_msg=False)[0]
+        ref_data = read_func(datasetName=inps.ref_date,
+                             box=inps.pix_box,
+                             print_msg=False)[0]
         data -= ref_data
 
     # v/dlim, adjust data if all subplots share the same unit
@@ -944,14 +980,15 @@ def read_data4figure(i_start, i_end, inps, metadata):
         if (not inps.vlim
                 and not (inps.dsetFamilyList[0].startswith('unwrap') and not inps.file_ref_yx)
                 and inps.dsetFamilyList[0] not in ['bperp']):
-            data_mli = multilook_data(data, 10, 10)
+            # 10 by 10 looks relative to the full resolution
+            data_mli = multilook_data(data, max(1, 10 // lks), max(1, 10 // lks))
             inps.vlim = [np.nanmin(data_mli), np.nanmax(data_mli)]
             del data_mli
     inps.dlim = [np.nanmin(data), np.nanmax(data)]
 
-    # multilook
-    if inps.multilook:
-        data = multilook_data(data, inps.multilook_num, inps.multilook_num)
+    # multilook, unless read from the overview
+    if inps.multilook and inps.multilook_num // lks > 1:
+        data = multilook_data(data, inps.multilook_num // lks, inps.multilook_num // lks)
 
     # mask
     if inps.msk is not None:
@@ -1159,6 +1196,14 @@ def prepare4multi_subplots(inps, metadata):
         if inps.msk is not None:
             inps.msk = multilook_data(inps.msk, inps.multilook_num, inps.multilook_num)
 
+    # Overview in the level of the multilook number
+    inps.ovr_obj, inps.ovr_level = None, 1
+    if inps.multilook and inps.multilook_num > 1:
+        inps.ovr_obj, inps.ovr_level = prepare_overview(inps.file, inps.pix_box,
+                                                        ovr_mode=inps.overview,
+                                                        multilook_num=inps.multilook_num,
+                                                        print_msg=inps.print_msg)
+
     # Reference pixel for timeseries and ifgramStack
     #metadata = readfile.read_attribute(inps.file)
     inps.file_ref_yx = None